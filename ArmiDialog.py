@@ -1,4 +1,3 @@
-import sqlite3
 import traceback
 from PyQt5.QtWidgets import (
     QDialog, QTabWidget, QWidget, QVBoxLayout, QFormLayout, QLineEdit,
@@ -6,8 +5,11 @@ from PyQt5.QtWidgets import (
     QLabel, QSizePolicy, QComboBox, QMessageBox, QInputDialog, QDateEdit, QCheckBox,
 )
 from PyQt5.QtCore import QDate, Qt
-from Utility import convert_all_lineedits_to_uppercase, DateInputWidget
+from Utility import convert_all_lineedits_to_uppercase, DateInputWidget, qdate_da_db, qdate_per_db
 from TransferimentoDialog import TransferimentoDialog
+from Database import DatabaseManager, ArmiRepository, DetentoriRepository, TrasferimentiRepository
+from RicercaMatricole import registra_matricole
+from Avvio import risultato_avvio
 
 
 class ArmaDialog(QDialog):
@@ -18,31 +20,9 @@ class ArmaDialog(QDialog):
         """
         super().__init__()
 
-        # Se arma_data esiste, verifichiamo se contiene il campo DataAcquisto
-        if arma_data and 'DataAcquisto' not in arma_data:
-            # Recuperiamo direttamente il valore dal database
-            try:
-                conn = sqlite3.connect("gestione_armi.db")
-                cursor = conn.cursor()
-                cursor.execute("SELECT DataAcquisto FROM armi WHERE ID_ArmaDetenuta = ?",
-                               (arma_data['ID_ArmaDetenuta'],))
-                data_acquisto = cursor.fetchone()
-                if data_acquisto:
-                    # Aggiungiamo il campo al dizionario
-                    arma_data['DataAcquisto'] = data_acquisto[0] if data_acquisto[0] is not None else ''
-                else:
-                    arma_data['DataAcquisto'] = ''
-            except Exception as e:
-                print(f"Errore nel recupero della data di acquisto: {e}")
-                arma_data['DataAcquisto'] = ''
-            finally:
-                if conn:
-                    conn.close()
-
-        # NUOVA PARTE: Verifica dei campi del luogo di detenzione
+        # Se arma_data esiste, verifichiamo che contenga la data di acquisto e i campi del luogo di detenzione
         if arma_data:
-            # Lista dei campi del luogo di detenzione
-            campi_detenzione = ['ComuneDetenzione', 'ProvinciaDetenzione', 'TipoViaDetenzione',
+            campi_detenzione = ['DataAcquisto', 'ComuneDetenzione', 'ProvinciaDetenzione', 'TipoViaDetenzione',
                                 'IndirizzoDetenzione', 'CivicoDetenzione', 'NoteDetenzione']
 
             # Verifica se mancano campi
@@ -51,33 +31,16 @@ class ArmaDialog(QDialog):
             if campi_mancanti:
                 print(f"Campi detenzione mancanti: {campi_mancanti}")
                 try:
-                    conn = sqlite3.connect("gestione_armi.db")
-                    cursor = conn.cursor()
-
-                    # Costruisci la query per selezionare i campi mancanti
-                    select_fields = ', '.join(campi_mancanti)
-                    cursor.execute(f"SELECT {select_fields} FROM armi WHERE ID_ArmaDetenuta = ?",
-                                   (arma_data['ID_ArmaDetenuta'],))
-
-                    risultati = cursor.fetchone()
-
-                    # Aggiungi i valori al dizionario arma_data
-                    if risultati:
-                        for i, campo in enumerate(campi_mancanti):
-                            arma_data[campo] = risultati[i] if risultati[i] is not None else ''
-                            print(f"Recuperato {campo}: {arma_data[campo]}")
-                    else:
-                        for campo in campi_mancanti:
-                            arma_data[campo] = ''
+                    # Recupera tutti i campi mancanti con un'unica lettura
+                    risultati = ArmiRepository().get_campi(arma_data['ID_ArmaDetenuta'], campi_mancanti) or {}
+                    for campo in campi_mancanti:
+                        valore = risultati.get(campo)
+                        arma_data[campo] = valore if valore is not None else ''
                 except Exception as e:
                     print(f"Errore nel recupero dei dati del luogo di detenzione: {e}")
-                    import traceback
                     traceback.print_exc()
                     for campo in campi_mancanti:
                         arma_data[campo] = ''
-                finally:
-                    if conn:
-                        conn.close()
 
         self.arma_data = arma_data
         self.detentore_id = detentore_id
@@ -139,7 +102,8 @@ class ArmaDialog(QDialog):
         # Marca Arma - ComboBox
         self.marcaArmaEdit = QComboBox()
         self.marcaArmaEdit.setEditable(True)
-        self.load_marche_from_db()
+        # La prima finestra usa le marche lette all'avvio, le successive le rileggono
+        self.load_marche_from_db(risultato_avvio("marche"))
 
         self.modelloArmaEdit = QLineEdit()
         self.tipologiaArmaEdit = QLineEdit()
@@ -287,33 +251,18 @@ class ArmaDialog(QDialog):
         for caricamento in caricamenti:
             self.caricamentoArmaEdit.addItem(caricamento)
 
-    def load_marche_from_db(self):
-        """Carica le marche dal database nella combobox"""
+    def load_marche_from_db(self, marche=None):
+        """Carica le marche dal database nella combobox (o quelle già lette, se fornite)"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Assicuriamoci che la tabella esista
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS marche_armi (
-                    ID_MarcaArma INTEGER PRIMARY KEY AUTOINCREMENT,
-                    NomeMarca TEXT NOT NULL UNIQUE,
-                    StatoProduzione TEXT
-                )
-            """)
-            conn.commit()
-
-            cursor.execute("SELECT NomeMarca FROM marche_armi ORDER BY NomeMarca")
-            marche = cursor.fetchall()
+            if marche is None:
+                marche = ArmiRepository().lista_marche()
 
             self.marcaArmaEdit.clear()
             for marca in marche:
-                self.marcaArmaEdit.addItem(marca[0])
+                self.marcaArmaEdit.addItem(marca)
 
         except Exception as e:
             print("Errore durante il caricamento delle marche:", e)
-        finally:
-            conn.close()
 
     def create_arma_identification_group(self):
         """Crea il gruppo per i dati identificativi dell'arma"""
@@ -514,18 +463,8 @@ class ArmaDialog(QDialog):
                 self.ugualeResidenzaCheck.setChecked(False)
                 return
 
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Recupera i dati della residenza del detentore dal database usando i nomi corretti delle colonne
-            cursor.execute("""
-                SELECT ComuneResidenza, SiglaProvinciaResidenza, TipoVia,
-                       Via, Civico
-                FROM detentori
-                WHERE ID_Detentore = ?
-            """, (self.detentore_id,))
-
-            result = cursor.fetchone()
+            # Recupera i dati della residenza del detentore dal database
+            result = DetentoriRepository().get_residenza(self.detentore_id)
 
             if result:
                 # Copia i dati nei campi del luogo di detenzione
@@ -549,9 +488,7 @@ class ArmaDialog(QDialog):
             import traceback
             traceback.print_exc()
             self.ugualeResidenzaCheck.setChecked(False)
-        finally:
-            if conn:
-                conn.close()
+
     def on_detenzione_field_changed(self):
         """
         Gestisce i cambiamenti nei campi del luogo di detenzione.
@@ -740,36 +677,24 @@ class ArmaDialog(QDialog):
             return
 
         # Verifica se il testo è già presente nel database
-        conn = None
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT StatoProduzione FROM marche_armi WHERE NomeMarca = ?", (upper_text,))
-            result = cursor.fetchone()
+            stato = ArmiRepository().stato_produzione_marca(upper_text)
 
-            if result:
+            if stato is not None:
                 # La marca esiste, carica lo stato produzione
-                self.statoProduzioneArmaEdit.setText(result[0] if result[0] else "")
+                self.statoProduzioneArmaEdit.setText(stato)
         except Exception as e:
             print("Errore nella verifica della marca:", e)
-        finally:
-            if conn:
-                conn.close()
 
     def load_stato_produzione(self, marca):
         """Carica lo stato di produzione associato alla marca selezionata"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT StatoProduzione FROM marche_armi WHERE NomeMarca = ?", (marca,))
-            result = cursor.fetchone()
+            stato = ArmiRepository().stato_produzione_marca(marca)
 
-            if result and result[0]:
-                self.statoProduzioneArmaEdit.setText(result[0])
+            if stato:
+                self.statoProduzioneArmaEdit.setText(stato)
         except Exception as e:
             print("Errore nel caricamento dello stato di produzione:", e)
-        finally:
-            conn.close()
 
     def check_and_add_new_marca(self):
         """Verifica se la marca inserita esiste nel db e, se non esiste, chiede di aggiungerla"""
@@ -779,12 +704,9 @@ class ArmaDialog(QDialog):
             return
 
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM marche_armi WHERE NomeMarca = ?", (marca_text,))
-            count = cursor.fetchone()[0]
+            armi_repo = ArmiRepository()
 
-            if count == 0:
+            if armi_repo.stato_produzione_marca(marca_text) is None:
                 # La marca non esiste, chiedi se aggiungerla
                 reply = QMessageBox.question(
                     self,
@@ -806,11 +728,7 @@ class ArmaDialog(QDialog):
                     if ok:
                         stato_produzione = stato_produzione.upper()
                         # Aggiungi la nuova marca al database
-                        cursor.execute(
-                            "INSERT INTO marche_armi (NomeMarca, StatoProduzione) VALUES (?, ?)",
-                            (marca_text, stato_produzione)
-                        )
-                        conn.commit()
+                        armi_repo.inserisci_marca(marca_text, stato_produzione)
 
                         # Aggiorna la combobox
                         self.load_marche_from_db()
@@ -828,8 +746,6 @@ class ArmaDialog(QDialog):
                     pass
         except Exception as e:
             print("Errore durante il controllo/aggiunta della marca:", e)
-        finally:
-            conn.close()
 
     def populate_fields(self, data):
         """Popola i campi con i dati esistenti"""
@@ -885,24 +801,15 @@ class ArmaDialog(QDialog):
         self.numeroCatalogoEdit.setText(data.get('NumeroCatalogo', ''))
         self.classificazioneEuropeaEdit.setText(data.get('ClassificazioneEuropea', ''))
 
-        # Per i campi data
+        # Per i campi data (salvati come yyyy-MM-dd)
         if 'DataAcquisto' in data and data['DataAcquisto']:
-            try:
-                date_parts = data['DataAcquisto'].split('/')
-                if len(date_parts) == 3:
-                    day, month, year = map(int, date_parts)
-                    self.dataAcquistoEdit.setDate(QDate(year, month, day))
-            except (ValueError, IndexError):
-                self.dataAcquistoEdit.setDate(QDate.currentDate())
+            data_acquisto = qdate_da_db(data['DataAcquisto'])
+            self.dataAcquistoEdit.setDate(data_acquisto if data_acquisto.isValid() else QDate.currentDate())
 
         if 'DataNascitaCedente' in data and data['DataNascitaCedente']:
-            try:
-                date_parts = data['DataNascitaCedente'].split('/')
-                if len(date_parts) == 3:
-                    day, month, year = map(int, date_parts)
-                    self.dataNascitaCedenteEdit.setDate(QDate(year, month, day))
-            except (ValueError, IndexError):
-                self.dataNascitaCedenteEdit.setDate(QDate.currentDate().addYears(-18))
+            data_nascita = qdate_da_db(data['DataNascitaCedente'])
+            self.dataNascitaCedenteEdit.setDate(
+                data_nascita if data_nascita.isValid() else QDate.currentDate().addYears(-18))
 
         # Imposta il tipo di cedente e aggiorna l'interfaccia
         tipo_cedente = data.get('TipoCedente', '')
@@ -938,25 +845,20 @@ class ArmaDialog(QDialog):
             if not self.detentore_id:
                 return False
 
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
             # Ottieni i dati del detentore attuale
-            cursor.execute("""
-                SELECT Cognome, Nome, DataNascita, LuogoNascita, SiglaProvinciaNascita, 
-                       ComuneResidenza, SiglaProvinciaResidenza, TipoViaResidenza, 
-                       IndirizzoResidenza, CivicoResidenza, Telefono
+            detentore = DatabaseManager().fetchone("""
+                SELECT Cognome, Nome, DataNascita, LuogoNascita, SiglaProvinciaNascita,
+                       ComuneResidenza, SiglaProvinciaResidenza, TipoVia,
+                       Via, Civico, Telefono
                 FROM detentori
                 WHERE ID_Detentore = ?
             """, (self.detentore_id,))
 
-            detentore = cursor.fetchone()
-
             if not detentore:
                 return False
 
             # Aggiorna i dati del cedente nell'arma con quelli del detentore attuale
-            cursor.execute("""
+            DatabaseManager().esegui_scrittura(lambda conn: conn.execute("""
                 UPDATE armi
                 SET CognomeCedente = ?,
                     NomeCedente = ?,
@@ -984,18 +886,14 @@ class ArmaDialog(QDialog):
                 detentore[9],  # CivicoResidenza
                 detentore[10],  # Telefono
                 self.arma_data['ID_ArmaDetenuta']
-            ))
+            )))
 
             print(f"Tipo cedente impostato a PERSONA FISICA per l'arma {self.arma_data['ID_ArmaDetenuta']}")
-            conn.commit()
             return True
 
         except Exception as e:
             print(f"Errore nell'aggiornamento dei dati del cedente: {e}")
             return False
-        finally:
-            if conn:
-                conn.close()
 
     def save_arma(self):
         """Salva i dati dell'arma nel database"""
@@ -1011,9 +909,6 @@ class ArmaDialog(QDialog):
             if self.arma_data is None and self.detentore_id is None:
                 raise ValueError("ID_Detentore non valorizzato. Impossibile salvare l'arma.")
 
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
             # Raccolta dati dal form
             tipoArma = self.tipoArmaEdit.currentText()
             marcaArma = self.marcaArmaEdit.currentText()
@@ -1042,7 +937,7 @@ class ArmaDialog(QDialog):
             print(f"[DEBUG] numeroCatalogo = '{numeroCatalogo}', classificazioneEuropea = '{classificazioneEuropea}'")
             cognomeCedente = self.cognomeCedenteEdit.text()
             nomeCedente = self.nomeCedenteEdit.text()
-            dataNascitaCedente = self.dataNascitaCedenteEdit.date().toString("dd/MM/yyyy")
+            dataNascitaCedente = qdate_per_db(self.dataNascitaCedenteEdit.date())
             luogoNascitaCedente = self.luogoNascitaCedenteEdit.text()
             siglaProvinciaResidenzaCedente = self.siglaProvinciaResidenzaCedenteEdit.text()
             comuneResidenzaCedente = self.comuneResidenzaCedenteEdit.text()
@@ -1051,7 +946,7 @@ class ArmaDialog(QDialog):
             indirizzoResidenzaCedente = self.indirizzoResidenzaCedenteEdit.text()
             civicoResidenzaCedente = self.civicoResidenzaCedenteEdit.text()
             telefonoCedente = self.telefonoCedenteEdit.text()
-            dataAcquisto = self.dataAcquistoEdit.date().toString("dd/MM/yyyy")
+            dataAcquisto = qdate_per_db(self.dataAcquistoEdit.date())
             comuneDetenzione = self.comuneDetenzioneEdit.text()
             provinciaDetenzione = self.provinciaDetenzioneEdit.text()
             tipoViaDetenzione = self.tipoViaDetenzioneEdit.text()
@@ -1061,7 +956,7 @@ class ArmaDialog(QDialog):
 
             # Se esiste un ID_ArmaDetenuta, faccio UPDATE
             if self.arma_data and self.arma_data.get('ID_ArmaDetenuta'):
-                cursor.execute("""
+                sql = """
                     UPDATE armi
                     SET TipoArma=?, MarcaArma=?, ModelloArma=?, TipologiaArma=?, Matricola=?, CalibroArma=?,
                         MatricolaCanna=?, LunghezzaCanna=?, NumeroCanne=?, ArmaLungaCorta=?, TipoCanna=?,
@@ -1074,7 +969,8 @@ class ArmaDialog(QDialog):
                         ProvinciaDetenzione=?, TipoViaDetenzione=?, IndirizzoDetenzione=?, CivicoDetenzione=?,
                         NoteDetenzione=?
                     WHERE ID_ArmaDetenuta=?
-                """, (
+                """
+                params = (
                     tipoArma, marcaArma, modelloArma, tipologiaArma, matricola, calibroArma,
                     matricolaCanna, lunghezzaCanna, numeroCanne, armaLungaCorta, tipoCanna,
                     categoriaArma, funzionamentoArma, caricamentoArma, punzoniArma, statoProduzioneArma,
@@ -1085,7 +981,7 @@ class ArmaDialog(QDialog):
                     civicoResidenzaCedente, telefonoCedente, dataAcquisto, comuneDetenzione,
                     provinciaDetenzione, tipoViaDetenzione, indirizzoDetenzione, civicoDetenzione,
                     noteDetenzione, self.arma_data.get('ID_ArmaDetenuta')
-                ))
+                )
             else:
                 # Nuovo record: INSERT dinamico per mantenere cols/params allineati
                 cols = [
@@ -1118,18 +1014,17 @@ class ArmaDialog(QDialog):
                 ]
                 print(f"[DEBUG] SQL: {sql}")
                 print(f"[DEBUG] params ({len(params)}): {params}")
-                cursor.execute(sql, params)
 
-            conn.commit()
+            # La scrittura passa dal DatabaseManager (coda unica e retry in modalità multi-postazione)
+            DatabaseManager().esegui_scrittura(lambda conn: conn.execute(sql, params))
+            # Le matricole modificate non vengono rilette dall'aggiornamento incrementale dell'indice
+            registra_matricole(matricola, matricolaCanna)
             QMessageBox.information(self, "Successo", "Arma salvata con successo!")
         except Exception as e:
             print(f"ERRORE durante il salvataggio: {e}")
             traceback.print_exc()
             QMessageBox.critical(self, "Errore", f"Errore durante il salvataggio:\n{e}")
             return False
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
         self.accept()
         return True
@@ -1214,68 +1109,16 @@ class ArmaDialog(QDialog):
                 # Ottieni il motivo completo formattato
                 motivo_completo = dialogo_motivo.get_motivo_completo()
 
-                conn = None
                 try:
-                    conn = sqlite3.connect("gestione_armi.db")
-                    cursor = conn.cursor()
-
-                    # Ottieni i dettagli dell'arma prima dell'eliminazione
-                    arma_id = self.arma_data.get('ID_ArmaDetenuta')
-                    detentore_id = self.detentore_id
-
-                    # Recupera i dati del detentore (cedente)
-                    cursor.execute("""
-                        SELECT Cognome, Nome, CodiceFiscale 
-                        FROM detentori 
-                        WHERE ID_Detentore = ?
-                    """, (detentore_id,))
-                    detentore_data = cursor.fetchone()
-
-                    # Recupera tutti i dati dell'arma
-                    cursor.execute("""
-                        SELECT TipoArma, MarcaArma, ModelloArma, Matricola, CalibroArma
-                        FROM armi 
-                        WHERE ID_ArmaDetenuta = ?
-                    """, (arma_id,))
-                    arma_details = cursor.fetchone()
-
                     # Ottieni la data corrente per il trasferimento
                     from PyQt5.QtCore import QDate, QDateTime
                     data_trasferimento = QDate.currentDate().toString("yyyy-MM-dd")
                     timestamp = QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
 
-                    # Prepara la nota con il motivo fornito dall'utente
-                    note = motivo_completo
-
-                    # Registra l'eliminazione nella tabella trasferimenti
-                    cursor.execute("""
-                        INSERT INTO trasferimenti 
-                        (ID_Arma, ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento, 
-                         Motivo_Trasferimento, Note, Timestamp_Registrazione,
-                         MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma,
-                         Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        arma_id,  # ID_Arma
-                        detentore_id,  # ID_Detentore_Cedente
-                        -1,  # ID_Detentore_Ricevente (usiamo -1 come valore speciale per "eliminato")
-                        data_trasferimento,  # Data_Trasferimento
-                        "ELIMINAZIONE",  # Motivo_Trasferimento
-                        note,  # Note (con il motivo completo)
-                        timestamp,  # Timestamp_Registrazione
-                        arma_details[1] if arma_details else self.arma_data.get('MarcaArma', ''),  # MarcaArma
-                        arma_details[2] if arma_details else self.arma_data.get('ModelloArma', ''),  # ModelloArma
-                        arma_details[3] if arma_details else self.arma_data.get('Matricola', ''),  # Matricola
-                        arma_details[4] if arma_details else self.arma_data.get('CalibroArma', ''),  # CalibroArma
-                        arma_details[0] if arma_details else self.arma_data.get('TipoArma', ''),  # TipoArma
-                        detentore_data[0] if detentore_data else '',  # Cedente_Cognome
-                        detentore_data[1] if detentore_data else '',  # Cedente_Nome
-                        detentore_data[2] if detentore_data else ''  # Cedente_CodiceFiscale
-                    ))
-
-                    # Ora elimina l'arma
-                    cursor.execute("DELETE FROM armi WHERE ID_ArmaDetenuta = ?", (arma_id,))
-                    conn.commit()
+                    # Registra l'eliminazione nella tabella trasferimenti ed elimina l'arma
+                    TrasferimentiRepository().registra_eliminazione(
+                        self.arma_data.get('ID_ArmaDetenuta'), self.detentore_id, motivo_completo,
+                        data_trasferimento, timestamp, arma_fallback=self.arma_data)
 
                     QMessageBox.information(self, "Eliminazione completata",
                                             f"L'arma è stata eliminata con successo.\nMotivo registrato nello storico.")
@@ -1284,9 +1127,6 @@ class ArmaDialog(QDialog):
                 except Exception as e:
                     QMessageBox.critical(self, "Errore", f"Si è verificato un errore durante l'eliminazione: {str(e)}")
                     print("Errore durante l'eliminazione dell'arma:", e)
-                finally:
-                    if conn:
-                        conn.close()
 class DialogoMotivoEliminazione(QDialog):
     def __init__(self, arma_data=None, detentore_id=None):
         """
@@ -1295,67 +1135,25 @@ class DialogoMotivoEliminazione(QDialog):
         """
         super().__init__()
 
-        # --- Recupero DataAcquisto se manca ---
-        if arma_data and 'DataAcquisto' not in arma_data:
-            try:
-                conn = sqlite3.connect("gestione_armi.db")
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT DataAcquisto FROM armi WHERE ID_ArmaDetenuta = ?",
-                    (arma_data['ID_ArmaDetenuta'],)
-                )
-                row = cursor.fetchone()
-                arma_data['DataAcquisto'] = row[0] if row and row[0] else ''
-            except Exception as e:
-                print(f"Errore recupero DataAcquisto: {e}")
-                arma_data['DataAcquisto'] = ''
-            finally:
-                conn.close()
-
-        # --- Recupero campi luogo di detenzione se mancano ---
+        # Data di acquisto, luogo di detenzione, catalogo e classificazione se mancano
         if arma_data:
-            campi_detenzione = [
-                'ComuneDetenzione', 'ProvinciaDetenzione', 'TipoViaDetenzione',
-                'IndirizzoDetenzione', 'CivicoDetenzione', 'NoteDetenzione'
+            campi_richiesti = [
+                'DataAcquisto', 'ComuneDetenzione', 'ProvinciaDetenzione', 'TipoViaDetenzione',
+                'IndirizzoDetenzione', 'CivicoDetenzione', 'NoteDetenzione',
+                'NumeroCatalogo', 'ClassificazioneEuropea'
             ]
-            mancanti = [c for c in campi_detenzione if c not in arma_data]
+            mancanti = [c for c in campi_richiesti if c not in arma_data]
             if mancanti:
                 try:
-                    conn = sqlite3.connect("gestione_armi.db")
-                    cursor = conn.cursor()
-                    select_fields = ', '.join(mancanti)
-                    cursor.execute(
-                        f"SELECT {select_fields} FROM armi WHERE ID_ArmaDetenuta = ?",
-                        (arma_data['ID_ArmaDetenuta'],)
-                    )
-                    risultati = cursor.fetchone() or []
-                    for i, campo in enumerate(mancanti):
-                        arma_data[campo] = risultati[i] or ''
+                    # Recupera tutti i campi mancanti con un'unica lettura
+                    risultati = ArmiRepository().get_campi(arma_data['ID_ArmaDetenuta'], mancanti) or {}
+                    for campo in mancanti:
+                        valore = risultati.get(campo)
+                        arma_data[campo] = valore if valore is not None else ''
                 except Exception as e:
-                    print(f"Errore recupero luogo detenzione: {e}")
-                finally:
-                    conn.close()
-
-        # --- NUOVO: recupero NumeroCatalogo e ClassificazioneEuropea se mancanti ---
-        if arma_data and (
-                'NumeroCatalogo' not in arma_data or
-                'ClassificazioneEuropea' not in arma_data
-        ):
-            try:
-                conn = sqlite3.connect("gestione_armi.db")
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT NumeroCatalogo, ClassificazioneEuropea FROM armi WHERE ID_ArmaDetenuta = ?",
-                    (arma_data['ID_ArmaDetenuta'],)
-                )
-                row = cursor.fetchone()
-                arma_data['NumeroCatalogo'] = row[0] if row and row[0] else ''
-                arma_data['ClassificazioneEuropea'] = row[1] if row and row[1] else ''
-            except Exception as e:
-                print(f"Errore recupero catalogo/classificazione: {e}")
-                arma_data['NumeroCatalogo'] = arma_data['ClassificazioneEuropea'] = ''
-            finally:
-                conn.close()
+                    print(f"Errore nel recupero dei dati dell'arma: {e}")
+                    for campo in mancanti:
+                        arma_data[campo] = ''
 
         # Resto dell’inizializzazione UI
         self.arma_data = arma_data
@@ -0,0 +1,93 @@
+# Avvio.py
+# Caricamenti eseguiti in background all'avvio: la finestra principale si
+# disegna subito e le finestre attendono i dati solo se non sono ancora pronti
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("Avvio")
+
+
+class CaricamentoAvvio:
+    """
+    Esegue su un unico thread di lavoro, nell'ordine in cui sono richiesti,
+    i caricamenti lenti dell'avvio e ne conserva i Future per nome.
+    Un solo thread basta: i caricamenti usano tutti la stessa connessione
+    SQLite (una per thread, vedi DatabaseManager).
+    """
+
+    def __init__(self):
+        self._esecutore = ThreadPoolExecutor(max_workers=1, thread_name_prefix="avvio")
+        self._futuri: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def avvia(self, nome: str, funzione: Callable[[], Any]) -> Future:
+        def esegui():
+            inizio = time.perf_counter()
+            try:
+                return funzione()
+            except Exception as e:
+                logger.error(f"Caricamento '{nome}' fallito: {e}")
+                raise
+            finally:
+                logger.info(f"Caricamento '{nome}' in {(time.perf_counter() - inizio) * 1000:.0f} ms")
+
+        with self._lock:
+            futuro = self._esecutore.submit(esegui)
+            self._futuri[nome] = futuro
+        return futuro
+
+    def futuro(self, nome: str) -> Optional[Future]:
+        with self._lock:
+            return self._futuri.get(nome)
+
+    def prendi(self, nome: str) -> Optional[Any]:
+        """
+        Risultato di un caricamento già concluso, consegnato una sola volta: chi lo
+        chiede dopo rilegge i dati aggiornati. None se non è pronto o è fallito.
+        """
+        with self._lock:
+            futuro = self._futuri.get(nome)
+            if futuro is None or not futuro.done() or futuro.exception() is not None:
+                return None
+            del self._futuri[nome]
+        return futuro.result()
+
+    def chiudi(self):
+        self._esecutore.shutdown(wait=False, cancel_futures=True)
+
+
+_corrente: Optional[CaricamentoAvvio] = None
+
+
+def avvia_caricamenti() -> CaricamentoAvvio:
+    """
+    Avvia i caricamenti dell'applicazione: catalogo dello schema, comuni e province,
+    marche, indici di ricerca di comuni e province.
+    """
+    global _corrente
+    from Database import DatabaseManager, ArmiRepository
+    from ElencoComuni import ElencoComuni
+
+    avvio = CaricamentoAvvio()
+    # Il catalogo per primo: la prima connessione applica anche le migrazioni
+    avvio.avvia("catalogo", lambda: DatabaseManager().catalogo())
+    avvio.avvia("riferimenti", ElencoComuni.condiviso)
+    avvio.avvia("marche", lambda: ArmiRepository().lista_marche())
+    # Pronti prima che si apra la scheda di un detentore (le combo dei comuni li usano)
+    avvio.avvia("indici", lambda: (ElencoComuni.condiviso().indice_comuni,
+                                   ElencoComuni.condiviso().indice_province))
+    _corrente = avvio
+    return avvio
+
+
+def caricamento_avvio() -> Optional[CaricamentoAvvio]:
+    return _corrente
+
+
+def risultato_avvio(nome: str) -> Optional[Any]:
+    """Scorciatoia per CaricamentoAvvio.prendi sui caricamenti correnti (None se non avviati)."""
+    return _corrente.prendi(nome) if _corrente is not None else None
@@ -0,0 +1,255 @@
+# CodiceFiscale.py
+# Calcolo e verifica del codice fiscale, anche su molti record alla volta,
+# con tabelle precalcolate e codici catastali dall'elenco dei comuni in memoria
+
+import re
+import sys
+import time
+import logging
+import unicodedata
+from collections import namedtuple, Counter
+from datetime import date
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+from Database import DatabaseManager, DetentoriRepository, ComuniRepository, data_iso
+from ElencoComuni import ElencoComuni
+
+logger = logging.getLogger("CodiceFiscale")
+
+# Lettera del mese: indice 0 = gennaio
+LETTERE_MESE = "ABCDEHLMPRST"
+MESE_DA_LETTERA = {lettera: indice + 1 for indice, lettera in enumerate(LETTERE_MESE)}
+
+# Valori per il carattere di controllo dei caratteri in posizione dispari e pari (contando da 1)
+_VALORI_DISPARI = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                           [1, 0, 5, 7, 9, 13, 15, 17, 19, 21,
+                            1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14,
+                            16, 10, 22, 25, 24, 23]))
+_VALORI_PARI = {c: (int(c) if c.isdigit() else ord(c) - ord("A"))
+                for c in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"}
+
+# Omocodia: in caso di codici uguali l'Agenzia sostituisce le cifre, a partire
+# da destra, con queste lettere (0 -> L, 1 -> M, ..., 9 -> V)
+LETTERE_OMOCODIA = "LMNPQRSTUV"
+POSIZIONI_OMOCODIA = (14, 13, 12, 10, 9, 7, 6)
+_CIFRA_DA_OMOCODIA = str.maketrans(LETTERE_OMOCODIA, "0123456789")
+_OMOCODIA_DA_CIFRA = str.maketrans("0123456789", LETTERE_OMOCODIA)
+
+FORMATO_CODICE = re.compile(
+    r"^[A-Z]{6}[0-9LMNPQRSTUV]{2}[ABCDEHLMPRST][0-9LMNPQRSTUV]{2}[A-Z][0-9LMNPQRSTUV]{3}[A-Z]$")
+
+# Esiti della verifica di un codice memorizzato
+ESITO_OK = "OK"
+ESITO_OMOCODIA = "OMOCODIA"
+ESITO_DIVERSO = "DIVERSO"
+ESITO_NON_VALIDO = "NON VALIDO"
+ESITO_MANCANTE = "MANCANTE"
+ESITO_DATI_INCOMPLETI = "DATI INCOMPLETI"
+
+Discrepanza = namedtuple("Discrepanza", ["id_detentore", "cognome", "nome", "memorizzato", "calcolato", "esito"])
+DatiCodiceFiscale = namedtuple("DatiCodiceFiscale",
+                               ["data_nascita", "sesso", "catastale", "comune", "sigla", "omocodico"])
+
+
+@lru_cache(maxsize=65536)
+def _lettere(testo: str) -> Tuple[str, str]:
+    """Consonanti e vocali (A-Z, senza accenti) di un nome o cognome."""
+    testo = unicodedata.normalize("NFKD", testo.upper())
+    consonanti = "".join(c for c in testo if "A" <= c <= "Z" and c not in "AEIOU")
+    vocali = "".join(c for c in testo if c in "AEIOU")
+    return consonanti, vocali
+
+
+@lru_cache(maxsize=65536)
+def codice_cognome(cognome: str) -> str:
+    consonanti, vocali = _lettere(cognome)
+    return (consonanti + vocali + "XXX")[:3]
+
+
+@lru_cache(maxsize=65536)
+def codice_nome(nome: str) -> str:
+    consonanti, vocali = _lettere(nome)
+    if len(consonanti) >= 4:
+        # Con almeno 4 consonanti si usano la prima, la terza e la quarta
+        return consonanti[0] + consonanti[2] + consonanti[3]
+    return (consonanti + vocali + "XXX")[:3]
+
+
+def _anno_mese_giorno(data_nascita) -> Tuple[int, int, int]:
+    """Anno, mese e giorno da yyyy-MM-dd o dd/MM/yyyy (gli altri formati passano da data_iso)."""
+    testo = str(data_nascita or "").strip()
+    if len(testo) == 10 and testo[2] == "/" and testo[5] == "/":
+        anno, mese, giorno = testo[6:], testo[3:5], testo[:2]
+    else:
+        if not (len(testo) == 10 and testo[4] == "-" and testo[7] == "-"):
+            testo = data_iso(testo)
+        anno, mese, giorno = testo[:4], testo[5:7], testo[8:10]
+    try:
+        valori = int(anno), int(mese), int(giorno)
+        date(*valori)
+    except ValueError as e:
+        raise ValueError("Formato data_nascita non valido. Usa DD/MM/YYYY.") from e
+    return valori
+
+
+def carattere_controllo(parziale: str) -> str:
+    """Carattere di controllo dei primi 15 caratteri del codice fiscale."""
+    totale = sum(_VALORI_DISPARI[c] for c in parziale[0::2]) + sum(_VALORI_PARI[c] for c in parziale[1::2])
+    return chr(totale % 26 + ord("A"))
+
+
+def calcola_codice_fiscale(nome: str, cognome: str, data_nascita, sesso: str, comune_nascita: str,
+                           elenco: Optional[ElencoComuni] = None) -> str:
+    """
+    Calcola il codice fiscale (16 caratteri) dai dati anagrafici.
+
+    Raises:
+        ValueError: se la data non è valida o il comune di nascita non è nell'elenco
+    """
+    elenco = elenco or ElencoComuni.condiviso()
+    catastale = elenco.codice_catastale(comune_nascita)
+    if not catastale:
+        raise ValueError(f"Comune di nascita non trovato: {comune_nascita}")
+    anno, mese, giorno = _anno_mese_giorno(data_nascita)
+    if (sesso or "").strip().upper() == "F":
+        giorno += 40
+    parziale = f"{codice_cognome(cognome)}{codice_nome(nome)}{anno % 100:02d}{LETTERE_MESE[mese - 1]}{giorno:02d}{catastale}"
+    return parziale + carattere_controllo(parziale)
+
+
+def calcola_codici(record: Iterable[Tuple[str, str, str, str, str]],
+                   elenco: Optional[ElencoComuni] = None) -> List[Optional[str]]:
+    """
+    Calcola i codici fiscali di molti record (nome, cognome, data, sesso, comune).
+    Restituisce None al posto del codice per i record con dati incompleti o non validi.
+    """
+    elenco = elenco or ElencoComuni.condiviso()
+    risultati = []
+    for nome, cognome, data_nascita, sesso, comune in record:
+        if not (nome and cognome and data_nascita and comune):
+            risultati.append(None)
+            continue
+        try:
+            risultati.append(calcola_codice_fiscale(nome, cognome, data_nascita, sesso, comune, elenco))
+        except ValueError:
+            risultati.append(None)
+    return risultati
+
+
+def codice_valido(codice: str) -> bool:
+    """Controlla formato (anche omocodico) e carattere di controllo."""
+    codice = (codice or "").strip().upper()
+    return bool(FORMATO_CODICE.match(codice)) and carattere_controllo(codice[:15]) == codice[15]
+
+
+def forma_base(codice: str) -> str:
+    """Codice senza sostituzioni di omocodia, con il carattere di controllo ricalcolato."""
+    caratteri = list(codice.strip().upper()[:15])
+    for posizione in POSIZIONI_OMOCODIA:
+        caratteri[posizione] = caratteri[posizione].translate(_CIFRA_DA_OMOCODIA)
+    parziale = "".join(caratteri)
+    return parziale + carattere_controllo(parziale)
+
+
+def varianti_omocodia(codice: str) -> List[str]:
+    """Le sette varianti omocodiche successive del codice, nell'ordine in cui vengono assegnate."""
+    caratteri = list(forma_base(codice)[:15])
+    varianti = []
+    for posizione in POSIZIONI_OMOCODIA:
+        caratteri[posizione] = caratteri[posizione].translate(_OMOCODIA_DA_CIFRA)
+        parziale = "".join(caratteri)
+        varianti.append(parziale + carattere_controllo(parziale))
+    return varianti
+
+
+def decodifica_codice_fiscale(codice: str, elenco: Optional[ElencoComuni] = None,
+                              oggi: Optional[date] = None) -> DatiCodiceFiscale:
+    """
+    Ricava dal codice fiscale data di nascita, sesso e comune (con la sigla della provincia).
+    Il comune resta vuoto per i nati all'estero (codici Z...) e per i codici non presenti
+    nell'elenco; l'anno a due cifre è attribuito al secolo che non lo colloca nel futuro.
+
+    Raises:
+        ValueError: se il formato, il carattere di controllo o la data non sono validi
+    """
+    codice = (codice or "").strip().upper()
+    if not FORMATO_CODICE.match(codice):
+        raise ValueError("Formato del codice fiscale non valido")
+    if carattere_controllo(codice[:15]) != codice[15]:
+        raise ValueError("Carattere di controllo non valido")
+
+    base = forma_base(codice)
+    anno, mese, giorno = int(base[6:8]), MESE_DA_LETTERA[base[8]], int(base[9:11])
+    sesso = "F" if giorno > 40 else "M"
+    if sesso == "F":
+        giorno -= 40
+    oggi = oggi or date.today()
+    anno += 2000 if 2000 + anno <= oggi.year else 1900
+    try:
+        data_nascita = date(anno, mese, giorno)
+    except ValueError as e:
+        raise ValueError("Data di nascita non valida nel codice fiscale") from e
+
+    catastale = base[11:15]
+    comune = (elenco or ElencoComuni.condiviso()).da_catastale(catastale)
+    return DatiCodiceFiscale(data_nascita, sesso, catastale,
+                             comune.nome if comune else "", comune.sigla if comune else "",
+                             base[:15] != codice[:15])
+
+
+def verifica_codice(memorizzato: Optional[str], calcolato: Optional[str]) -> str:
+    """Confronta il codice memorizzato con quello calcolato e restituisce l'esito."""
+    memorizzato = (memorizzato or "").strip().upper()
+    if not memorizzato:
+        return ESITO_MANCANTE
+    if not codice_valido(memorizzato):
+        return ESITO_NON_VALIDO
+    if calcolato is None:
+        return ESITO_DATI_INCOMPLETI
+    if memorizzato == calcolato:
+        return ESITO_OK
+    if forma_base(memorizzato) == calcolato:
+        return ESITO_OMOCODIA
+    return ESITO_DIVERSO
+
+
+def verifica_codici(record: Iterable[Tuple[str, str, str, str, str, str]],
+                    elenco: Optional[ElencoComuni] = None) -> List[Tuple[Optional[str], str]]:
+    """
+    Verifica molti record (codice memorizzato, nome, cognome, data, sesso, comune).
+    Restituisce per ciascuno (codice calcolato o None, esito).
+    """
+    record = list(record)
+    calcolati = calcola_codici((r[1:] for r in record), elenco)
+    return [(calcolato, verifica_codice(r[0], calcolato)) for r, calcolato in zip(record, calcolati)]
+
+
+def verifica_detentori(db: Optional[DatabaseManager] = None,
+                       elenco: Optional[ElencoComuni] = None) -> Tuple[Counter, List[Discrepanza]]:
+    """
+    Ricalcola il codice fiscale di tutti i detentori e lo confronta con CodiceFiscale.
+
+    Returns:
+        (conteggio per esito, detentori con esito diverso da OK, omocodie comprese)
+    """
+    inizio = time.perf_counter()
+    righe = DetentoriRepository(db).dati_codice_fiscale()
+    esiti = verifica_codici(((r[6], r[1], r[2], r[3], r[4], r[5]) for r in righe), elenco)
+    conteggi = Counter(esito for _, esito in esiti)
+    discrepanze = [Discrepanza(r[0], r[2], r[1], r[6], calcolato, esito)
+                   for r, (calcolato, esito) in zip(righe, esiti) if esito != ESITO_OK]
+    logger.info(f"Verificati {len(righe)} codici fiscali in {(time.perf_counter() - inizio) * 1000:.0f} ms: "
+                f"{dict(conteggi)}")
+    return conteggi, discrepanze
+
+
+if __name__ == "__main__":
+    # Uso: python CodiceFiscale.py [percorso del database]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = DatabaseManager(sys.argv[1]) if len(sys.argv) > 1 else DatabaseManager()
+    conteggi, discrepanze = verifica_detentori(db, ElencoComuni.carica(ComuniRepository(db)))
+    for d in discrepanze:
+        print(f"{d.id_detentore:>6}  {d.cognome or ''} {d.nome or ''}: {d.esito} "
+              f"(memorizzato {d.memorizzato or '-'}, calcolato {d.calcolato or '-'})")
+    print(", ".join(f"{esito}: {numero}" for esito, numero in conteggi.most_common()))
@@ -0,0 +1,1546 @@
+# Database.py
+# Livello di accesso ai dati condiviso da tutti i moduli dell'applicazione
+
+import os
+import sys
+import sqlite3
+import threading
+import time
+import queue
+import logging
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable, Callable
+
+logger = logging.getLogger("Database")
+
+DB_PATH = "gestione_armi.db"
+
+# Modalità multi-postazione: journal WAL e coda di scrittura unica.
+# Si attiva con la variabile d'ambiente GESTIONE_ARMI_CONCORRENTE=1
+# oppure con DatabaseManager().configura(concorrente=True) prima del primo accesso.
+# ATTENZIONE: WAL richiede memoria condivisa sullo stesso host; non va usato
+# se il file del database si trova su una cartella di rete (SMB/NFS).
+MODALITA_CONCORRENTE = os.environ.get("GESTIONE_ARMI_CONCORRENTE", "0") == "1"
+
+# Millisecondi di attesa di SQLite su un lock prima di restituire "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# Tentativi e attesa iniziale (secondi, raddoppiata a ogni tentativo) per le scritture
+# che falliscono con "database is locked"
+MAX_TENTATIVI_SCRITTURA = 6
+ATTESA_INIZIALE_RETRY = 0.05
+
+# Numero di scritture recenti conservate per le metriche di attesa
+DIMENSIONE_METRICHE = 500
+
+# Numero di statement preparati mantenuti in cache da ciascuna connessione.
+# sqlite3 riutilizza lo statement compilato quando riceve lo stesso testo SQL,
+# per questo le query dei repository sono costanti di modulo.
+STATEMENT_CACHE_SIZE = 256
+
+# Corrispondenza tra le colonne della tabella detentori e le chiavi dei
+# dizionari usati dalle finestre (InserisciDetentoreDialog, liste detentori)
+CAMPI_DETENTORE = [
+    ("ID_Detentore", "id"),
+    ("Nome", "nome"),
+    ("Cognome", "cognome"),
+    ("FascicoloPersonale", "fascicoloPersonale"),
+    ("DataNascita", "dataNascita"),
+    ("LuogoNascita", "luogoNascita"),
+    ("SiglaProvinciaNascita", "siglaProvinciaNascita"),
+    ("Sesso", "sesso"),
+    ("CodiceFiscale", "codiceFiscale"),
+    ("ComuneResidenza", "comuneResidenza"),
+    ("SiglaProvinciaResidenza", "siglaProvinciaResidenza"),
+    ("TipoVia", "tipoVia"),
+    ("Via", "via"),
+    ("Civico", "civico"),
+    ("Telefono", "telefono"),
+    ("TipologiaTitolo", "tipologiaTitolo"),
+    ("EnteRilascio", "enteRilascio"),
+    ("ProvinciaEnteRilascio", "provinciaEnteRilascio"),
+    ("DataRilascio", "dataRilascio"),
+    ("NumeroPortoArmi", "numeroPortoArmi"),
+    ("TipoLuogoDetenzione", "tipoLuogoDetenzione"),
+    ("ComuneDetenzione", "comuneDetenzione"),
+    ("SiglaProvinciaDetenzione", "siglaProvinciaDetenzione"),
+    ("TipoViaDetenzione", "tipoViaDetenzione"),
+    ("ViaDetenzione", "viaDetenzione"),
+    ("CivicoDetenzione", "civicoDetenzione"),
+    ("TipoDocumento", "tipoDocumento"),
+    ("NumeroDocumento", "numeroDocumento"),
+    ("DataRilascioDocumento", "dataRilascioDocumento"),
+    ("EnteRilascioDocumento", "enteRilascioDocumento"),
+    ("ComuneEnteRilascioDocumento", "comuneEnteRilascioDocumento"),
+]
+
+# Tutte le colonne della tabella armi, nell'ordine usato da ArmaDialog
+COLONNE_ARMA = [
+    "ID_ArmaDetenuta", "ID_Detentore", "TipoArma", "MarcaArma", "ModelloArma",
+    "TipologiaArma", "Matricola", "CalibroArma", "MatricolaCanna", "LunghezzaCanna",
+    "NumeroCanne", "ArmaLungaCorta", "TipoCanna", "CategoriaArma", "FunzionamentoArma",
+    "CaricamentoArma", "PunzoniArma", "StatoProduzioneArma", "ExOrdDem",
+    "TipoMunizioni", "QuantitaMunizioni", "TipoBossolo", "TipoCedente", "NoteArma",
+    # campi cedente
+    "CognomeCedente", "NomeCedente", "DataNascitaCedente", "LuogoNascitaCedente",
+    "SiglaProvinciaResidenzaCedente", "ComuneResidenzaCedente",
+    "SiglaProvinciaNascitaCedente", "TipoViaResidenzaCedente",
+    "IndirizzoResidenzaCedente", "CivicoResidenzaCedente", "TelefonoCedente",
+    # data e luogo detenzione
+    "DataAcquisto", "ComuneDetenzione", "ProvinciaDetenzione",
+    "TipoViaDetenzione", "IndirizzoDetenzione", "CivicoDetenzione", "NoteDetenzione",
+    # catalogo
+    "NumeroCatalogo", "ClassificazioneEuropea"
+]
+
+# Le date sono memorizzate come testo yyyy-MM-dd (migrazione 7), così l'ordinamento
+# e i confronti di stringa coincidono con quelli cronologici e gli indici servono
+# anche per gli intervalli. Le finestre le mostrano come dd/MM/yyyy.
+FORMATO_DATA_DB = "%Y-%m-%d"
+FORMATO_DATA_VISUALIZZATA = "%d/%m/%Y"
+FORMATI_DATA_ACCETTATI = (FORMATO_DATA_DB, FORMATO_DATA_VISUALIZZATA, "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d")
+
+# Colonne data di ciascuna tabella
+COLONNE_DATA = {
+    "detentori": ["DataNascita", "DataRilascio", "DataRilascioDocumento"],
+    "armi": ["DataNascitaCedente", "DataAcquisto"],
+    "trasferimenti": ["Data_Trasferimento"],
+}
+
+# Chiavi data dei dizionari dei detentori
+CHIAVI_DATA_DETENTORE = ("dataNascita", "dataRilascio", "dataRilascioDocumento")
+
+# Validità del porto d'armi in mesi secondo la tipologia del titolo: decide la prima
+# parola chiave contenuta in TipologiaTitolo. I titoli senza scadenza (licenza di
+# collezione, nulla osta) non sono elencati e restano senza data di scadenza.
+# La regola è copiata nei trigger di detentori: se cambia serve una nuova migrazione.
+VALIDITA_PORTO_ARMI = [
+    ("DIFESA", 12),       # porto di pistola per difesa personale
+    ("GIURAT", 24),       # guardie particolari giurate
+    ("CACCIA", 60),       # porto di fucile uso caccia
+    ("TIRO A VOLO", 60),  # porto di fucile uso tiro a volo
+    ("SPORTIV", 60),
+]
+
+# Campi caricati dalle liste dei detentori (CAMPI_DETENTORE e la scadenza calcolata del porto d'armi)
+CAMPI_LISTA_DETENTORE = [
+    ("ID_Detentore", "id"),
+    ("Cognome", "cognome"),
+    ("Nome", "nome"),
+    ("CodiceFiscale", "codiceFiscale"),
+    ("ComuneResidenza", "comuneResidenza"),
+    ("SiglaProvinciaResidenza", "siglaProvinciaResidenza"),
+    ("Telefono", "telefono"),
+    ("NumeroPortoArmi", "numeroPortoArmi"),
+    ("DataNascita", "dataNascita"),
+    ("LuogoNascita", "luogoNascita"),
+    ("TipoVia", "tipoVia"),
+    ("Via", "via"),
+    ("Civico", "civico"),
+    ("ScadenzaPortoArmi", "scadenza"),
+]
+
+# Riepilogo delle armi del detentore (tabella riepilogo_detentori), caricato dalla lista dopo CAMPI_LISTA_DETENTORE
+CAMPI_RIEPILOGO_DETENTORE = [
+    ("NumeroArmi", "numeroArmi"),
+    ("CategorieArmi", "categorieArmi"),
+    ("Munizioni", "munizioni"),
+    ("UltimoTrasferimento", "ultimoTrasferimento"),
+]
+
+
+def _interpreta_data(valore) -> Optional[datetime]:
+    testo = str(valore).strip()
+    for formato in FORMATI_DATA_ACCETTATI:
+        try:
+            return datetime.strptime(testo, formato)
+        except ValueError:
+            continue
+    return None
+
+
+def data_iso(valore) -> str:
+    """
+    Converte una data in uno dei formati accettati nel formato del database (yyyy-MM-dd).
+    Restituisce '' per un valore vuoto e il testo invariato se non è una data riconoscibile.
+    """
+    if valore is None or not str(valore).strip():
+        return ""
+    data = _interpreta_data(valore)
+    return data.strftime(FORMATO_DATA_DB) if data else str(valore).strip()
+
+
+def data_italiana(valore) -> str:
+    """Converte una data del database nel formato visualizzato dd/MM/yyyy."""
+    if valore is None or not str(valore).strip():
+        return ""
+    data = _interpreta_data(valore)
+    return data.strftime(FORMATO_DATA_VISUALIZZATA) if data else str(valore).strip()
+
+
+def sql_data_italiana(colonna: str) -> str:
+    """Espressione SQL equivalente a data_italiana() per una colonna data (yyyy-MM-dd o testo libero)."""
+    return (f"CASE WHEN {colonna} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' "
+            f"THEN substr({colonna}, 9, 2) || '/' || substr({colonna}, 6, 2) || '/' || substr({colonna}, 1, 4) "
+            f"ELSE COALESCE(TRIM({colonna}), '') END")
+
+
+def sql_scadenza_porto_armi(tipologia: str, rilascio: str) -> str:
+    """
+    Espressione SQL della scadenza (yyyy-MM-dd) del porto d'armi secondo VALIDITA_PORTO_ARMI,
+    NULL se il titolo non scade o la data di rilascio non è una data.
+    """
+    casi = " ".join(f"WHEN instr(UPPER({tipologia}), '{parola}') > 0 THEN date({rilascio}, '+{mesi} months')"
+                    for parola, mesi in VALIDITA_PORTO_ARMI)
+    return (f"CASE WHEN {rilascio} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' "
+            f"THEN CASE {casi} END END")
+
+
+class DatabaseManager:
+    """
+    Gestore unico delle connessioni al database.
+
+    Mantiene una connessione per thread (aperta al primo utilizzo e riusata
+    per tutta la durata del thread), in modo che ogni finestra e ogni worker
+    non paghi il costo di apertura del file a ogni operazione.
+    """
+    _instance = None
+    _lock = threading.Lock()  # Per evitare problemi in ambienti multi-thread
+    # Lock separato per le migrazioni: possono durare a lungo (primo avvio dopo un
+    # aggiornamento) e solo chi apre una connessione deve attenderle, non DatabaseManager()
+    _lock_migrazioni = threading.Lock()
+
+    def __new__(cls, db_path=DB_PATH):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(DatabaseManager, cls).__new__(cls)
+                cls._instance._db_path = db_path
+                cls._instance._local = threading.local()
+                cls._instance._connections = []
+                cls._instance._concorrente = MODALITA_CONCORRENTE
+                cls._instance._wal_attivato = False
+                cls._instance._migrazioni_applicate = False
+                cls._instance._versione_schema = None
+                cls._instance._catalogo = None
+                cls._instance._coda_scritture = None
+                cls._instance.metriche_scritture = MetricheScritture()
+                cls._instance._osservatori_scritture = []
+            return cls._instance
+
+    def configura(self, concorrente: bool):
+        """
+        Attiva o disattiva la modalità multi-postazione (WAL + coda di scrittura).
+        Va chiamato prima di aprire le connessioni.
+        """
+        self._concorrente = concorrente
+
+    @property
+    def concorrente(self):
+        return self._concorrente
+
+    @property
+    def db_path(self):
+        return self._db_path
+
+    def _open_connection(self):
+        """Apre una nuova connessione configurata per il thread corrente."""
+        try:
+            # check_same_thread=False solo per permettere a close_all() di chiudere
+            # le connessioni degli altri thread: ogni connessione resta privata del suo thread
+            conn = sqlite3.connect(self._db_path,
+                                   timeout=BUSY_TIMEOUT_MS / 1000,
+                                   cached_statements=STATEMENT_CACHE_SIZE,
+                                   check_same_thread=False)
+            # row_factory per accedere ai campi sia per indice sia per nome
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            if self._concorrente:
+                self._attiva_wal(conn)
+        except Exception as e:
+            raise Exception(f"Errore durante l'apertura del database: {e}")
+        self._applica_migrazioni(conn)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def get_connection(self):
+        """Restituisce la connessione del thread corrente; la apre se non esiste già."""
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.connection = conn
+        return conn
+
+    def close_connection(self):
+        """Chiude la connessione del thread corrente, se esiste."""
+        conn = getattr(self._local, "connection", None)
+        if conn is not None:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+            self._local.connection = None
+
+    def _applica_migrazioni(self, conn):
+        """Porta lo schema all'ultima versione, una sola volta per processo."""
+        if self._migrazioni_applicate:
+            return
+        with self._lock_migrazioni:
+            if self._migrazioni_applicate:
+                return
+            from Migrazioni import applica_migrazioni
+            self._versione_schema = applica_migrazioni(conn)
+            self._migrazioni_applicate = True
+
+    def catalogo(self) -> "CatalogoSchema":
+        """
+        Restituisce il catalogo dello schema, letto una sola volta per processo
+        e ricostruito solo se la versione dello schema (user_version) cambia.
+        """
+        conn = self.get_connection()
+        catalogo = self._catalogo
+        if catalogo is None or catalogo.versione != self._versione_schema:
+            catalogo = CatalogoSchema(conn, self._versione_schema)
+            self._catalogo = catalogo
+        return catalogo
+
+    def invalida_catalogo(self):
+        """Da chiamare dopo una modifica dello schema fatta a runtime."""
+        self._catalogo = None
+
+    def _attiva_wal(self, conn):
+        """
+        Imposta il journal WAL: i lettori lavorano su uno snapshot consistente
+        e non vengono bloccati dallo scrittore. journal_mode è persistente nel file,
+        quindi basta impostarlo una volta per processo.
+        """
+        if not self._wal_attivato:
+            modalita = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if str(modalita).lower() != "wal":
+                logger.warning(f"Impossibile attivare WAL, modalità journal attuale: {modalita}")
+            self._wal_attivato = True
+        # Con WAL la sincronizzazione NORMAL resta sicura in caso di crash dell'applicazione
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+    def esegui_scrittura(self, funzione: Callable, *args):
+        """
+        Esegue funzione(conn, *args) in una transazione di scrittura.
+
+        In modalità concorrente la scrittura passa dalla coda a scrittore unico;
+        altrimenti viene eseguita nel thread chiamante. In entrambi i casi i
+        "database is locked" vengono ritentati con backoff esponenziale e
+        l'attesa viene registrata in metriche_scritture.
+
+        Returns:
+            Il valore restituito da funzione
+        """
+        if self._concorrente:
+            risultato = self._get_coda_scritture().invia(funzione, *args).result()
+        else:
+            inizio = time.perf_counter()
+            risultato = _esegui_con_retry(self.get_connection(), funzione, args, inizio, self.metriche_scritture)
+        self._notifica_scrittura()
+        return risultato
+
+    def aggiungi_osservatore_scritture(self, osservatore: Callable[[], None]):
+        """
+        Registra una funzione senza argomenti chiamata dopo ogni scrittura completata
+        con esegui_scrittura, nel thread che ha chiesto la scrittura.
+        """
+        with self._lock:
+            self._osservatori_scritture.append(osservatore)
+
+    def rimuovi_osservatore_scritture(self, osservatore: Callable[[], None]):
+        with self._lock:
+            if osservatore in self._osservatori_scritture:
+                self._osservatori_scritture.remove(osservatore)
+
+    def _notifica_scrittura(self):
+        for osservatore in list(self._osservatori_scritture):
+            try:
+                osservatore()
+            except Exception as e:
+                # La scrittura è già confermata: un osservatore in errore non la annulla
+                logger.warning(f"Errore nella notifica di una scrittura: {e}")
+
+    def _get_coda_scritture(self):
+        with self._lock:
+            if self._coda_scritture is None:
+                self._coda_scritture = CodaScritture(self)
+            return self._coda_scritture
+
+    def close_all(self):
+        """Chiude tutte le connessioni aperte (da usare alla chiusura dell'applicazione)."""
+        with self._lock:
+            coda, self._coda_scritture = self._coda_scritture, None
+        if coda is not None:
+            coda.ferma()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+    def execute_query(self, query, params=()):
+        """
+        Esegue una query e restituisce il cursore.
+        Ricorda di gestire il commit se stai modificando dati.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor
+        except Exception as e:
+            raise Exception(f"Errore durante l'esecuzione della query: {e}")
+
+    def fetchone(self, query, params=()):
+        """Esegue una query e restituisce la prima riga (o None)."""
+        return self.get_connection().execute(query, params).fetchone()
+
+    def fetchall(self, query, params=()):
+        """Esegue una query e restituisce tutte le righe."""
+        return self.get_connection().execute(query, params).fetchall()
+
+
+# Statement SQL già costruito: testo e campi logici nell'ordine dei segnaposto o delle colonne
+StatementPreparato = namedtuple("StatementPreparato", ["sql", "campi"])
+
+# Riga di registro_modifiche (migrazione 12): operazione INSERITA, AGGIORNATA o ELIMINATA
+# sulla riga id_riga di tabella, con i detentori coinvolti
+EventoModifica = namedtuple("EventoModifica", ["id", "tabella", "operazione", "id_riga",
+                                               "id_detentore", "id_detentore_precedente"])
+INSERITA, AGGIORNATA, ELIMINATA = "I", "U", "D"
+
+
+class CatalogoSchema:
+    """
+    Struttura delle tabelle letta con un'unica query all'avvio (al posto di un
+    PRAGMA table_info per ogni operazione) e cache degli statement che si
+    adattano alle colonne realmente presenti, richiamabili per nome.
+    """
+
+    SQL_COLONNE = """
+        SELECT m.name, p.name
+        FROM sqlite_master m
+        JOIN pragma_table_info(m.name) p
+        WHERE m.type = 'table'
+        ORDER BY m.name, p.cid
+    """
+
+    def __init__(self, conn, versione=None):
+        self.versione = versione
+        self._colonne: Dict[str, List[str]] = {}
+        for tabella, colonna in conn.execute(self.SQL_COLONNE):
+            self._colonne.setdefault(tabella.lower(), []).append(colonna)
+        self._statement: Dict[str, StatementPreparato] = {}
+        self._lock = threading.Lock()
+
+    def colonne(self, tabella: str) -> List[str]:
+        return self._colonne.get(tabella.lower(), [])
+
+    def ha_colonna(self, tabella: str, colonna: str) -> bool:
+        return colonna in self.colonne(tabella)
+
+    def risolvi(self, tabella: str, alternative: Dict[str, List[str]]) -> List[tuple]:
+        """
+        Per ogni campo logico restituisce la prima colonna esistente tra le alternative.
+
+        Returns:
+            Lista di coppie (campo logico, colonna reale)
+        """
+        colonne = self.colonne(tabella)
+        risolte = []
+        for campo, possibili in alternative.items():
+            for colonna in possibili:
+                if colonna in colonne:
+                    risolte.append((campo, colonna))
+                    break
+            else:
+                logger.warning(f"Nessuna colonna trovata per '{campo}' nella tabella {tabella}")
+        return risolte
+
+    def select(self, tabella: str, alternative: Dict[str, List[str]], where: str,
+               order_by: Optional[List[str]] = None) -> StatementPreparato:
+        """SELECT delle sole colonne esistenti; i campi del risultato sono quelli logici."""
+        risolte = self.risolvi(tabella, alternative)
+        elenco = ", ".join(colonna for _, colonna in risolte) or "1"
+        sql = f"SELECT {elenco} FROM {tabella} WHERE {where}"
+        ordine = [c for c in (order_by or []) if self.ha_colonna(tabella, c)]
+        if order_by is not None:
+            sql += " ORDER BY " + ", ".join(ordine or ["rowid"])
+        return StatementPreparato(sql, [campo for campo, _ in risolte])
+
+    def update(self, tabella: str, alternative: Dict[str, List[str]], where: str) -> StatementPreparato:
+        """UPDATE delle sole colonne esistenti; i campi sono quelli logici nell'ordine dei segnaposto."""
+        risolte = self.risolvi(tabella, alternative)
+        sql = f"UPDATE {tabella} SET {', '.join(f'{c} = ?' for _, c in risolte)} WHERE {where}"
+        return StatementPreparato(sql, [campo for campo, _ in risolte])
+
+    def statement(self, nome: str, costruttore: Callable[["CatalogoSchema"], StatementPreparato]) -> StatementPreparato:
+        """
+        Restituisce lo statement registrato con questo nome; al primo utilizzo
+        lo costruisce chiamando costruttore(catalogo).
+        """
+        stmt = self._statement.get(nome)
+        if stmt is None:
+            with self._lock:
+                stmt = self._statement.get(nome)
+                if stmt is None:
+                    stmt = costruttore(self)
+                    self._statement[nome] = stmt
+        return stmt
+
+
+def _database_bloccato(errore: Exception) -> bool:
+    messaggio = str(errore).lower()
+    return isinstance(errore, sqlite3.OperationalError) and (
+        "database is locked" in messaggio or "database is busy" in messaggio)
+
+
+def _esegui_con_retry(conn, funzione, args, inizio, metriche):
+    """
+    Esegue funzione(conn, *args) in una transazione, ritentando con backoff
+    esponenziale se il database è bloccato da un'altra postazione.
+
+    Args:
+        conn: Connessione da usare
+        funzione: Callable che riceve la connessione ed esegue le scritture
+        args: Argomenti aggiuntivi per funzione
+        inizio: Istante (perf_counter) in cui la scrittura è stata richiesta
+        metriche: MetricheScritture su cui registrare l'esito
+    """
+    attesa = ATTESA_INIZIALE_RETRY
+    for tentativo in range(1, MAX_TENTATIVI_SCRITTURA + 1):
+        inizio_esecuzione = time.perf_counter()
+        try:
+            # BEGIN IMMEDIATE prende subito il lock di scrittura: il conflitto emerge
+            # qui e non a metà transazione
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            risultato = funzione(conn, *args)
+            conn.commit()
+            fine = time.perf_counter()
+            metriche.registra(inizio_esecuzione - inizio, fine - inizio_esecuzione, tentativo)
+            return risultato
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if _database_bloccato(e) and tentativo < MAX_TENTATIVI_SCRITTURA:
+                logger.info(f"Database bloccato, nuovo tentativo {tentativo + 1} tra {attesa:.2f}s")
+                time.sleep(attesa)
+                attesa *= 2
+                continue
+            metriche.registra(time.perf_counter() - inizio, 0.0, tentativo, errore=True)
+            raise
+
+
+class MetricheScritture:
+    """Raccoglie i tempi di attesa e di esecuzione delle scritture recenti."""
+
+    def __init__(self, dimensione: int = DIMENSIONE_METRICHE):
+        self._lock = threading.Lock()
+        self._campioni = deque(maxlen=dimensione)
+        self.totale = 0
+        self.errori = 0
+        self.ritentate = 0
+
+    def registra(self, attesa: float, durata: float, tentativi: int, errore: bool = False):
+        with self._lock:
+            self._campioni.append((attesa, durata))
+            self.totale += 1
+            if errore:
+                self.errori += 1
+            if tentativi > 1:
+                self.ritentate += 1
+        if attesa > 1.0:
+            logger.warning(f"Scrittura attesa {attesa * 1000:.0f} ms ({tentativi} tentativi)")
+        else:
+            logger.debug(f"Scrittura: attesa {attesa * 1000:.1f} ms, esecuzione {durata * 1000:.1f} ms, "
+                         f"tentativi {tentativi}")
+
+    def riepilogo(self) -> Dict[str, float]:
+        """Restituisce conteggi e attese (ms) media, 95° percentile e massima delle scritture recenti."""
+        with self._lock:
+            attese = sorted(a for a, _ in self._campioni)
+            durate = [d for _, d in self._campioni]
+            totale, errori, ritentate = self.totale, self.errori, self.ritentate
+        if not attese:
+            return {"scritture": totale, "errori": errori, "ritentate": ritentate,
+                    "attesa_media_ms": 0.0, "attesa_p95_ms": 0.0, "attesa_max_ms": 0.0,
+                    "durata_media_ms": 0.0}
+        p95 = attese[min(len(attese) - 1, int(len(attese) * 0.95))]
+        return {
+            "scritture": totale,
+            "errori": errori,
+            "ritentate": ritentate,
+            "attesa_media_ms": sum(attese) / len(attese) * 1000,
+            "attesa_p95_ms": p95 * 1000,
+            "attesa_max_ms": attese[-1] * 1000,
+            "durata_media_ms": sum(durate) / len(durate) * 1000,
+        }
+
+    def testo_stato(self) -> str:
+        """Testo sintetico per la barra di stato."""
+        r = self.riepilogo()
+        if not r["scritture"]:
+            return "Scritture: nessuna"
+        return (f"Scritture: {r['scritture']} | attesa media {r['attesa_media_ms']:.0f} ms, "
+                f"p95 {r['attesa_p95_ms']:.0f} ms, max {r['attesa_max_ms']:.0f} ms | "
+                f"ritentate {r['ritentate']}, fallite {r['errori']}")
+
+
+class CodaScritture:
+    """
+    Scrittore unico: tutte le scritture del processo vengono serializzate su un
+    thread dedicato con una propria connessione, così le finestre non si
+    contendono il lock tra loro e i conflitti con le altre postazioni vengono
+    gestiti in un solo punto.
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self._db = db
+        self._coda = queue.Queue()
+        self._thread = threading.Thread(target=self._ciclo, name="CodaScritture", daemon=True)
+        self._thread.start()
+
+    def invia(self, funzione: Callable, *args) -> Future:
+        """Accoda una scrittura e restituisce il Future con il suo risultato."""
+        futuro = Future()
+        self._coda.put((funzione, args, futuro, time.perf_counter()))
+        return futuro
+
+    def ferma(self):
+        self._coda.put(None)
+        self._thread.join(timeout=5)
+
+    def _ciclo(self):
+        conn = self._db.get_connection()
+        while True:
+            elemento = self._coda.get()
+            if elemento is None:
+                break
+            funzione, args, futuro, inizio = elemento
+            if not futuro.set_running_or_notify_cancel():
+                continue
+            try:
+                futuro.set_result(_esegui_con_retry(conn, funzione, args, inizio, self._db.metriche_scritture))
+            except Exception as e:
+                futuro.set_exception(e)
+        self._db.close_connection()
+
+
+class DetentoriRepository:
+    """Accesso alla tabella detentori."""
+
+    SQL_LISTA = "SELECT * FROM detentori ORDER BY Cognome, Nome"
+    SQL_GET = "SELECT * FROM detentori WHERE ID_Detentore = ?"
+    SQL_ANAGRAFICA = "SELECT Cognome, Nome, CodiceFiscale FROM detentori WHERE ID_Detentore = ?"
+    SQL_RESIDENZA = """
+        SELECT ComuneResidenza, SiglaProvinciaResidenza, TipoVia, Via, Civico
+        FROM detentori
+        WHERE ID_Detentore = ?
+    """
+    SQL_DATI_CODICE_FISCALE = """
+        SELECT ID_Detentore, Nome, Cognome, DataNascita, Sesso, LuogoNascita, CodiceFiscale
+        FROM detentori
+        ORDER BY Cognome, Nome
+    """
+    SQL_CONTA_ARMI = "SELECT COUNT(*) FROM armi WHERE ID_Detentore = ?"
+    SQL_CATEGORIE_ARMI = "SELECT DISTINCT CategoriaArma FROM riepilogo_categorie ORDER BY CategoriaArma"
+    SQL_PORTI_IN_SCADENZA = """
+        SELECT ID_Detentore, Cognome, Nome, CodiceFiscale, Telefono, TipologiaTitolo, NumeroPortoArmi,
+               ScadenzaPortoArmi
+        FROM detentori
+        WHERE ScadenzaPortoArmi BETWEEN date('now', 'localtime') AND date('now', 'localtime', ?)
+        ORDER BY ScadenzaPortoArmi, Cognome, Nome
+    """
+    SQL_ELIMINA = "DELETE FROM detentori WHERE ID_Detentore = ?"
+    SQL_ELIMINA_ARMI = "DELETE FROM armi WHERE ID_Detentore = ?"
+    SQL_AGGIORNA = "UPDATE detentori SET {} WHERE ID_Detentore = ?".format(
+        ", ".join(f"{col}=?" for col, _ in CAMPI_DETENTORE[1:]))
+    SQL_INSERISCI = "INSERT INTO detentori ({}) VALUES ({})".format(
+        ", ".join(col for col, _ in CAMPI_DETENTORE[1:]),
+        ", ".join("?" for _ in CAMPI_DETENTORE[1:]))
+
+    # Filtri della lista: chiave -> (colonna di detentori, colonna di ricerca_detentori)
+    COLONNE_FILTRO = {
+        "cognome": ("Cognome", "cognome"),
+        "nome": ("Nome", "nome"),
+        "codiceFiscale": ("CodiceFiscale", "codice_fiscale"),
+        "comuneResidenza": ("ComuneResidenza", "comune"),
+    }
+    # Minimo del tokenizer trigram: i filtri più corti usano LIKE
+    LUNGHEZZA_MINIMA_FTS = 3
+
+    # Colonne del riepilogo armi (alias s), nell'ordine di CAMPI_RIEPILOGO_DETENTORE:
+    # i detentori senza armi né trasferimenti non hanno una riga
+    ESPRESSIONI_RIEPILOGO = {
+        "numeroArmi": "COALESCE(s.NumeroArmi, 0)",
+        "categorieArmi": "s.CategorieArmi",
+        "munizioni": "COALESCE(s.Munizioni, 0)",
+        "ultimoTrasferimento": sql_data_italiana("s.UltimoTrasferimento"),
+    }
+    # Lista detentori: solo i campi mostrati, il record completo si legge con get() quando serve
+    SQL_COLONNE_VISTA = ", ".join(
+        [sql_data_italiana(f"d.{col}") if chiave in CHIAVI_DATA_DETENTORE + ("scadenza",) else f"d.{col}"
+         for col, chiave in CAMPI_LISTA_DETENTORE] +
+        list(ESPRESSIONI_RIEPILOGO.values()))
+    # Campi esportabili: chiave -> espressione SQL (date come dd/MM/yyyy, indirizzo composto)
+    ESPRESSIONI_CAMPI = {
+        **{chiave: sql_data_italiana(f"d.{col}") if chiave in CHIAVI_DATA_DETENTORE else f"d.{col}"
+           for col, chiave in CAMPI_DETENTORE},
+        "indirizzo": "TRIM(COALESCE(d.TipoVia || ' ', '') || COALESCE(d.Via || ' ', '') || COALESCE(d.Civico, ''))",
+        "scadenza": sql_data_italiana("d.ScadenzaPortoArmi"),
+        **ESPRESSIONI_RIEPILOGO,
+    }
+    # Valori ripetuti su molte righe: internati, un solo oggetto per valore
+    CHIAVI_RIPETUTE = {"comuneResidenza", "siglaProvinciaResidenza", "luogoNascita", "tipoVia", "civico", "dataNascita",
+                       "scadenza", "categorieArmi", "ultimoTrasferimento"}
+    RIGHE_PER_BLOCCO = 2000
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    @staticmethod
+    def to_dict(row) -> Dict[str, Any]:
+        """Converte una riga della tabella detentori nel dizionario usato dalle finestre."""
+        dati = {chiave: row[col] for col, chiave in CAMPI_DETENTORE}
+        for chiave in CHIAVI_DATA_DETENTORE:
+            dati[chiave] = data_italiana(dati[chiave])
+        return dati
+
+    def lista(self) -> List[Dict[str, Any]]:
+        """Restituisce tutti i detentori ordinati per cognome e nome."""
+        return [self.to_dict(row) for row in self.db.fetchall(self.SQL_LISTA)]
+
+    def dati_codice_fiscale(self):
+        """(ID, Nome, Cognome, DataNascita, Sesso, LuogoNascita, CodiceFiscale) di tutti i detentori."""
+        return self.db.fetchall(self.SQL_DATI_CODICE_FISCALE)
+
+    def lista_colonne(self, filtri: Optional[Dict[str, str]] = None,
+                      ids: Optional[Iterable[int]] = None) -> List[List[Any]]:
+        """
+        Campi di CAMPI_LISTA_DETENTORE e CAMPI_RIEPILOGO_DETENTORE dei detentori, per colonne
+        (una lista per campo), ordinati per cognome e nome. Con i filtri restituisce solo i detentori
+        che contengono ciascun filtro nel campo corrispondente (senza distinzione tra maiuscole e
+        minuscole): i filtri di almeno 3 caratteri usano l'indice ricerca_detentori, gli altri LIKE.
+
+        Args:
+            filtri: cognome, nome, codiceFiscale, comuneResidenza; minimoArmi (numero minimo
+                di armi detenute), categoriaArma (almeno un'arma della categoria) e
+                scadenzaEntroGiorni (porto d'armi che scade tra oggi e i prossimi N giorni)
+            ids: Se indicati, solo i detentori con questi ID (per aggiornare le righe modificate)
+        """
+        origine, where_clause, params = self._condizioni_filtro(filtri or {}, ids)
+        # Tuple semplici invece di sqlite3.Row: le righe servono solo per essere distribuite nelle colonne
+        cursore = self.db.get_connection().cursor()
+        cursore.row_factory = None
+        cursore.execute(
+            f"SELECT {self.SQL_COLONNE_VISTA} FROM {origine} WHERE {where_clause} ORDER BY d.Cognome, d.Nome",
+            params)
+        campi = CAMPI_LISTA_DETENTORE + CAMPI_RIEPILOGO_DETENTORE
+        colonne = [[] for _ in campi]
+        ripetute = [chiave in self.CHIAVI_RIPETUTE for _, chiave in campi]
+        # A blocchi: non si tengono mai in memoria tutte le righe insieme alle colonne
+        while True:
+            righe = cursore.fetchmany(self.RIGHE_PER_BLOCCO)
+            if not righe:
+                break
+            for colonna, valori, interna in zip(colonne, zip(*righe), ripetute):
+                if interna:
+                    valori = [sys.intern(v) if isinstance(v, str) else v for v in valori]
+                colonna.extend(valori)
+        return colonne
+
+    def conta(self, filtri: Optional[Dict[str, str]] = None) -> int:
+        """Numero di detentori che soddisfano i filtri della lista (vedi lista_colonne)."""
+        origine, where_clause, params = self._condizioni_filtro(filtri or {})
+        return self.db.fetchone(f"SELECT COUNT(*) FROM {origine} WHERE {where_clause}", params)[0]
+
+    def blocchi_righe(self, chiavi: List[str], filtri: Optional[Dict[str, str]] = None,
+                      righe_per_blocco: Optional[int] = None):
+        """
+        Generatore di blocchi di righe (tuple con i campi in chiavi, vedi ESPRESSIONI_CAMPI)
+        dei detentori filtrati, ordinati per cognome e nome, letti dal cursore man mano:
+        in memoria c'è un blocco alla volta. Usa la connessione del thread che lo consuma.
+        """
+        origine, where_clause, params = self._condizioni_filtro(filtri or {})
+        colonne = ", ".join(self.ESPRESSIONI_CAMPI[chiave] for chiave in chiavi)
+        cursore = self.db.get_connection().cursor()
+        cursore.row_factory = None
+        cursore.execute(f"SELECT {colonne} FROM {origine} WHERE {where_clause} ORDER BY d.Cognome, d.Nome",
+                        params)
+        try:
+            while True:
+                righe = cursore.fetchmany(righe_per_blocco or self.RIGHE_PER_BLOCCO)
+                if not righe:
+                    break
+                yield righe
+        finally:
+            cursore.close()
+
+    def _condizioni_filtro(self, filtri: Dict[str, str], ids: Optional[Iterable[int]] = None):
+        """
+        (FROM, WHERE e parametri) della ricerca con i filtri della lista (vedi lista_colonne);
+        con soloPortoArmi vero restano solo i titolari di porto d'armi, con ids solo quei detentori.
+        """
+        fts = self.db.catalogo().colonne("ricerca_detentori")
+        match, brevi, params = [], [], []
+        where_clauses = []
+        if ids is not None:
+            ids = [int(i) for i in ids]
+            where_clauses.append(f"d.ID_Detentore IN ({', '.join('?' for _ in ids)})")
+            params.extend(ids)
+        if filtri.get("soloPortoArmi"):
+            where_clauses.append("COALESCE(d.NumeroPortoArmi, '') <> ''")
+        # Filtri sul riepilogo armi, serviti dagli indici di riepilogo_detentori e riepilogo_categorie
+        if filtri.get("minimoArmi"):
+            where_clauses.append("s.NumeroArmi >= ?")
+            params.append(int(filtri["minimoArmi"]))
+        if filtri.get("categoriaArma"):
+            where_clauses.append("d.ID_Detentore IN (SELECT c.ID_Detentore FROM riepilogo_categorie c "
+                                 "WHERE c.CategoriaArma = ?)")
+            params.append(filtri["categoriaArma"])
+        if filtri.get("scadenzaEntroGiorni"):
+            where_clauses.append("d.ScadenzaPortoArmi BETWEEN date('now', 'localtime') AND date('now', 'localtime', ?)")
+            params.append(f"+{int(filtri['scadenzaEntroGiorni'])} days")
+
+        for chiave, (colonna, colonna_fts) in self.COLONNE_FILTRO.items():
+            valore = (filtri.get(chiave) or "").strip()
+            if not valore:
+                continue
+            if fts and len(valore) >= self.LUNGHEZZA_MINIMA_FTS:
+                # Frase FTS5: le virgolette nel testo vanno raddoppiate
+                frase = valore.replace('"', '""')
+                match.append(f'{colonna_fts} : "{frase}"')
+            else:
+                brevi.append((colonna, colonna_fts))
+                escape = valore.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params.append(f"%{escape}%")
+
+        # Con MATCH i filtri brevi si applicano alle colonne dell'indice (solo sulle righe
+        # già trovate); su quelle di detentori il planner scandirebbe la tabella
+        for colonna, colonna_fts in brevi:
+            campo = f"r.{colonna_fts}" if match else f"d.{colonna}"
+            # LIKE non distingue già maiuscole e minuscole: LOWER() raddoppierebbe il costo della scansione
+            where_clauses.append(f"{campo} LIKE ? ESCAPE '\\'")
+        if match:
+            where_clauses.insert(0, "ricerca_detentori MATCH ?")
+            params.insert(0, " AND ".join(match))
+            # L'indice full-text guida il join (CROSS JOIN) e detentori si legge per rowid
+            # (NOT INDEXED): con statistiche vecchie il planner sceglierebbe altrimenti di
+            # scandire idx_detentori_cognome_nome per ogni riga trovata
+            origine = ("ricerca_detentori r CROSS JOIN detentori d NOT INDEXED ON d.ID_Detentore = r.rowid "
+                       "LEFT JOIN riepilogo_detentori s ON s.ID_Detentore = d.ID_Detentore")
+        elif filtri.get("minimoArmi"):
+            # Allo stesso modo idx_riepilogo_numero_armi guida la ricerca per numero di armi
+            origine = "riepilogo_detentori s CROSS JOIN detentori d NOT INDEXED ON d.ID_Detentore = s.ID_Detentore"
+        else:
+            origine = "detentori d LEFT JOIN riepilogo_detentori s ON s.ID_Detentore = d.ID_Detentore"
+        where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
+        return origine, where_clause, params
+
+    def get(self, detentore_id: int) -> Optional[Dict[str, Any]]:
+        """Restituisce il detentore con l'ID indicato o None."""
+        row = self.db.fetchone(self.SQL_GET, (detentore_id,))
+        return self.to_dict(row) if row else None
+
+    def get_anagrafica(self, detentore_id: int):
+        """Restituisce (Cognome, Nome, CodiceFiscale) del detentore o None."""
+        return self.db.fetchone(self.SQL_ANAGRAFICA, (detentore_id,))
+
+    def get_residenza(self, detentore_id: int):
+        """Restituisce (Comune, Sigla provincia, Tipo via, Via, Civico) della residenza o None."""
+        return self.db.fetchone(self.SQL_RESIDENZA, (detentore_id,))
+
+    def conta_armi(self, detentore_id: int) -> int:
+        return self.db.fetchone(self.SQL_CONTA_ARMI, (detentore_id,))[0]
+
+    def porti_in_scadenza(self, giorni: int):
+        """
+        Detentori il cui porto d'armi scade tra oggi e i prossimi giorni, in ordine di scadenza
+        (ricerca sull'indice idx_detentori_scadenza_porto, senza leggere gli altri detentori).
+        """
+        return self.db.fetchall(self.SQL_PORTI_IN_SCADENZA, (f"+{int(giorni)} days",))
+
+    def categorie_armi(self) -> List[str]:
+        """Categorie delle armi detenute, per il filtro categoriaArma della lista."""
+        return [row[0] for row in self.db.fetchall(self.SQL_CATEGORIE_ARMI)]
+
+    def salva(self, dati: Dict[str, Any], detentore_id: Optional[int] = None) -> int:
+        """
+        Inserisce un nuovo detentore o aggiorna quello esistente.
+
+        Args:
+            dati: Dizionario con le chiavi di CAMPI_DETENTORE (esclusa 'id')
+            detentore_id: ID del detentore da aggiornare, None per un inserimento
+
+        Returns:
+            ID del detentore salvato
+        """
+        valori = [data_iso(dati.get(chiave, '')) if chiave in CHIAVI_DATA_DETENTORE else dati.get(chiave, '')
+                  for _, chiave in CAMPI_DETENTORE[1:]]
+        if detentore_id:
+            self.db.esegui_scrittura(lambda conn: conn.execute(self.SQL_AGGIORNA, valori + [detentore_id]))
+            return detentore_id
+        return self.db.esegui_scrittura(lambda conn: conn.execute(self.SQL_INSERISCI, valori).lastrowid)
+
+    def elimina(self, detentore_id: int, con_armi: bool = False):
+        """Elimina il detentore; se con_armi è True elimina prima le armi associate."""
+        def scrittura(conn):
+            if con_armi:
+                conn.execute(self.SQL_ELIMINA_ARMI, (detentore_id,))
+            conn.execute(self.SQL_ELIMINA, (detentore_id,))
+
+        self.db.esegui_scrittura(scrittura)
+
+
+class ArmiRepository:
+    """Accesso alle tabelle armi e marche_armi."""
+
+    SQL_GET = f"SELECT {', '.join(COLONNE_ARMA)} FROM armi WHERE ID_ArmaDetenuta = ?"
+    SQL_PER_DETENTORE = """
+        SELECT ID_ArmaDetenuta, MarcaArma, ModelloArma, Matricola
+        FROM armi
+        WHERE ID_Detentore = ?
+        ORDER BY MarcaArma, ModelloArma
+    """
+    SQL_AGGIORNA_PROPRIETARIO = """
+        UPDATE armi
+        SET ID_Detentore = ?, TipoCedente = 'PERSONA FISICA'
+        WHERE ID_ArmaDetenuta = ?
+    """
+    SQL_LISTA_MARCHE = "SELECT NomeMarca FROM marche_armi ORDER BY NomeMarca"
+    SQL_STATO_PRODUZIONE = "SELECT StatoProduzione FROM marche_armi WHERE NomeMarca = ?"
+    SQL_INSERISCI_MARCA = "INSERT INTO marche_armi (NomeMarca, StatoProduzione) VALUES (?, ?)"
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    def get(self, arma_id: int) -> Optional[Dict[str, Any]]:
+        """Restituisce tutti i campi dell'arma come dizionario o None."""
+        row = self.db.fetchone(self.SQL_GET, (arma_id,))
+        return dict(zip(COLONNE_ARMA, row)) if row else None
+
+    def get_campi(self, arma_id: int, campi: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Restituisce solo i campi richiesti dell'arma (devono appartenere a COLONNE_ARMA)."""
+        campi = [c for c in campi if c in COLONNE_ARMA]
+        if not campi:
+            return {}
+        row = self.db.fetchone(f"SELECT {', '.join(campi)} FROM armi WHERE ID_ArmaDetenuta = ?", (arma_id,))
+        return dict(zip(campi, row)) if row else None
+
+    def lista_per_detentore(self, detentore_id: int):
+        """Restituisce (ID, Marca, Modello, Matricola) delle armi del detentore."""
+        return self.db.fetchall(self.SQL_PER_DETENTORE, (detentore_id,))
+
+    def righe_per_detentore(self, detentore_id: int, ids: Iterable[int]):
+        """(ID, Marca, Modello, Matricola) delle sole armi indicate che appartengono al detentore."""
+        ids = [int(i) for i in ids]
+        return self.db.fetchall(f"""
+            SELECT ID_ArmaDetenuta, MarcaArma, ModelloArma, Matricola
+            FROM armi
+            WHERE ID_ArmaDetenuta IN ({', '.join('?' for _ in ids)}) AND ID_Detentore = ?
+        """, ids + [detentore_id])
+
+    @staticmethod
+    def _valori(dati: Dict[str, Any], cols: List[str]) -> List[Any]:
+        """Valori delle colonne indicate, con le date nel formato del database."""
+        return [data_iso(dati[c]) if c in COLONNE_DATA["armi"] else dati[c] for c in cols]
+
+    def inserisci(self, dati: Dict[str, Any]) -> int:
+        """Inserisce una nuova arma; le chiavi di dati sono nomi di colonna della tabella armi."""
+        cols = [c for c in COLONNE_ARMA[1:] if c in dati]
+        sql = f"INSERT INTO armi ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        valori = self._valori(dati, cols)
+        return self.db.esegui_scrittura(lambda conn: conn.execute(sql, valori).lastrowid)
+
+    def aggiorna(self, arma_id: int, dati: Dict[str, Any]):
+        """Aggiorna i campi indicati dell'arma."""
+        cols = [c for c in COLONNE_ARMA[2:] if c in dati]
+        if not cols:
+            return
+        sql = f"UPDATE armi SET {', '.join(f'{c}=?' for c in cols)} WHERE ID_ArmaDetenuta=?"
+        valori = self._valori(dati, cols) + [arma_id]
+        self.db.esegui_scrittura(lambda conn: conn.execute(sql, valori))
+
+    def lista_marche(self) -> List[str]:
+        return [row[0] for row in self.db.fetchall(self.SQL_LISTA_MARCHE)]
+
+    def stato_produzione_marca(self, marca: str) -> Optional[str]:
+        """Restituisce lo stato di produzione della marca, None se la marca non esiste."""
+        row = self.db.fetchone(self.SQL_STATO_PRODUZIONE, (marca,))
+        if row is None:
+            return None
+        return row[0] or ""
+
+    def inserisci_marca(self, marca: str, stato_produzione: str):
+        self.db.esegui_scrittura(lambda conn: conn.execute(self.SQL_INSERISCI_MARCA, (marca, stato_produzione)))
+
+    def cerca(self, filtri: Dict[str, str]):
+        """
+        Cerca tra le armi attive.
+
+        Args:
+            filtri: marca, modello, matricola, calibro, tipo, detentore (cognome)
+
+        Returns:
+            Righe (ID, Marca, Modello, Matricola, Calibro, Tipo, Detentore, Stato)
+        """
+        where_clauses = []
+        params = []
+        for chiave, colonna in (("marca", "a.MarcaArma"), ("modello", "a.ModelloArma"),
+                                ("matricola", "a.Matricola"), ("calibro", "a.CalibroArma"),
+                                ("detentore", "d.Cognome")):
+            if filtri.get(chiave):
+                where_clauses.append(f"LOWER({colonna}) LIKE ?")
+                params.append(f"%{filtri[chiave].lower()}%")
+        if filtri.get("tipo"):
+            where_clauses.append("a.TipoArma = ?")
+            params.append(filtri["tipo"])
+
+        where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
+        query = f"""
+            SELECT a.ID_ArmaDetenuta, a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma,
+                   a.TipoArma, d.Cognome || ' ' || d.Nome, 'Attiva' as Stato
+            FROM armi a
+            LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
+            WHERE {where_clause}
+        """
+        return self.db.fetchall(query, params)
+
+    def dettagli_con_detentore(self, arma_id: int):
+        """Restituisce marca, modello, matricola, calibro, tipo e dati del detentore attuale."""
+        return self.db.fetchone("""
+            SELECT a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma, a.TipoArma,
+                   d.Cognome, d.Nome, d.CodiceFiscale
+            FROM armi a
+            LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
+            WHERE a.ID_ArmaDetenuta = ?
+        """, (arma_id,))
+
+
+class TrasferimentiRepository:
+    """Accesso alla tabella trasferimenti (storico movimenti ed eliminazioni)."""
+
+    SQL_STORICO_MATRICOLA = """
+        SELECT ID_Trasferimento, Data_Trasferimento, Motivo_Trasferimento,
+               Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
+               Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
+               Note
+        FROM trasferimenti
+        WHERE Matricola = ?
+        ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
+    """
+    SQL_STORICO_ARMA = """
+        SELECT ID_Trasferimento, Data_Trasferimento, Motivo_Trasferimento,
+               Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
+               Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
+               Note
+        FROM trasferimenti
+        WHERE ID_Arma = ?
+        ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
+    """
+    # L'ultima eliminazione di ogni matricola è mantenuta in stato_armi (migrazione 5)
+    SQL_ULTIMA_ELIMINAZIONE = """
+        SELECT t.MarcaArma, t.ModelloArma, t.Matricola, t.CalibroArma, t.TipoArma,
+               t.Motivo_Trasferimento, t.Data_Trasferimento, t.Note, t.ID_Arma
+        FROM stato_armi s
+        JOIN trasferimenti t ON t.ID_Trasferimento = s.ID_Eliminazione
+        WHERE s.Matricola = ?
+    """
+    SQL_STATO = """
+        SELECT Matricola, Stato, ID_Arma, ID_UltimoTrasferimento, ID_Eliminazione, DataEliminazione
+        FROM stato_armi
+        WHERE Matricola = ?
+    """
+    SQL_INSERISCI_ELIMINAZIONE = """
+        INSERT INTO trasferimenti
+        (ID_Arma, ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento,
+         Motivo_Trasferimento, Note, Timestamp_Registrazione,
+         MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma,
+         Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    SQL_ARMA_ELIMINAZIONE = """
+        SELECT TipoArma, MarcaArma, ModelloArma, Matricola, CalibroArma
+        FROM armi
+        WHERE ID_ArmaDetenuta = ?
+    """
+    SQL_ELIMINA_ARMA = "DELETE FROM armi WHERE ID_ArmaDetenuta = ?"
+
+    # Snapshot di arma, cedente e ricevente letto con un'unica query all'interno
+    # della transazione del trasferimento (sostituisce il trigger popolamento_dati_trasferimento)
+    SQL_SNAPSHOT_TRASFERIMENTO = """
+        SELECT a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma, a.TipoArma,
+               c.Cognome, c.Nome, c.CodiceFiscale,
+               r.Cognome, r.Nome, r.CodiceFiscale, a.ID_ArmaDetenuta
+        FROM (SELECT ? AS ID_Arma, ? AS ID_Cedente, ? AS ID_Ricevente) p
+        LEFT JOIN armi a ON a.ID_ArmaDetenuta = p.ID_Arma
+        LEFT JOIN detentori c ON c.ID_Detentore = p.ID_Cedente
+        LEFT JOIN detentori r ON r.ID_Detentore = p.ID_Ricevente
+    """
+    SQL_INSERISCI_TRASFERIMENTO = """
+        INSERT INTO trasferimenti
+        (ID_Arma, ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento,
+         Motivo_Trasferimento, Note, Timestamp_Registrazione,
+         MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma,
+         Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
+         Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
+         ID_DetentorePrecedente, ID_NuovoDetentore)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    SQL_CAMBIA_DETENTORE = """
+        UPDATE armi
+        SET ID_Detentore = ?, TipoCedente = 'PERSONA FISICA'
+        WHERE ID_ArmaDetenuta = ?
+    """
+
+    # ID_Detentore_Ricevente delle cessioni a soggetti non presenti in archivio
+    RICEVENTE_ESTERNO = -1
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    def storico_per_matricola(self, matricola: str):
+        return self.db.fetchall(self.SQL_STORICO_MATRICOLA, (matricola,))
+
+    def storico_per_arma(self, arma_id: int):
+        return self.db.fetchall(self.SQL_STORICO_ARMA, (arma_id,))
+
+    def storico_filtrato(self, matricola: Optional[str] = None, arma_id: Optional[int] = None,
+                         data_da: Optional[str] = None, data_a: Optional[str] = None,
+                         motivo: Optional[str] = None, testo: Optional[str] = None):
+        """
+        Storico dei movimenti della matricola (o dell'arma) con i filtri applicati in SQL.
+        L'intervallo di date usa gli indici (Matricola, Data_Trasferimento) e
+        (ID_Arma, Data_Trasferimento) perché le date sono in formato yyyy-MM-dd.
+
+        Args:
+            matricola: Matricola dell'arma (ha precedenza su arma_id)
+            arma_id: ID dell'arma
+            data_da, data_a: Estremi inclusi dell'intervallo (yyyy-MM-dd)
+            motivo: Motivo del trasferimento, None per tutti
+            testo: Testo cercato in cedente, ricevente, codici fiscali e note
+
+        Returns:
+            Righe con le stesse colonne di storico_per_matricola
+        """
+        if matricola:
+            where_clauses, params = ["Matricola = ?"], [matricola]
+        else:
+            where_clauses, params = ["ID_Arma = ?"], [arma_id]
+        if data_da:
+            where_clauses.append("Data_Trasferimento >= ?")
+            params.append(data_iso(data_da))
+        if data_a:
+            where_clauses.append("Data_Trasferimento <= ?")
+            params.append(data_iso(data_a))
+        if motivo:
+            where_clauses.append("UPPER(Motivo_Trasferimento) = UPPER(?)")
+            params.append(motivo)
+        if testo:
+            # Stesso testo mostrato dalle colonne della tabella (cognome e nome affiancati)
+            colonne_testo = ("Cedente_Cognome", "Cedente_Nome", "Cedente_CodiceFiscale",
+                             "Ricevente_Cognome", "Ricevente_Nome", "Ricevente_CodiceFiscale", "Note")
+            concatenate = " || ' ' || ".join(f"COALESCE({c}, '')" for c in colonne_testo)
+            # LIKE non distingue già maiuscole e minuscole; % e _ nel testo si cercano alla lettera
+            where_clauses.append(f"{concatenate} LIKE ? ESCAPE '\\'")
+            escape = testo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escape}%")
+
+        query = f"""
+            SELECT ID_Trasferimento, Data_Trasferimento, Motivo_Trasferimento,
+                   Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
+                   Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
+                   Note
+            FROM trasferimenti
+            WHERE {" AND ".join(where_clauses)}
+            ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
+        """
+        return self.db.fetchall(query, params)
+
+    def ultima_eliminazione(self, matricola: str):
+        """Restituisce la registrazione di eliminazione più recente per la matricola o None."""
+        return self.db.fetchone(self.SQL_ULTIMA_ELIMINAZIONE, (matricola,))
+
+    def stato(self, matricola: str):
+        """
+        Restituisce lo stato della matricola (Matricola, Stato, ID_Arma,
+        ID_UltimoTrasferimento, ID_Eliminazione, DataEliminazione) o None.
+        Stato vale 'ATTIVA', 'ELIMINATA' o 'NON PRESENTE'.
+        """
+        return self.db.fetchone(self.SQL_STATO, (matricola,))
+
+    def cerca_eliminate(self, filtri: Dict[str, str]):
+        """
+        Cerca tra le armi eliminate e non più attive (ultima eliminazione registrata per matricola).
+
+        Returns:
+            Righe (ID, Marca, Modello, Matricola, Calibro, Tipo, Detentore, Stato)
+        """
+        t_where_clauses = []
+        t_params = []
+        for chiave, colonna in (("marca", "t.MarcaArma"), ("modello", "t.ModelloArma"),
+                                ("matricola", "t.Matricola"), ("calibro", "t.CalibroArma")):
+            if filtri.get(chiave):
+                t_where_clauses.append(f"LOWER({colonna}) LIKE ?")
+                t_params.append(f"%{filtri[chiave].lower()}%")
+        if filtri.get("tipo"):
+            t_where_clauses.append("t.TipoArma = ?")
+            t_params.append(filtri["tipo"])
+        if filtri.get("detentore"):
+            t_where_clauses.append("(LOWER(t.Cedente_Cognome) LIKE ? OR LOWER(t.Ricevente_Cognome) LIKE ?)")
+            t_params.append(f"%{filtri['detentore'].lower()}%")
+            t_params.append(f"%{filtri['detentore'].lower()}%")
+
+        query = f"""
+            SELECT
+                t.ID_Arma as ID_ArmaDetenuta,
+                t.MarcaArma,
+                t.ModelloArma,
+                t.Matricola,
+                t.CalibroArma,
+                t.TipoArma,
+                t.Cedente_Cognome || ' ' || t.Cedente_Nome as Detentore,
+                'Cancellata (' || t.Data_Trasferimento || ')' as Stato
+            FROM stato_armi s
+            JOIN trasferimenti t ON t.ID_Trasferimento = s.ID_Eliminazione
+            WHERE {" AND ".join(["s.Stato = 'ELIMINATA'"] + t_where_clauses)}
+        """
+        return self.db.fetchall(query, t_params)
+
+    def registra(self, campi: Dict[str, Any], conn=None) -> int:
+        """
+        Inserisce una registrazione nella tabella trasferimenti.
+
+        Args:
+            campi: Dizionario colonna -> valore
+            conn: Connessione di una scrittura già in corso (opzionale)
+
+        Returns:
+            ID del trasferimento inserito
+        """
+        cols = list(campi)
+        sql = f"INSERT INTO trasferimenti ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        if conn is not None:
+            return conn.execute(sql, [campi[c] for c in cols]).lastrowid
+        return self.db.esegui_scrittura(lambda conn: conn.execute(sql, [campi[c] for c in cols]).lastrowid)
+
+    def registra_eliminazione(self, arma_id: int, detentore_id: int, note: str,
+                              data_trasferimento: str, timestamp: str, arma_fallback=None):
+        """
+        Registra l'eliminazione di un'arma nello storico ed elimina l'arma,
+        in un'unica transazione.
+
+        Args:
+            arma_id: ID dell'arma da eliminare
+            detentore_id: ID del detentore (cedente)
+            note: Motivo completo dell'eliminazione
+            data_trasferimento: Data dell'eliminazione (yyyy-MM-dd)
+            timestamp: Timestamp di registrazione
+            arma_fallback: Dati dell'arma da usare se non è più presente nella tabella armi
+        """
+        arma_fallback = arma_fallback or {}
+
+        def scrittura(conn):
+            detentore_data = conn.execute(DetentoriRepository.SQL_ANAGRAFICA, (detentore_id,)).fetchone()
+            arma_details = conn.execute(self.SQL_ARMA_ELIMINAZIONE, (arma_id,)).fetchone()
+
+            conn.execute(self.SQL_INSERISCI_ELIMINAZIONE, (
+                arma_id,  # ID_Arma
+                detentore_id,  # ID_Detentore_Cedente
+                -1,  # ID_Detentore_Ricevente (usiamo -1 come valore speciale per "eliminato")
+                data_trasferimento,  # Data_Trasferimento
+                "ELIMINAZIONE",  # Motivo_Trasferimento
+                note,  # Note (con il motivo completo)
+                timestamp,  # Timestamp_Registrazione
+                arma_details[1] if arma_details else arma_fallback.get('MarcaArma', ''),  # MarcaArma
+                arma_details[2] if arma_details else arma_fallback.get('ModelloArma', ''),  # ModelloArma
+                arma_details[3] if arma_details else arma_fallback.get('Matricola', ''),  # Matricola
+                arma_details[4] if arma_details else arma_fallback.get('CalibroArma', ''),  # CalibroArma
+                arma_details[0] if arma_details else arma_fallback.get('TipoArma', ''),  # TipoArma
+                detentore_data[0] if detentore_data else '',  # Cedente_Cognome
+                detentore_data[1] if detentore_data else '',  # Cedente_Nome
+                detentore_data[2] if detentore_data else ''  # Cedente_CodiceFiscale
+            ))
+
+            conn.execute(self.SQL_ELIMINA_ARMA, (arma_id,))
+
+        self.db.esegui_scrittura(scrittura)
+
+    @classmethod
+    def scrivi_trasferimento(cls, conn, arma_id: int, cedente_id: int, ricevente_id: Optional[int],
+                             data_trasferimento: str, motivo: str, note: str, timestamp: str,
+                             ricevente_esterno: Optional[Dict[str, str]] = None) -> int:
+        """
+        Registra il trasferimento su una connessione con la transazione già aperta:
+        una lettura congiunta di arma, cedente e ricevente, l'inserimento nello
+        storico e, per un ricevente in archivio, il cambio di detentore dell'arma.
+
+        Args:
+            conn: Connessione della scrittura in corso
+            arma_id: ID dell'arma trasferita
+            cedente_id: ID del detentore attuale
+            ricevente_id: ID del nuovo detentore, None se esterno all'archivio
+            data_trasferimento: Data del trasferimento (yyyy-MM-dd)
+            motivo: Motivo del trasferimento
+            note: Note
+            timestamp: Timestamp di registrazione
+            ricevente_esterno: Cognome, Nome e CodiceFiscale del ricevente esterno
+
+        Returns:
+            ID del trasferimento inserito
+        """
+        snapshot = conn.execute(cls.SQL_SNAPSHOT_TRASFERIMENTO,
+                                (arma_id, cedente_id, ricevente_id)).fetchone()
+        if snapshot[11] is None:
+            raise ValueError(f"Arma con ID {arma_id} non trovata")
+
+        if ricevente_id is None:
+            ricevente_esterno = ricevente_esterno or {}
+            ricevente = (ricevente_esterno.get('Cognome', ''), ricevente_esterno.get('Nome', ''),
+                         ricevente_esterno.get('CodiceFiscale', ''))
+        else:
+            ricevente = tuple(snapshot[8:11])
+
+        trasferimento_id = conn.execute(cls.SQL_INSERISCI_TRASFERIMENTO, (
+            arma_id,
+            cedente_id,
+            ricevente_id if ricevente_id is not None else cls.RICEVENTE_ESTERNO,
+            data_trasferimento,
+            motivo,
+            note,
+            timestamp,
+            *snapshot[0:5],  # Marca, Modello, Matricola, Calibro, Tipo
+            *snapshot[5:8],  # Cognome, Nome e CF del cedente
+            *ricevente,  # Cognome, Nome e CF del ricevente
+            cedente_id,  # ID_DetentorePrecedente
+            ricevente_id  # ID_NuovoDetentore (None per un ricevente esterno)
+        )).lastrowid
+
+        if ricevente_id is not None:
+            conn.execute(cls.SQL_CAMBIA_DETENTORE, (ricevente_id, arma_id))
+        return trasferimento_id
+
+    def registra_trasferimento(self, arma_id: int, cedente_id: int, ricevente_id: Optional[int],
+                               data_trasferimento: str, motivo: str, note: str, timestamp: str,
+                               ricevente_esterno: Optional[Dict[str, str]] = None) -> int:
+        """Registra il trasferimento in un'unica transazione (vedi scrivi_trasferimento)."""
+        return self.db.esegui_scrittura(
+            lambda conn: self.scrivi_trasferimento(conn, arma_id, cedente_id, ricevente_id,
+                                                   data_trasferimento, motivo, note, timestamp,
+                                                   ricevente_esterno))
+
+
+class RicercaArmiRepository:
+    """
+    Ricerca delle armi (attive ed eliminate) sull'indice full-text ricerca_armi.
+    Se l'indice non esiste o un filtro è più corto di 3 caratteri (minimo del
+    tokenizer trigram) si ricade sulle ricerche LIKE dei repository.
+    """
+
+    LUNGHEZZA_MINIMA = 3
+
+    # Campi di testo del filtro -> colonne dell'indice
+    COLONNE_FTS = {
+        "marca": "marca",
+        "modello": "modello",
+        "matricola": "matricola",
+        "calibro": "calibro",
+        "detentore": "detentore",
+    }
+
+    SQL_ATTIVE = """
+        SELECT a.ID_ArmaDetenuta, a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma,
+               a.TipoArma, d.Cognome || ' ' || d.Nome, 'Attiva' as Stato
+        FROM ricerca_armi r
+        JOIN armi a ON a.ID_ArmaDetenuta = r.rowid
+        LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
+        WHERE ricerca_armi MATCH ? AND r.rowid > 0 AND (? = '' OR a.TipoArma = ?)
+        ORDER BY r.rank
+    """
+
+    # Per le eliminate si tiene solo la registrazione più recente delle matricole
+    # non più attive, secondo stato_armi
+    SQL_ELIMINATE = """
+        SELECT t.ID_Arma, t.MarcaArma, t.ModelloArma, t.Matricola, t.CalibroArma, t.TipoArma,
+               t.Cedente_Cognome || ' ' || t.Cedente_Nome as Detentore,
+               'Cancellata (' || t.Data_Trasferimento || ')' as Stato
+        FROM ricerca_armi r
+        JOIN trasferimenti t ON t.ID_Trasferimento = -r.rowid
+        JOIN stato_armi s ON s.Matricola = t.Matricola AND s.ID_Eliminazione = t.ID_Trasferimento
+        WHERE ricerca_armi MATCH ? AND r.rowid < 0 AND (? = '' OR t.TipoArma = ?)
+          AND s.Stato = 'ELIMINATA'
+        ORDER BY r.rank
+    """
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    def disponibile(self) -> bool:
+        return bool(self.db.catalogo().colonne("ricerca_armi"))
+
+    @staticmethod
+    def _frase(testo: str) -> str:
+        # Le virgolette nel testo vanno raddoppiate all'interno di una frase FTS5
+        return '"' + testo.replace('"', '""') + '"'
+
+    def espressione_match(self, filtri: Dict[str, str]) -> Optional[str]:
+        """
+        Costruisce l'espressione MATCH (un filtro per colonna, in AND).
+        Restituisce None se l'indice non può rispondere a questi filtri.
+        """
+        parti = []
+        for chiave, colonna in self.COLONNE_FTS.items():
+            valore = (filtri.get(chiave) or "").strip()
+            if not valore:
+                continue
+            if len(valore) < self.LUNGHEZZA_MINIMA:
+                return None
+            parti.append(f"{colonna} : {self._frase(valore)}")
+        return " AND ".join(parti) if parti else None
+
+    def cerca(self, filtri: Dict[str, str], attive: bool = True, eliminate: bool = True):
+        """
+        Cerca le armi con i filtri indicati, ordinate per rilevanza.
+
+        Args:
+            filtri: marca, modello, matricola, calibro, tipo, detentore
+            attive: Include le armi attive
+            eliminate: Include le armi eliminate e non più attive
+
+        Returns:
+            Righe (ID, Marca, Modello, Matricola, Calibro, Tipo, Detentore, Stato)
+        """
+        tipo = filtri.get("tipo") or ""
+        match = self.espressione_match(filtri) if self.disponibile() else None
+
+        risultati = []
+        if attive:
+            if match:
+                risultati.extend(self.db.fetchall(self.SQL_ATTIVE, (match, tipo, tipo)))
+            else:
+                risultati.extend(ArmiRepository(self.db).cerca(filtri))
+        if eliminate:
+            if match:
+                risultati.extend(self.db.fetchall(self.SQL_ELIMINATE, (match, tipo, tipo)))
+            else:
+                risultati.extend(TrasferimentiRepository(self.db).cerca_eliminate(filtri))
+        return risultati
+
+    def cerca_per_matricole(self, matricole: List[str], tipo: str = "",
+                            attive: bool = True, eliminate: bool = True):
+        """
+        Armi con matricola (o matricola della canna) esattamente in elenco,
+        usato per risolvere i risultati della ricerca approssimata.
+
+        Returns:
+            Righe (ID, Marca, Modello, Matricola, Calibro, Tipo, Detentore, Stato, MatricolaCanna)
+        """
+        matricole = list(dict.fromkeys(m for m in matricole if m))
+        if not matricole:
+            return []
+        segnaposto = ", ".join("?" * len(matricole))
+        risultati = []
+        if attive:
+            risultati.extend(self.db.fetchall(f"""
+                SELECT a.ID_ArmaDetenuta, a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma,
+                       a.TipoArma, d.Cognome || ' ' || d.Nome, 'Attiva' as Stato, a.MatricolaCanna
+                FROM armi a
+                LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
+                WHERE (a.Matricola IN ({segnaposto}) OR a.MatricolaCanna IN ({segnaposto}))
+                  AND (? = '' OR a.TipoArma = ?)
+            """, matricole + matricole + [tipo, tipo]))
+        if eliminate:
+            risultati.extend(self.db.fetchall(f"""
+                SELECT t.ID_Arma, t.MarcaArma, t.ModelloArma, t.Matricola, t.CalibroArma, t.TipoArma,
+                       t.Cedente_Cognome || ' ' || t.Cedente_Nome as Detentore,
+                       'Cancellata (' || t.Data_Trasferimento || ')' as Stato, NULL
+                FROM stato_armi s
+                JOIN trasferimenti t ON t.ID_Trasferimento = s.ID_Eliminazione
+                WHERE s.Matricola IN ({segnaposto}) AND s.Stato = 'ELIMINATA'
+                  AND (? = '' OR t.TipoArma = ?)
+            """, matricole + [tipo, tipo]))
+        return risultati
+
+
+class ComuniRepository:
+    """Accesso alle tabelle di riferimento comuni e province."""
+
+    SQL_COMUNI = 'SELECT [Denominazione in italiano] FROM comuni'
+    SQL_PROVINCE = 'SELECT C15 FROM province'
+    # Dati completi per l'elenco in memoria (ElencoComuni), nell'ordine della tabella
+    SQL_ELENCO_COMUNI = """
+        SELECT [Denominazione in italiano], [Sigla automobilistica], [Codice Catastale del comune],
+               [Codice Comune formato alfanumerico], [Denominazione Regione], Campo12
+        FROM comuni
+        ORDER BY rowid
+    """
+    SQL_ELENCO_PROVINCE = 'SELECT C15, C16 FROM province ORDER BY rowid'
+    # Cambia quando cambiano i dati (trigger della migrazione 8) o lo schema delle tabelle
+    SQL_VERSIONE = """
+        SELECT (SELECT schema_version FROM pragma_schema_version),
+               (SELECT Versione FROM versioni_riferimento WHERE Tabella = 'comuni'),
+               (SELECT Versione FROM versioni_riferimento WHERE Tabella = 'province'),
+               (SELECT COUNT(*) FROM comuni),
+               (SELECT COUNT(*) FROM province)
+    """
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    def lista_comuni(self) -> List[str]:
+        rows = self.db.fetchall(self.SQL_COMUNI)
+        # Il primo record della tabella non è un comune
+        return [row[0].upper() for row in rows[1:] if row[0]]
+
+    def lista_province(self) -> List[str]:
+        return [row[0].upper() for row in self.db.fetchall(self.SQL_PROVINCE) if row[0]]
+
+    def elenco_comuni(self) -> List[tuple]:
+        """(nome, sigla, catastale, codice ISTAT, regione, provincia) di tutti i comuni."""
+        return [tuple(row) for row in self.db.fetchall(self.SQL_ELENCO_COMUNI)]
+
+    def elenco_province(self) -> List[tuple]:
+        """(nome, sigla) di tutte le province."""
+        return [tuple(row) for row in self.db.fetchall(self.SQL_ELENCO_PROVINCE)]
+
+    def versione(self) -> tuple:
+        """Versione corrente dei dati di comuni e province (per validare l'istantanea su disco)."""
+        return tuple(self.db.fetchone(self.SQL_VERSIONE))
+
+
+class RegistroModificheRepository:
+    """Lettura di registro_modifiche, scritto dai trigger della migrazione 12."""
+
+    SQL_ULTIMA = "SELECT COALESCE(MAX(ID_Modifica), 0) FROM registro_modifiche"
+    SQL_SUCCESSIVE = """
+        SELECT ID_Modifica, Tabella, Operazione, ID_Riga, ID_Detentore, ID_DetentorePrecedente
+        FROM registro_modifiche
+        WHERE ID_Modifica > ?
+        ORDER BY ID_Modifica
+        LIMIT ?
+    """
+    # Cambia quando un'altra connessione (anche di un'altra postazione) conferma una scrittura
+    SQL_VERSIONE_DATI = "PRAGMA data_version"
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+
+    def ultima(self) -> int:
+        """ID dell'ultima modifica registrata (0 se il registro è vuoto)."""
+        return self.db.fetchone(self.SQL_ULTIMA)[0]
+
+    def successive(self, id_modifica: int, limite: int) -> List[EventoModifica]:
+        """Al più limite modifiche successive a id_modifica, in ordine."""
+        return [EventoModifica(*row) for row in self.db.fetchall(self.SQL_SUCCESSIVE, (id_modifica, limite))]
+
+    def versione_dati(self) -> int:
+        return self.db.fetchone(self.SQL_VERSIONE_DATI)[0]
@@ -1,5 +1,3 @@
-import sqlite3
-import threading
 from datetime import datetime
 import os
 import sys
@@ -9,16 +7,19 @@ from PyQt5.QtWidgets import (
     QCompleter, QTableWidget, QGridLayout, QLabel, QScrollArea, QSizePolicy,
     QMessageBox, QHeaderView, QTableWidgetItem, QFileDialog
 )
-from docxtpl import DocxTemplate
-from PyQt5.QtCore import Qt, QSortFilterProxyModel, QStringListModel
+from PyQt5.QtCore import Qt, QSortFilterProxyModel, QStringListModel, QDate, QTimer
 from PyQt5.QtWidgets import QComboBox, QCompleter
 from Utility import get_comuni, get_province
 from PyQt5.QtCore import Qt
-from Utility import get_sigla_provincia, DateInputWidget
-from PyQt5.QtGui import QIcon, QTextDocument
-from PyQt5.QtPrintSupport import QPrinter, QPrintPreviewDialog #
+from Utility import get_sigla_provincia, DateInputWidget, modello_comuni, modello_province
+from Utility import indice_comuni, indice_province
+from IndiceTesto import IndiceTesto
+from PyQt5.QtGui import QIcon
 from Utility import UpperCaseLineEdit
-from GeneraDenuncia import crea_documento_denuncia
+from CodiceFiscale import decodifica_codice_fiscale
+# DatabaseManager è definito in Database.py; l'import lo mantiene disponibile anche da qui
+from Database import DatabaseManager, DetentoriRepository, ArmiRepository, TrasferimentiRepository
+from NotificheModifiche import bus_modifiche
 class InserisciDetentoreDialog(QDialog):
     def __init__(self, detentore_data=None, comuni=None, province=None):  # <-- CORREZIONE: Aggiunti comuni e province
         super().__init__()
@@ -65,6 +66,9 @@ class InserisciDetentoreDialog(QDialog):
             self.populate_fields(detentore_data)
             # Ricorda: self.carica_armi() è stato rimosso per il lazy loading
 
+        # Armi inserite, modificate o tolte (anche da altre postazioni) aggiornano solo le loro righe
+        bus_modifiche().modifiche.connect(self.applica_modifiche_armi)
+
     def create_dati_tab(self):
         """Crea la tab con i dati personali e di contatto del detentore"""
         self.tab_dati = QWidget()
@@ -93,18 +97,11 @@ class InserisciDetentoreDialog(QDialog):
         self.dataNascitaEdit.setDisplayFormat("dd/MM/yyyy")
 
         # --- INIZIO MODIFICA: Luogo Nascita ---
-        self.luogoNascitaCombo = QComboBox()  # Usa QComboBox standard
-        self.luogoNascitaCombo.setEditable(True)
-        self.luogoNascitaCombo.setInsertPolicy(QComboBox.NoInsert)  # Impedisce di aggiungere nuovi item
+        self.luogoNascitaCombo = FilterableComboBox()  # Filtra con l'indice dei comuni
         self.luogoNascitaCombo.setPlaceholderText("Digita per cercare il comune...")
 
-        # NON chiamare addItems() o setItems()!
-
-        completer_nascita = QCompleter(self.comuni_list, self)
-        completer_nascita.setCaseSensitivity(Qt.CaseInsensitive)
-        completer_nascita.setFilterMode(Qt.MatchContains)  # Cerca ovunque, non solo all'inizio
-        completer_nascita.setCompletionMode(QCompleter.PopupCompletion)
-        self.luogoNascitaCombo.setCompleter(completer_nascita)
+        # NON chiamare addItems() o setItems(): la combo usa il modello e l'indice condivisi dei comuni
+        self.luogoNascitaCombo.setItemsModel(modello_comuni(self.comuni_list), indice_comuni)
 
         self.luogoNascitaCombo.setCurrentIndex(-1)
         self.luogoNascitaCombo.clearEditText()
@@ -121,16 +118,9 @@ class InserisciDetentoreDialog(QDialog):
     def create_contact_widgets(self):
         """Crea i widget per i contatti"""
         # --- INIZIO MODIFICA: Comune Residenza ---
-        self.comuneResidenzaCombo = QComboBox()  # Usa QComboBox standard
-        self.comuneResidenzaCombo.setEditable(True)
-        self.comuneResidenzaCombo.setInsertPolicy(QComboBox.NoInsert)
+        self.comuneResidenzaCombo = FilterableComboBox()
         self.comuneResidenzaCombo.setPlaceholderText("Digita per cercare il comune...")
-
-        completer_residenza = QCompleter(self.comuni_list, self)
-        completer_residenza.setCaseSensitivity(Qt.CaseInsensitive)
-        completer_residenza.setFilterMode(Qt.MatchContains)
-        completer_residenza.setCompletionMode(QCompleter.PopupCompletion)
-        self.comuneResidenzaCombo.setCompleter(completer_residenza)
+        self.comuneResidenzaCombo.setItemsModel(modello_comuni(self.comuni_list), indice_comuni)
 
         self.comuneResidenzaCombo.setCurrentIndex(-1)
         self.comuneResidenzaCombo.clearEditText()
@@ -240,16 +230,9 @@ class InserisciDetentoreDialog(QDialog):
         self.enteRilascioEdit = UpperCaseLineEdit()
 
         # --- INIZIO MODIFICA: Provincia Ente Rilascio ---
-        self.provinciaEnteRilascioCombo = QComboBox()
-        self.provinciaEnteRilascioCombo.setEditable(True)
-        self.provinciaEnteRilascioCombo.setInsertPolicy(QComboBox.NoInsert)
+        self.provinciaEnteRilascioCombo = FilterableComboBox()
         self.provinciaEnteRilascioCombo.setPlaceholderText("Digita per cercare la provincia...")
-
-        completer_provincia = QCompleter(self.province_list, self)  # Usa province_list
-        completer_provincia.setCaseSensitivity(Qt.CaseInsensitive)
-        completer_provincia.setFilterMode(Qt.MatchContains)
-        completer_provincia.setCompletionMode(QCompleter.PopupCompletion)
-        self.provinciaEnteRilascioCombo.setCompleter(completer_provincia)
+        self.provinciaEnteRilascioCombo.setItemsModel(modello_province(self.province_list), indice_province)
 
         self.provinciaEnteRilascioCombo.setCurrentIndex(-1)
         self.provinciaEnteRilascioCombo.clearEditText()
@@ -261,16 +244,9 @@ class InserisciDetentoreDialog(QDialog):
         self.tipoLuogoDetenzioneEdit = UpperCaseLineEdit()
 
         # --- INIZIO MODIFICA: Comune Detenzione ---
-        self.comuneDetenzioneCombo = QComboBox()
-        self.comuneDetenzioneCombo.setEditable(True)
-        self.comuneDetenzioneCombo.setInsertPolicy(QComboBox.NoInsert)
+        self.comuneDetenzioneCombo = FilterableComboBox()
         self.comuneDetenzioneCombo.setPlaceholderText("Digita per cercare il comune...")
-
-        completer_detenzione = QCompleter(self.comuni_list, self)
-        completer_detenzione.setCaseSensitivity(Qt.CaseInsensitive)
-        completer_detenzione.setFilterMode(Qt.MatchContains)
-        completer_detenzione.setCompletionMode(QCompleter.PopupCompletion)
-        self.comuneDetenzioneCombo.setCompleter(completer_detenzione)
+        self.comuneDetenzioneCombo.setItemsModel(modello_comuni(self.comuni_list), indice_comuni)
 
         self.comuneDetenzioneCombo.setCurrentIndex(-1)
         self.comuneDetenzioneCombo.clearEditText()
@@ -290,16 +266,9 @@ class InserisciDetentoreDialog(QDialog):
         self.enteRilascioDocumentoEdit = UpperCaseLineEdit()
 
         # --- INIZIO MODIFICA: Comune Ente Rilascio Documento ---
-        self.comuneEnteRilascioDocumentoCombo = QComboBox()
-        self.comuneEnteRilascioDocumentoCombo.setEditable(True)
-        self.comuneEnteRilascioDocumentoCombo.setInsertPolicy(QComboBox.NoInsert)
+        self.comuneEnteRilascioDocumentoCombo = FilterableComboBox()
         self.comuneEnteRilascioDocumentoCombo.setPlaceholderText("Digita per cercare il comune...")
-
-        completer_ente_rilascio = QCompleter(self.comuni_list, self)
-        completer_ente_rilascio.setCaseSensitivity(Qt.CaseInsensitive)
-        completer_ente_rilascio.setFilterMode(Qt.MatchContains)
-        completer_ente_rilascio.setCompletionMode(QCompleter.PopupCompletion)
-        self.comuneEnteRilascioDocumentoCombo.setCompleter(completer_ente_rilascio)
+        self.comuneEnteRilascioDocumentoCombo.setItemsModel(modello_comuni(self.comuni_list), indice_comuni)
 
         self.comuneEnteRilascioDocumentoCombo.setCurrentIndex(-1)
         self.comuneEnteRilascioDocumentoCombo.clearEditText()
@@ -463,6 +432,8 @@ class InserisciDetentoreDialog(QDialog):
         self.comuneDetenzioneCombo.lineEdit().editingFinished.connect(self.update_sigla_provincia_detenzione)
 
         self.btnCalcolaCF.clicked.connect(self.calcola_codice_fiscale)
+        # Solo il testo digitato o incollato: i setText del programma non ricompilano i campi
+        self.codiceFiscaleEdit.textEdited.connect(self.precompila_da_codice_fiscale)
 
         # Double click su tabella
         self.armiTable.cellDoubleClicked.connect(self.modifica_arma)
@@ -566,13 +537,8 @@ class InserisciDetentoreDialog(QDialog):
                 self.comuneEnteRilascioDocumentoCombo.setEditText(data.get('comuneEnteRilascioDocumento'))
 
     def save_detentore(self):
-        """Salva o aggiorna i dati del detentore utilizzando la connessione persistente fornita dal DatabaseManager."""
+        """Salva o aggiorna i dati del detentore tramite il DetentoriRepository."""
         print("Salvataggio record Detentore in corso...")
-        from Detentori import DatabaseManager  # Assicurati che l'import sia corretto
-        db_manager = DatabaseManager()
-        conn = db_manager.get_connection()
-        cursor = conn.cursor()
-
         # Raccolta dati dai campi
         nome = self.nomeEdit.text()
         cognome = self.cognomeEdit.text()
@@ -605,57 +571,38 @@ class InserisciDetentoreDialog(QDialog):
         enteRilascioDocumento = self.enteRilascioDocumentoEdit.text()
         comuneEnteRilascioDocumento = self.comuneEnteRilascioDocumentoCombo.currentText()
 
+        dati = {
+            'nome': nome, 'cognome': cognome, 'fascicoloPersonale': fascicoloPersonale,
+            'dataNascita': dataNascita, 'luogoNascita': luogoNascita,
+            'siglaProvinciaNascita': siglaProvinciaNascita, 'sesso': sesso, 'codiceFiscale': codiceFiscale,
+            'comuneResidenza': comuneResidenza, 'siglaProvinciaResidenza': siglaProvinciaResidenza,
+            'tipoVia': tipoVia, 'via': via, 'civico': civico, 'telefono': telefono,
+            'tipologiaTitolo': tipologiaTitolo, 'enteRilascio': enteRilascio,
+            'provinciaEnteRilascio': provinciaEnteRilascio, 'dataRilascio': dataRilascio,
+            'numeroPortoArmi': numeroPortoArmi, 'tipoLuogoDetenzione': tipoLuogoDetenzione,
+            'comuneDetenzione': comuneDetenzione, 'siglaProvinciaDetenzione': siglaProvinciaDetenzione,
+            'tipoViaDetenzione': tipoViaDetenzione, 'viaDetenzione': viaDetenzione,
+            'civicoDetenzione': civicoDetenzione, 'tipoDocumento': tipoDocumento,
+            'numeroDocumento': numeroDocumento, 'dataRilascioDocumento': dataRilascioDocumento,
+            'enteRilascioDocumento': enteRilascioDocumento,
+            'comuneEnteRilascioDocumento': comuneEnteRilascioDocumento,
+        }
+
         try:
             if self.detentore_data and self.detentore_data.get('id'):
                 # UPDATE record esistente
-                cursor.execute("""
-                    UPDATE detentori
-                    SET Nome=?, Cognome=?, FascicoloPersonale=?, DataNascita=?, LuogoNascita=?, SiglaProvinciaNascita=?,
-                        Sesso=?, CodiceFiscale=?, ComuneResidenza=?, SiglaProvinciaResidenza=?, TipoVia=?, Via=?, Civico=?, Telefono=?,
-                        TipologiaTitolo=?, EnteRilascio=?, ProvinciaEnteRilascio=?, DataRilascio=?, NumeroPortoArmi=?, TipoLuogoDetenzione=?,
-                        ComuneDetenzione=?, SiglaProvinciaDetenzione=?, TipoViaDetenzione=?, ViaDetenzione=?, CivicoDetenzione=?,
-                        TipoDocumento=?, NumeroDocumento=?, DataRilascioDocumento=?, EnteRilascioDocumento=?, ComuneEnteRilascioDocumento=?
-                    WHERE ID_Detentore=?
-                """, (
-                    nome, cognome, fascicoloPersonale, dataNascita, luogoNascita, siglaProvinciaNascita, sesso,
-                    codiceFiscale, comuneResidenza, siglaProvinciaResidenza, tipoVia, via, civico, telefono,
-                    tipologiaTitolo, enteRilascio, provinciaEnteRilascio, dataRilascio, numeroPortoArmi,
-                    tipoLuogoDetenzione, comuneDetenzione, siglaProvinciaDetenzione,
-                    tipoViaDetenzione, viaDetenzione, civicoDetenzione, tipoDocumento, numeroDocumento,
-                    dataRilascioDocumento, enteRilascioDocumento, comuneEnteRilascioDocumento,
-                    self.detentore_data.get('id')
-                ))
-
+                DetentoriRepository().salva(dati, self.detentore_data.get('id'))
                 QMessageBox.information(self, "Successo", "Detentore aggiornato con successo!")
             else:
                 # INSERT nuovo record
-                cursor.execute("""
-                    INSERT INTO detentori (Nome, Cognome, FascicoloPersonale, DataNascita, LuogoNascita, SiglaProvinciaNascita,
-                        Sesso, CodiceFiscale, ComuneResidenza, SiglaProvinciaResidenza, TipoVia, Via, Civico, Telefono,
-                        TipologiaTitolo, EnteRilascio, ProvinciaEnteRilascio, DataRilascio, NumeroPortoArmi, TipoLuogoDetenzione,
-                        ComuneDetenzione, SiglaProvinciaDetenzione, TipoViaDetenzione, ViaDetenzione, CivicoDetenzione,
-                        TipoDocumento, NumeroDocumento, DataRilascioDocumento, EnteRilascioDocumento, ComuneEnteRilascioDocumento)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    nome, cognome, fascicoloPersonale, dataNascita, luogoNascita, siglaProvinciaNascita, sesso,
-                    codiceFiscale, comuneResidenza, siglaProvinciaResidenza, tipoVia, via, civico, telefono,
-                    tipologiaTitolo, enteRilascio, provinciaEnteRilascio, dataRilascio, numeroPortoArmi,
-                    tipoLuogoDetenzione, comuneDetenzione, siglaProvinciaDetenzione,
-                    tipoViaDetenzione, viaDetenzione, civicoDetenzione, tipoDocumento, numeroDocumento,
-                    dataRilascioDocumento, enteRilascioDocumento, comuneEnteRilascioDocumento
-                ))
-
+                DetentoriRepository().salva(dati)
                 QMessageBox.information(self, "Successo", "Nuovo detentore salvato con successo!")
 
-            conn.commit()
             self.accept()
 
         except Exception as e:
+            # Il rollback viene eseguito dalla transazione del repository
             QMessageBox.critical(self, "Errore", f"Si è verificato un errore durante il salvataggio: {str(e)}")
-            # Nel caso di errori, potresti voler effettuare un rollback
-            conn.rollback()
-
-        # Non chiudiamo qui la connessione perché la gestiamo centralmente
 
     def delete_detentore(self):
         """Elimina il detentore dal database"""
@@ -674,25 +621,14 @@ class InserisciDetentoreDialog(QDialog):
 
         if reply == QMessageBox.Yes:
             try:
-                # Importa DatabaseManager dal file Detentori.py
-                from Detentori import DatabaseManager
-                db_manager = DatabaseManager()
-                conn = db_manager.get_connection()
-                cursor = conn.cursor()
-
-                # Elimina prima le armi associate
-                cursor.execute("DELETE FROM armi WHERE ID_Detentore = ?", (self.detentore_data.get('id'),))
+                # Elimina prima le armi associate, poi il detentore (in un'unica transazione)
+                DetentoriRepository().elimina(self.detentore_data.get('id'), con_armi=True)
 
-                # Poi elimina il detentore
-                cursor.execute("DELETE FROM detentori WHERE ID_Detentore = ?", (self.detentore_data.get('id'),))
-
-                conn.commit()
                 QMessageBox.information(self, "Successo", "Detentore e armi associate eliminati con successo!")
                 self.accept()
 
             except Exception as e:
                 QMessageBox.critical(self, "Errore", f"Si è verificato un errore durante l'eliminazione: {str(e)}")
-            # Non chiudiamo la connessione qui per mantenere la connessione persistente gestita centralmente
 
     def modifica_arma_selected(self):
         """Modifica l'arma selezionata nella tabella"""
@@ -706,7 +642,6 @@ class InserisciDetentoreDialog(QDialog):
         """Apre la finestra di dialogo per modificare un'arma"""
         from PyQt5.QtWidgets import QDialog, QMessageBox
         from PyQt5.QtCore import Qt
-        from Detentori import DatabaseManager
         from ArmiDialog import ArmaDialog
 
         # Ottengo l'ID dell'arma selezionata
@@ -716,52 +651,18 @@ class InserisciDetentoreDialog(QDialog):
         arma_id = id_item.data(Qt.UserRole)
 
         try:
-            # Connessione al DB
-            db_manager = DatabaseManager()
-            conn = db_manager.get_connection()
-            cursor = conn.cursor()
-
-            # Lista esplicita dei campi in ordine (includo i nuovi alla fine)
-            columns = [
-                "ID_ArmaDetenuta", "ID_Detentore", "TipoArma", "MarcaArma", "ModelloArma",
-                "TipologiaArma", "Matricola", "CalibroArma", "MatricolaCanna", "LunghezzaCanna",
-                "NumeroCanne", "ArmaLungaCorta", "TipoCanna", "CategoriaArma", "FunzionamentoArma",
-                "CaricamentoArma", "PunzoniArma", "StatoProduzioneArma", "ExOrdDem",
-                "TipoMunizioni", "QuantitaMunizioni", "TipoBossolo", "TipoCedente", "NoteArma",
-                # campi cedente
-                "CognomeCedente", "NomeCedente", "DataNascitaCedente", "LuogoNascitaCedente",
-                "SiglaProvinciaResidenzaCedente", "ComuneResidenzaCedente",
-                "SiglaProvinciaNascitaCedente", "TipoViaResidenzaCedente",
-                "IndirizzoResidenzaCedente", "CivicoResidenzaCedente", "TelefonoCedente",
-                # data e luogo detenzione
-                "DataAcquisto", "ComuneDetenzione", "ProvinciaDetenzione",
-                "TipoViaDetenzione", "IndirizzoDetenzione", "CivicoDetenzione", "NoteDetenzione",
-                # i due nuovi campi
-                "NumeroCatalogo", "ClassificazioneEuropea"
-            ]
-
-            # Costruisco la SELECT con le colonne esplicite
-            sql = f"SELECT {','.join(columns)} FROM armi WHERE ID_ArmaDetenuta = ?"
-            cursor.execute(sql, (arma_id,))
-            row_data = cursor.fetchone()
-            if not row_data:
+            arma_data = ArmiRepository().get(arma_id)
+            if not arma_data:
                 QMessageBox.warning(self, "Attenzione", "Arma non trovata.")
                 return
 
-            # Mappo i valori al dizionario
-            arma_data = dict(zip(columns, row_data))
-
             # Apre il dialog di modifica/passaggio dati
             det_id = self.detentore_data.get('id') if self.detentore_data else None
             dialog = ArmaDialog(arma_data=arma_data, detentore_id=det_id)
-            if dialog.exec_() == QDialog.Accepted:
-                self.carica_armi()
+            dialog.exec_()
 
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore durante il caricamento dell'arma:\n{e}")
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def carica_armi(self):
         """Carica le armi del detentore nella tabella"""
@@ -773,22 +674,10 @@ class InserisciDetentoreDialog(QDialog):
             return
 
         try:
-            # Importa il singleton DatabaseManager dal file Detentori.py
-            from Detentori import DatabaseManager
-            db_manager = DatabaseManager()
-            conn = db_manager.get_connection()
-            cursor = conn.cursor()
             det_id = self.detentore_data.get('id')
             print(f"DEBUG - carica_armi: Caricamento armi per detentore ID={det_id}")
 
-            cursor.execute("""
-                SELECT ID_ArmaDetenuta, MarcaArma, ModelloArma, Matricola 
-                FROM armi 
-                WHERE ID_Detentore = ?
-                ORDER BY MarcaArma, ModelloArma
-            """, (det_id,))
-
-            rows = cursor.fetchall()
+            rows = ArmiRepository().lista_per_detentore(det_id)
             print(f"DEBUG - carica_armi: Trovate {len(rows)} armi")
 
             self.armiTable.setRowCount(len(rows))
@@ -801,16 +690,7 @@ class InserisciDetentoreDialog(QDialog):
                 print(
                     f"DEBUG - Arma {row_index + 1}: ID={id_arma}, Marca={marca}, Modello={modello}, Matricola={matricola}")
 
-                marca_item = QTableWidgetItem(marca)
-                modello_item = QTableWidgetItem(modello)
-                matricola_item = QTableWidgetItem(matricola)
-
-                # Salva l'ID dell'arma nel primo item tramite Qt.UserRole
-                marca_item.setData(Qt.UserRole, id_arma)
-
-                self.armiTable.setItem(row_index, 0, marca_item)
-                self.armiTable.setItem(row_index, 1, modello_item)
-                self.armiTable.setItem(row_index, 2, matricola_item)
+                self.imposta_riga_arma(row_index, id_arma, marca, modello, matricola)
 
             # Adatta le dimensioni delle colonne al contenuto
             self.armiTable.resizeColumnsToContents()
@@ -821,6 +701,69 @@ class InserisciDetentoreDialog(QDialog):
             traceback.print_exc()
             QMessageBox.critical(self, "Errore", f"Errore nel caricamento delle armi: {str(e)}")
 
+    def imposta_riga_arma(self, row_index, id_arma, marca, modello, matricola):
+        """Scrive marca, modello e matricola nella riga della tabella armi"""
+        marca_item = QTableWidgetItem(marca)
+        modello_item = QTableWidgetItem(modello)
+        matricola_item = QTableWidgetItem(matricola)
+
+        # Salva l'ID dell'arma nel primo item tramite Qt.UserRole
+        marca_item.setData(Qt.UserRole, id_arma)
+
+        self.armiTable.setItem(row_index, 0, marca_item)
+        self.armiTable.setItem(row_index, 1, modello_item)
+        self.armiTable.setItem(row_index, 2, matricola_item)
+
+    def applica_modifiche_armi(self, modifiche):
+        """Aggiorna nella tabella solo le armi del detentore che sono cambiate"""
+        # Tabella non ancora caricata (lazy loading): la leggerà per intero all'apertura della tab
+        if not self.armi_caricate or not self.detentore_data or not self.detentore_data.get('id'):
+            return
+        if modifiche.ricarica:
+            self.carica_armi()
+            return
+
+        det_id = self.detentore_data.get('id')
+        ids = modifiche.armi_di(det_id)
+        if not ids:
+            return
+        try:
+            rows = {row[0]: row for row in ArmiRepository().righe_per_detentore(det_id, ids)}
+        except Exception as e:
+            print(f"Errore nell'aggiornamento delle armi: {e}")
+            return
+
+        for id_arma in ids:
+            # Riga attuale dell'arma, tolta per rimetterla al posto giusto (o perché non è più del detentore)
+            for row_index in range(self.armiTable.rowCount()):
+                item = self.armiTable.item(row_index, 0)
+                if item is not None and item.data(Qt.UserRole) == id_arma:
+                    self.armiTable.removeRow(row_index)
+                    break
+            row = rows.get(id_arma)
+            if row is None:
+                continue
+            marca, modello, matricola = (valore if valore is not None else "" for valore in row[1:])
+            # Stesso ordine di carica_armi: marca, poi modello
+            row_index = 0
+            while row_index < self.armiTable.rowCount():
+                marca_item = self.armiTable.item(row_index, 0)
+                modello_item = self.armiTable.item(row_index, 1)
+                if (marca_item.text(), modello_item.text()) > (marca, modello):
+                    break
+                row_index += 1
+            self.armiTable.insertRow(row_index)
+            self.imposta_riga_arma(row_index, id_arma, marca, modello, matricola)
+        self.armiTable.resizeColumnsToContents()
+
+    def done(self, result):
+        # La finestra chiusa non segue più le modifiche
+        try:
+            bus_modifiche().modifiche.disconnect(self.applica_modifiche_armi)
+        except TypeError:
+            pass
+        super().done(result)
+
     def inserisci_arma(self):
         """Inserisce una nuova arma per il detentore"""
         if not self.detentore_data or not self.detentore_data.get('id'):
@@ -831,8 +774,7 @@ class InserisciDetentoreDialog(QDialog):
         from ArmiDialog import ArmaDialog
         det_id = self.detentore_data.get('id')
         dialog = ArmaDialog(arma_data=None, detentore_id=det_id)
-        if dialog.exec_() == QDialog.Accepted:
-            self.carica_armi()
+        dialog.exec_()
 
     def cancella_arma(self):
         """Elimina l'arma selezionata con lo stesso processo di ArmaDialog.delete_arma()"""
@@ -857,34 +799,14 @@ class InserisciDetentoreDialog(QDialog):
             return
 
         try:
-            # Importa il DatabaseManager dal file Detentori.py
-            from Detentori import DatabaseManager
-            db_manager = DatabaseManager()
-            conn = db_manager.get_connection()
-            cursor = conn.cursor()
-
             # Recupera i dati dell'arma
-            cursor.execute("""
-                SELECT ID_ArmaDetenuta, TipoArma, MarcaArma, ModelloArma, Matricola, CalibroArma 
-                FROM armi 
-                WHERE ID_ArmaDetenuta = ?
-            """, (arma_id,))
-            arma_data = cursor.fetchone()
+            arma_dict = ArmiRepository().get_campi(
+                arma_id, ["ID_ArmaDetenuta", "TipoArma", "MarcaArma", "ModelloArma", "Matricola", "CalibroArma"])
 
-            if not arma_data:
+            if not arma_dict:
                 QMessageBox.warning(self, "Attenzione", "Arma non trovata nel database.")
                 return
 
-            # Prepara il dizionario con i dati dell'arma
-            arma_dict = {
-                'ID_ArmaDetenuta': arma_data[0],
-                'TipoArma': arma_data[1],
-                'MarcaArma': arma_data[2],
-                'ModelloArma': arma_data[3],
-                'Matricola': arma_data[4],
-                'CalibroArma': arma_data[5]
-            }
-
             # Conferma eliminazione
             reply = QMessageBox.question(
                 self,
@@ -907,48 +829,15 @@ class InserisciDetentoreDialog(QDialog):
                 # Ottieni il motivo completo formattato
                 motivo_completo = dialogo_motivo.get_motivo_completo()
 
-                # Recupera i dati del detentore (cedente)
-                cursor.execute("""
-                    SELECT Cognome, Nome, CodiceFiscale 
-                    FROM detentori 
-                    WHERE ID_Detentore = ?
-                """, (detentore_id,))
-                detentore_data = cursor.fetchone()
-
                 # Ottieni la data corrente per il trasferimento
                 from PyQt5.QtCore import QDate, QDateTime
                 data_trasferimento = QDate.currentDate().toString("yyyy-MM-dd")
                 timestamp = QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
 
-                # Registra l'eliminazione nella tabella trasferimenti
-                cursor.execute("""
-                    INSERT INTO trasferimenti 
-                    (ID_Arma, ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento, 
-                     Motivo_Trasferimento, Note, Timestamp_Registrazione,
-                     MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma,
-                     Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    arma_id,  # ID_Arma
-                    detentore_id,  # ID_Detentore_Cedente
-                    -1,  # ID_Detentore_Ricevente (usiamo -1 come valore speciale per "eliminato")
-                    data_trasferimento,  # Data_Trasferimento
-                    "ELIMINAZIONE",  # Motivo_Trasferimento
-                    motivo_completo,  # Note
-                    timestamp,  # Timestamp_Registrazione
-                    arma_dict['MarcaArma'],  # MarcaArma
-                    arma_dict['ModelloArma'],  # ModelloArma
-                    arma_dict['Matricola'],  # Matricola
-                    arma_dict['CalibroArma'],  # CalibroArma
-                    arma_dict['TipoArma'],  # TipoArma
-                    detentore_data[0] if detentore_data else '',  # Cedente_Cognome
-                    detentore_data[1] if detentore_data else '',  # Cedente_Nome
-                    detentore_data[2] if detentore_data else ''  # Cedente_CodiceFiscale
-                ))
-
-                # Elimina l'arma dalla tabella armi
-                cursor.execute("DELETE FROM armi WHERE ID_ArmaDetenuta = ?", (arma_id,))
-                conn.commit()
+                # Registra l'eliminazione nella tabella trasferimenti ed elimina l'arma
+                TrasferimentiRepository().registra_eliminazione(
+                    arma_id, detentore_id, motivo_completo, data_trasferimento, timestamp,
+                    arma_fallback=arma_dict)
 
                 QMessageBox.information(
                     self,
@@ -956,15 +845,11 @@ class InserisciDetentoreDialog(QDialog):
                     "L'arma è stata eliminata con successo.\nMotivo registrato nello storico."
                 )
 
-                # Ricarica la tabella delle armi
-                self.carica_armi()
-
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Si è verificato un errore durante l'eliminazione: {str(e)}")
             print(f"Errore durante l'eliminazione dell'arma: {e}")
             import traceback
             traceback.print_exc()
-        # Non chiudiamo la connessione qui per mantenere la connessione persistente
 
     def update_sigla_provincia_nascita(self):
         """Aggiorna la sigla provincia di nascita in base al comune selezionato"""
@@ -1022,6 +907,26 @@ class InserisciDetentoreDialog(QDialog):
             # Gestisce eventuali eccezioni mostrando un messaggio di errore
             QMessageBox.critical(self, "Errore", f"Impossibile calcolare il codice fiscale:\n{e}")
 
+    def precompila_da_codice_fiscale(self, testo):
+        """Compila data, sesso, luogo e provincia di nascita da un codice fiscale completo"""
+        codice = testo.strip().upper()
+        if len(codice) != 16:
+            self.codiceFiscaleEdit.setToolTip("")
+            return
+
+        try:
+            dati = decodifica_codice_fiscale(codice)
+        except ValueError as e:
+            self.codiceFiscaleEdit.setToolTip(str(e))
+            return
+
+        self.codiceFiscaleEdit.setToolTip("Codice omocodico" if dati.omocodico else "")
+        self.dataNascitaEdit.setDate(QDate(dati.data_nascita.year, dati.data_nascita.month, dati.data_nascita.day))
+        self.sessoEdit.setText(dati.sesso)
+        if dati.comune:
+            self.luogoNascitaCombo.setEditText(dati.comune)
+            self.siglaProvinciaNascitaEdit.setText(dati.sigla)
+
     def stampa_denuncia_armi(self):
         """
         Chiama la funzione esterna per generare e salvare la denuncia.
@@ -1032,6 +937,9 @@ class InserisciDetentoreDialog(QDialog):
 
         detentore_id = self.detentore_data.get('id')
 
+        # GeneraDenuncia (con docxtpl e jinja2) viene caricato solo alla prima denuncia
+        from GeneraDenuncia import crea_documento_denuncia
+
         # Chiama la funzione esterna, passando l'ID e 'self' come parent_widget
         crea_documento_denuncia(detentore_id, self)
 
@@ -1048,74 +956,75 @@ class UpperCaseLineEdit(QLineEdit):
             self.setText(upper_text)
             self.blockSignals(False)
 
-class DatabaseManager:
-    _instance = None
-    _lock = threading.Lock()  # Per evitare problemi in ambienti multi-thread
-
-    def __new__(cls, db_path="gestione_armi.db"):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(DatabaseManager, cls).__new__(cls)
-                cls._instance._db_path = db_path
-                cls._instance._connection = None
-            return cls._instance
-
-    def get_connection(self):
-        """Restituisce la connessione attiva; la apre se non esiste già."""
-        if self._connection is None:
-            try:
-                self._connection = sqlite3.connect(self._db_path)
-                # Imposta eventualmente alcune opzioni utili, ad es. l'uso di row_factory per accedere ai campi per nome
-                self._connection.row_factory = sqlite3.Row
-            except Exception as e:
-                raise Exception(f"Errore durante l'apertura del database: {e}")
-        return self._connection
+class FilterableComboBox(QComboBox):
+    """
+    Combo modificabile che filtra gli elementi mentre si digita, cercando in un
+    IndiceTesto (prefissi con bisect, sottostringhe con gli n-grammi) invece di
+    far riesaminare tutti gli elementi a un proxy model a ogni tasto.
+    I suggerimenti mostrano prima i nomi che iniziano con il testo digitato.
+    """
 
-    def close_connection(self):
-        """Chiude la connessione, se esiste."""
-        if self._connection:
-            self._connection.close()
-            self._connection = None
+    # Attesa dopo l'ultimo tasto prima di filtrare: chi digita veloce fa una sola ricerca
+    RITARDO_FILTRO_MS = 100
+    MAX_SUGGERIMENTI = 200
 
-    def execute_query(self, query, params=()):
-        """
-        Esegue una query e restituisce il cursore.
-        Ricorda di gestire il commit se stai modificando dati.
-        """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(query, params)
-            return cursor
-        except Exception as e:
-            raise Exception(f"Errore durante l'esecuzione della query: {e}")
-
-class FilterableComboBox(QComboBox):
     def __init__(self, parent=None):
         super(FilterableComboBox, self).__init__(parent)
         self.setEditable(True)
-        # Imposta un modello di stringhe
-        self._model = QStringListModel()
-        # Imposta un proxy per il filtraggio
-        self._proxy_model = QSortFilterProxyModel(self)
-        self._proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
-        self._proxy_model.setSourceModel(self._model)
-        # Imposta il completer basato sul proxy model
-        self._completer = QCompleter(self._proxy_model, self)
-        self._completer.setCompletionMode(QCompleter.PopupCompletion)
+        self.setInsertPolicy(QComboBox.NoInsert)
+        self._indice = IndiceTesto([])
+        self._fonte_indice = None
+        # Il completer mostra solo i risultati della ricerca, già filtrati e ordinati
+        self._risultati = QStringListModel(self)
+        self._completer = QCompleter(self._risultati, self)
+        self._completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.setCompleter(self._completer)
-        # Collega l'evento per il filtraggio in tempo reale
-        self.lineEdit().textEdited.connect(self._filterItems)
+        self._timer_filtro = QTimer(self)
+        self._timer_filtro.setSingleShot(True)
+        self._timer_filtro.setInterval(self.RITARDO_FILTRO_MS)
+        self._timer_filtro.timeout.connect(self._filterItems)
+        # Collega l'evento per il filtraggio (ogni tasto riavvia l'attesa)
+        self.lineEdit().textEdited.connect(self._timer_filtro.start)
 
     def setItems(self, items):
-        """Imposta gli elementi nella comboBox e nel modello del completer."""
+        """Imposta gli elementi nella comboBox e ricostruisce l'indice di ricerca."""
         self.clear()
         self.addItems(items)
-        self._model.setStringList(items)
+        self._fonte_indice = None
+        self._indice = IndiceTesto(items)
 
-    def _filterItems(self, text):
-        """Aggiorna il filtro del proxy model in base al testo digitato."""
-        self._proxy_model.setFilterFixedString(text)
+    def setItemsModel(self, model, indice=None):
+        """
+        Usa un modello esistente (es. modello_comuni()) per la combo, senza copiarne gli elementi.
+        indice è la funzione che restituisce l'IndiceTesto corrispondente (es. indice_comuni),
+        richiamata anche quando il modello viene aggiornato; senza, l'indice è costruito dal modello.
+        """
+        if isinstance(self.model(), QStringListModel):
+            try:
+                self.model().modelReset.disconnect(self._aggiorna_indice)
+            except TypeError:
+                pass
+        self.setModel(model)
+        # setModel sostituisce il modello del completer: torna ai risultati della ricerca
+        self._completer.setModel(self._risultati)
+        self._fonte_indice = indice
+        model.modelReset.connect(self._aggiorna_indice)
+        self._aggiorna_indice()
+
+    def _aggiorna_indice(self):
+        if self._fonte_indice is not None:
+            self._indice = self._fonte_indice()
+        else:
+            self._indice = IndiceTesto(self.model().stringList())
+
+    def _filterItems(self):
+        """Cerca il testo digitato nell'indice e mostra i suggerimenti."""
+        testo = self.lineEdit().text()
+        self._risultati.setStringList(self._indice.cerca(testo, self.MAX_SUGGERIMENTI))
+        if testo.strip() and self._risultati.rowCount() and self.lineEdit().hasFocus():
+            self._completer.complete()
+        else:
+            self._completer.popup().hide()
 
 if __name__ == "__main__":
     import sys
@@ -1,31 +1,51 @@
 import sys
-import sqlite3
-import csv
-from datetime import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import (
-    QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+    QDialog, QProgressDialog, QSpinBox, QVBoxLayout, QHBoxLayout, QTableView, QAbstractItemView, QPushButton,
     QLabel, QLineEdit, QComboBox, QHeaderView, QGroupBox, QCheckBox, QFileDialog,
     QMessageBox, QSplitter, QFrame, QGridLayout, QToolButton, QMenu, QAction,
     QSpacerItem, QSizePolicy
 )
 from PyQt5.QtCore import Qt, QSize, QTimer
 from PyQt5.QtGui import QFont, QIcon, QPixmap, QColor
-from PyQt5.QtPrintSupport import QPrintPreviewDialog, QPrinter
+
+from Database import DatabaseManager, DetentoriRepository
+from EsportaDetentori import esporta_csv, EsportazioneAnnullata, TUTTI_I_CAMPI
+from NotificheModifiche import bus_modifiche
+from ModelloDetentori import (
+    DetentoriTableModel, DelegatoDetentori, RisultatoColonnare, CHIAVI_LISTA,
+    COLONNE_BASE, COLONNE_COMPLETE, CHIAVI_CENTRATE
+)
 
 
 class DetentoriListDialog(QDialog):
+    # Attesa dopo l'ultimo tasto nei campi di ricerca prima di filtrare
+    RITARDO_FILTRI_MS = 250
+    # Intervallo di aggiornamento della barra di avanzamento dell'esportazione
+    INTERVALLO_ESPORTAZIONE_MS = 100
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Gestione Detentori")
         self.resize(1200, 700)
         self.setWindowFlags(self.windowFlags() | Qt.WindowMaximizeButtonHint | Qt.WindowMinimizeButtonHint)
 
-        self.detentori = []
-        self.filtered_detentori = []
+        # Risultati per colonne con i soli campi della lista (RisultatoColonnare)
+        self.detentori = RisultatoColonnare(CHIAVI_LISTA, [])
+        self.filtered_detentori = self.detentori
+        # Filtri con cui è stato letto filtered_detentori, per aggiornarne le righe modificate
+        self.shown_filters = {}
+        # Ultima ricerca: se i nuovi filtri la allungano si restringe il suo risultato
+        self.last_filters = None
+        self.last_filtered = None
         self.current_sort_column = 1  # Default ordinamento per cognome
         self.sort_order = Qt.AscendingOrder
 
         self.setup_ui()
+        # Le modifiche (di questa e delle altre postazioni) aggiornano solo le righe interessate
+        bus_modifiche().modifiche.connect(self.applica_modifiche)
         self.load_detentori_from_db()
         self.populate_table()
 
@@ -70,14 +90,42 @@ class DetentoriListDialog(QDialog):
         filter_layout.addWidget(self.search_comune_label, 1, 2)
         filter_layout.addWidget(self.search_comune, 1, 3)
 
+        # Terza riga: filtri sul riepilogo delle armi detenute
+        self.min_armi_label = QLabel("Armi (almeno):")
+        self.min_armi = QSpinBox()
+        self.min_armi.setRange(0, 9999)
+        self.min_armi.setSpecialValueText("Qualsiasi numero")
+        filter_layout.addWidget(self.min_armi_label, 2, 0)
+        filter_layout.addWidget(self.min_armi, 2, 1)
+
+        self.categoria_armi_label = QLabel("Categoria arma:")
+        self.categoria_armi = QComboBox()
+        self.categoria_armi.addItem("Tutte", "")
+        try:
+            for categoria in DetentoriRepository().categorie_armi():
+                self.categoria_armi.addItem(categoria, categoria)
+        except Exception as e:
+            print(f"Errore nel caricamento delle categorie delle armi: {e}")
+        filter_layout.addWidget(self.categoria_armi_label, 2, 2)
+        filter_layout.addWidget(self.categoria_armi, 2, 3)
+
+        # Quarta riga: porti d'armi in scadenza (ricerca sull'indice della data di scadenza)
+        self.scadenza_label = QLabel("Porto in scadenza entro:")
+        self.scadenza_giorni = QSpinBox()
+        self.scadenza_giorni.setRange(0, 3650)
+        self.scadenza_giorni.setSuffix(" giorni")
+        self.scadenza_giorni.setSpecialValueText("Qualsiasi scadenza")
+        filter_layout.addWidget(self.scadenza_label, 3, 0)
+        filter_layout.addWidget(self.scadenza_giorni, 3, 1)
+
         # Pulsanti per filtri
         self.btn_apply_filters = QPushButton("Applica Filtri")
         self.btn_apply_filters.setIcon(QIcon.fromTheme("system-search"))
         self.btn_reset_filters = QPushButton("Reimposta Filtri")
         self.btn_reset_filters.setIcon(QIcon.fromTheme("edit-clear"))
 
-        filter_layout.addWidget(self.btn_apply_filters, 2, 1)
-        filter_layout.addWidget(self.btn_reset_filters, 2, 3)
+        filter_layout.addWidget(self.btn_apply_filters, 4, 1)
+        filter_layout.addWidget(self.btn_reset_filters, 4, 3)
 
         filter_group.setLayout(filter_layout)
         main_layout.addWidget(filter_group)
@@ -101,19 +149,23 @@ class DetentoriListDialog(QDialog):
 
         main_layout.addLayout(table_header)
 
-        # Tabella
-        self.table = QTableWidget()
+        # Tabella: modello con le righe a pagine e delegate per i colori
+        self.table = QTableView()
+        self.model = DetentoriTableModel(self)
+        self.table.setModel(self.model)
+        self.table.setItemDelegate(DelegatoDetentori(self.table))
         self.table.setAlternatingRowColors(True)
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSortIndicator(self.current_sort_column, self.sort_order)
         self.table.setSortingEnabled(True)
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 gridline-color: #d0d0d0;
                 selection-background-color: #0078d7;
                 selection-color: white;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 6px;
                 border-bottom: 1px solid #eaeaea;
             }
@@ -152,7 +204,11 @@ class DetentoriListDialog(QDialog):
         # Pulsanti aggiuntivi
         self.export_button = QPushButton("Esporta")
         self.export_button.setIcon(QIcon.fromTheme("document-save-as"))
-        self.export_button.setToolTip("Esporta i detentori selezionati in CSV")
+        self.export_button.setToolTip("Esporta in CSV i detentori che soddisfano i filtri")
+        export_menu = QMenu(self.export_button)
+        export_menu.addAction("Colonne visualizzate...", lambda: self.export_csv(tutti_i_campi=False))
+        export_menu.addAction("Tutti i campi...", lambda: self.export_csv(tutti_i_campi=True))
+        self.export_button.setMenu(export_menu)
         actions_layout.addWidget(self.export_button)
 
         self.print_button = QPushButton("Stampa")
@@ -173,23 +229,29 @@ class DetentoriListDialog(QDialog):
 
         # Collegamenti segnali
         self.btn_apply_filters.clicked.connect(self.apply_filters)
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.RITARDO_FILTRI_MS)
+        self.filter_timer.timeout.connect(self.apply_filters)
+        for campo in (self.search_cognome, self.search_nome, self.search_cf, self.search_comune):
+            campo.textEdited.connect(self.filter_timer.start)
+        self.min_armi.valueChanged.connect(self.filter_timer.start)
+        self.categoria_armi.currentIndexChanged.connect(self.filter_timer.start)
+        self.scadenza_giorni.valueChanged.connect(self.filter_timer.start)
         self.btn_reset_filters.clicked.connect(self.reset_filters)
         self.view_mode.currentIndexChanged.connect(self.change_view_mode)
-        self.table.itemSelectionChanged.connect(self.update_button_states)
-        self.table.itemDoubleClicked.connect(self.edit_detentore)
+        self.table.selectionModel().selectionChanged.connect(self.update_button_states)
+        self.table.doubleClicked.connect(self.edit_detentore)
 
         self.new_button.clicked.connect(self.new_detentore)
         self.edit_button.clicked.connect(self.edit_selected_detentore)
         self.delete_button.clicked.connect(self.delete_selected_detentore)
-        self.export_button.clicked.connect(self.export_csv)
         self.print_button.clicked.connect(self.print_preview)
         self.close_button.clicked.connect(self.accept)
 
     def setup_table_columns(self):
         # Definiamo le colonne della tabella in modalità base
-        columns = ["ID", "Cognome", "Nome", "Codice Fiscale", "Comune Residenza", "Telefono"]
-        self.table.setColumnCount(len(columns))
-        self.table.setHorizontalHeaderLabels(columns)
+        self.model.imposta_colonne(COLONNE_BASE)
 
         # Imposta la larghezza delle colonne
         header = self.table.horizontalHeader()
@@ -199,109 +261,107 @@ class DetentoriListDialog(QDialog):
         header.setSectionResizeMode(3, QHeaderView.ResizeToContents)  # CF
         header.setSectionResizeMode(4, QHeaderView.Stretch)  # Comune
         header.setSectionResizeMode(5, QHeaderView.ResizeToContents)  # Telefono
+        header.setSectionResizeMode(6, QHeaderView.ResizeToContents)  # Armi
 
         self.table.verticalHeader().setVisible(False)
 
     def load_detentori_from_db(self):
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM detentori ORDER BY Cognome, Nome")
-            rows = cursor.fetchall()
-            conn.close()
-
-            # Nomi delle colonne dal database
-            columns = ["id", "nome", "cognome", "fascicoloPersonale", "dataNascita", "luogoNascita",
-                       "siglaProvinciaNascita", "sesso", "codiceFiscale", "comuneResidenza", "siglaProvinciaResidenza",
-                       "tipoVia", "via", "civico", "telefono", "tipologiaTitolo", "enteRilascio",
-                       "provinciaEnteRilascio",
-                       "dataRilascio", "numeroPortoArmi", "tipoLuogoDetenzione", "comuneDetenzione",
-                       "siglaProvinciaDetenzione",
-                       "tipoViaDetenzione", "viaDetenzione", "civicoDetenzione", "tipoDocumento", "numeroDocumento",
-                       "dataRilascioDocumento", "enteRilascioDocumento", "comuneEnteRilascioDocumento"]
-
-            self.detentori = []
-            for row in rows:
-                self.detentori.append(dict(zip(columns, row)))
-
-            self.filtered_detentori = self.detentori.copy()
+            self.detentori = RisultatoColonnare(CHIAVI_LISTA, DetentoriRepository().lista_colonne())
+            self.last_filters = self.last_filtered = None
+
+            self.filtered_detentori = self.detentori
+            self.shown_filters = {}
             self.update_status(f"Caricati {len(self.detentori)} detentori")
             self.results_count_label.setText(f"Detentori trovati: {len(self.detentori)}")
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nel caricamento dei detentori:\n{e}")
 
     def populate_table(self):
-        self.table.setRowCount(0)  # Resetta la tabella
-        self.table.setSortingEnabled(False)  # Disabilita temporaneamente il sorting
-
-        # Popola la tabella in base alla modalità di visualizzazione corrente
-        view_index = self.view_mode.currentIndex()
-
-        for row_idx, det in enumerate(self.filtered_detentori):
-            self.table.insertRow(row_idx)
-
-            # Campi base sempre presenti
-            id_item = QTableWidgetItem(str(det['id']))
-            id_item.setTextAlignment(Qt.AlignCenter)
-            self.table.setItem(row_idx, 0, id_item)
-
-            self.table.setItem(row_idx, 1, QTableWidgetItem(det['cognome'] or ""))
-            self.table.setItem(row_idx, 2, QTableWidgetItem(det['nome'] or ""))
-
-            cf_item = QTableWidgetItem(det['codiceFiscale'] or "")
-            cf_item.setTextAlignment(Qt.AlignCenter)
-            self.table.setItem(row_idx, 3, cf_item)
+        # Il modello riceve i dati per colonne e li consegna alla vista a pagine
+        self.model.imposta_dati(self.filtered_detentori)
 
-            comune_item = QTableWidgetItem(det['comuneResidenza'] or "")
-            if det['siglaProvinciaResidenza']:
-                comune_item.setText(f"{det['comuneResidenza']} ({det['siglaProvinciaResidenza']})")
-            self.table.setItem(row_idx, 4, comune_item)
-
-            tel_item = QTableWidgetItem(det['telefono'] or "")
-            tel_item.setTextAlignment(Qt.AlignCenter)
-            self.table.setItem(row_idx, 5, tel_item)
-
-            # Aggiunge icone o indicazioni visive in base a determinate proprietà
-            if det['numeroPortoArmi']:
-                id_item.setForeground(QColor(0, 128, 0))  # Verde per detentori con porto d'armi
-
-            # Colora di grigio i detentori senza codice fiscale o dati incompleti
-            if not det['codiceFiscale'] or not det['comuneResidenza']:
-                for col in range(self.table.columnCount()):
-                    cell = self.table.item(row_idx, col)
-                    cell.setForeground(QColor(128, 128, 128))
-
-        self.table.setSortingEnabled(True)
+        # Riapplica l'ordinamento scelto dall'utente
+        header = self.table.horizontalHeader()
+        self.model.sort(header.sortIndicatorSection(), header.sortIndicatorOrder())
         self.update_button_states()
 
+    def current_filters(self):
+        return {
+            'cognome': self.search_cognome.text().strip(),
+            'nome': self.search_nome.text().strip(),
+            'codiceFiscale': self.search_cf.text().strip(),
+            'comuneResidenza': self.search_comune.text().strip(),
+            'minimoArmi': self.min_armi.value(),
+            'categoriaArma': self.categoria_armi.currentData() or '',
+            'scadenzaEntroGiorni': self.scadenza_giorni.value(),
+        }
+
+    def can_narrow(self, filters):
+        """True se ogni filtro allunga quello della ricerca precedente (il risultato può solo restringersi)"""
+        # Senza filtri precedenti il risultato è l'elenco intero: meglio l'indice del database
+        if self.last_filtered is None or not any(self.last_filters.values()):
+            return False
+        # Categoria e scadenza non si verificano in memoria: solo se sono le stesse della ricerca precedente
+        if (filters['categoriaArma'] != self.last_filters['categoriaArma']
+                or filters['scadenzaEntroGiorni'] != self.last_filters['scadenzaEntroGiorni']
+                or filters['minimoArmi'] < self.last_filters['minimoArmi']):
+            return False
+        return all(filters[chiave].lower().startswith(self.last_filters[chiave].lower())
+                   for chiave in DetentoriRepository.COLONNE_FILTRO)
+
     def apply_filters(self):
-        cognome_filter = self.search_cognome.text().lower()
-        nome_filter = self.search_nome.text().lower()
-        cf_filter = self.search_cf.text().lower()
-        comune_filter = self.search_comune.text().lower()
-
-        self.filtered_detentori = []
-        for det in self.detentori:
-            if (cognome_filter == "" or cognome_filter in (det['cognome'] or "").lower()) and \
-                    (nome_filter == "" or nome_filter in (det['nome'] or "").lower()) and \
-                    (cf_filter == "" or cf_filter in (det['codiceFiscale'] or "").lower()) and \
-                    (comune_filter == "" or comune_filter in (det['comuneResidenza'] or "").lower()):
-                self.filtered_detentori.append(det)
+        self.filter_timer.stop()
+        filters = self.current_filters()
+        start = time.perf_counter()
+
+        if not any(filters.values()):
+            self.filtered_detentori = self.detentori
+            source = "elenco completo"
+        elif self.can_narrow(filters):
+            # Confronto in memoria solo sulle righe della ricerca precedente
+            righe = None
+            for chiave in DetentoriRepository.COLONNE_FILTRO:
+                if filters[chiave]:
+                    righe = self.last_filtered.righe_con(chiave, filters[chiave], righe)
+            if filters['minimoArmi']:
+                righe = self.last_filtered.righe_almeno('numeroArmi', filters['minimoArmi'], righe)
+            # Filtri identici ai precedenti (es. solo la stessa categoria): stesso risultato
+            self.filtered_detentori = self.last_filtered if righe is None else self.last_filtered.sottoinsieme(righe)
+            source = "ristretta la ricerca precedente"
+        else:
+            try:
+                colonne = DetentoriRepository().lista_colonne(filters)
+            except Exception as e:
+                QMessageBox.critical(self, "Errore", f"Errore nella ricerca dei detentori:\n{e}")
+                return
+            self.filtered_detentori = RisultatoColonnare(CHIAVI_LISTA, colonne)
+            source = "database"
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_filters, self.last_filtered = filters, self.filtered_detentori
+        self.shown_filters = filters
 
         self.populate_table()
         self.results_count_label.setText(f"Detentori trovati: {len(self.filtered_detentori)}")
 
         if len(self.filtered_detentori) == 0:
-            self.update_status("Nessun detentore corrisponde ai criteri di ricerca")
+            self.update_status(f"Nessun detentore corrisponde ai criteri di ricerca ({elapsed_ms:.0f} ms)")
         else:
-            self.update_status(f"Trovati {len(self.filtered_detentori)} detentori")
+            self.update_status(f"Trovati {len(self.filtered_detentori)} detentori in {elapsed_ms:.0f} ms ({source})")
 
     def reset_filters(self):
         self.search_cognome.clear()
         self.search_nome.clear()
         self.search_cf.clear()
         self.search_comune.clear()
-        self.filtered_detentori = self.detentori.copy()
+        self.min_armi.setValue(0)
+        self.categoria_armi.setCurrentIndex(0)
+        self.scadenza_giorni.setValue(0)
+        self.filter_timer.stop()
+        self.last_filters = self.last_filtered = None
+        self.filtered_detentori = self.detentori
+        self.shown_filters = {}
         self.populate_table()
         self.results_count_label.setText(f"Detentori trovati: {len(self.detentori)}")
         self.update_status("Filtri reimpostati")
@@ -311,41 +371,51 @@ class DetentoriListDialog(QDialog):
         if index == 0:  # Base
             self.setup_table_columns()
         elif index == 1:  # Completa
-            columns = ["ID", "Cognome", "Nome", "Codice Fiscale", "Data Nascita", "Luogo Nascita",
-                       "Comune Residenza", "Indirizzo", "Telefono", "Porto d'Armi", "Scadenza"]
-            self.table.setColumnCount(len(columns))
-            self.table.setHorizontalHeaderLabels(columns)
+            self.model.imposta_colonne(COLONNE_COMPLETE)
         elif index == 2:  # Solo porto d'armi
-            self.filtered_detentori = [det for det in self.detentori if det['numeroPortoArmi']]
+            porto = self.detentori.colonna('numeroPortoArmi')
+            self.filtered_detentori = self.detentori.sottoinsieme(r for r in range(len(self.detentori)) if porto[r])
+            self.shown_filters = {'soloPortoArmi': True}
             self.setup_table_columns()
             self.results_count_label.setText(f"Detentori trovati: {len(self.filtered_detentori)}")
 
         self.populate_table()
 
     def update_button_states(self):
-        has_selection = len(self.table.selectedItems()) > 0
+        has_selection = self.table.selectionModel().hasSelection()
         self.edit_button.setEnabled(has_selection)
         self.delete_button.setEnabled(has_selection)
 
+    def selected_row(self):
+        """Riga (nell'ordine della vista) del primo detentore selezionato, None se non c'è selezione"""
+        rows = self.table.selectionModel().selectedRows()
+        return rows[0].row() if rows else None
+
     def new_detentore(self):
         try:
             from Detentori import InserisciDetentoreDialog
             dialog = InserisciDetentoreDialog()
             if dialog.exec_() == QDialog.Accepted:
-                self.load_detentori_from_db()
-                self.reset_filters()
                 self.update_status("Nuovo detentore aggiunto con successo")
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nell'apertura del form di inserimento:\n{e}")
 
+    def load_detentore(self, id_detentore):
+        """Record completo del detentore per la finestra di modifica (None se non esiste più)"""
+        try:
+            return DetentoriRepository().get(id_detentore)
+        except Exception as e:
+            QMessageBox.critical(self, "Errore", f"Errore nel caricamento del detentore:\n{e}")
+            return None
+
     def edit_selected_detentore(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             return
 
-        row = selected_items[0].row()
-        id_detentore = int(self.table.item(row, 0).text())
-        detentore = next((det for det in self.filtered_detentori if det['id'] == id_detentore), None)
+        id_detentore = self.model.id_detentore(row)
+        # La lista ha solo i campi mostrati: il record completo si legge ora
+        detentore = self.load_detentore(id_detentore)
 
         if not detentore:
             QMessageBox.warning(self, "Attenzione", "Detentore non trovato")
@@ -355,16 +425,14 @@ class DetentoriListDialog(QDialog):
             from Detentori import InserisciDetentoreDialog
             dialog = InserisciDetentoreDialog(detentore_data=detentore)
             if dialog.exec_() == QDialog.Accepted:
-                self.load_detentori_from_db()
-                self.apply_filters()  # Mantieni i filtri attivi
                 self.update_status("Detentore aggiornato con successo")
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nell'apertura del form di modifica:\n{e}")
 
-    def edit_detentore(self, item):
-        row = item.row()
-        id_detentore = int(self.table.item(row, 0).text())
-        detentore = next((det for det in self.filtered_detentori if det['id'] == id_detentore), None)
+    def edit_detentore(self, index):
+        id_detentore = self.model.id_detentore(index.row())
+        # La lista ha solo i campi mostrati: il record completo si legge ora
+        detentore = self.load_detentore(id_detentore)
 
         if not detentore:
             QMessageBox.warning(self, "Attenzione", "Detentore non trovato")
@@ -374,21 +442,18 @@ class DetentoriListDialog(QDialog):
             from Detentori import InserisciDetentoreDialog
             dialog = InserisciDetentoreDialog(detentore_data=detentore)
             if dialog.exec_() == QDialog.Accepted:
-                self.load_detentori_from_db()
-                self.apply_filters()
                 self.update_status("Detentore aggiornato con successo")
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nell'apertura del form di modifica:\n{e}")
 
     def delete_selected_detentore(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             return
 
-        row = selected_items[0].row()
-        id_detentore = int(self.table.item(row, 0).text())
-        nome = self.table.item(row, 2).text()
-        cognome = self.table.item(row, 1).text()
+        id_detentore = self.model.id_detentore(row)
+        nome = self.model.testo(row, "nome")
+        cognome = self.model.testo(row, "cognome")
 
         reply = QMessageBox.question(
             self,
@@ -400,31 +465,54 @@ class DetentoriListDialog(QDialog):
 
         if reply == QMessageBox.Yes:
             try:
-                conn = sqlite3.connect("gestione_armi.db")
-                cursor = conn.cursor()
+                repo = DetentoriRepository()
 
                 # Verifica se il detentore ha armi associate
-                cursor.execute("""
-                    SELECT COUNT(*) FROM armi WHERE ID_Detentore = ?
-                """, (id_detentore,))
-
-                if cursor.fetchone()[0] > 0:
+                if repo.conta_armi(id_detentore) > 0:
                     QMessageBox.warning(self, "Attenzione",
                                         "Non è possibile eliminare questo detentore perché ha delle armi associate.")
-                    conn.close()
                     return
 
-                cursor.execute("DELETE FROM detentori WHERE ID_Detentore = ?", (id_detentore,))
-                conn.commit()
-                conn.close()
-
-                self.load_detentori_from_db()
-                self.apply_filters()
+                repo.elimina(id_detentore)
                 self.update_status(f"Detentore {nome} {cognome} eliminato con successo")
             except Exception as e:
                 QMessageBox.critical(self, "Errore", f"Impossibile eliminare il detentore:\n{e}")
 
-    def export_csv(self):
+    def applica_modifiche(self, modifiche):
+        """Aggiorna le sole righe dei detentori modificati (ModificheDati dal bus delle modifiche)"""
+        if modifiche.ricarica:
+            self.load_detentori_from_db()
+            self.apply_filters()
+            return
+        ids = modifiche.detentori()
+        if not ids:
+            return
+        try:
+            repo = DetentoriRepository()
+            # Con filtri attivi anche l'elenco completo (usato da "Reimposta") va aggiornato a parte
+            if self.filtered_detentori is not self.detentori:
+                self.detentori.aggiorna(RisultatoColonnare(CHIAVI_LISTA, repo.lista_colonne(ids=ids)), ids)
+            # Righe rilette con i filtri mostrati: chi non li soddisfa più esce dalla lista
+            righe = RisultatoColonnare(CHIAVI_LISTA, repo.lista_colonne(self.shown_filters, ids))
+        except Exception as e:
+            self.update_status(f"Errore nell'aggiornamento dei detentori modificati: {e}")
+            return
+
+        self.model.aggiorna_righe(righe, ids)
+        # Il risultato della ricerca precedente non è più quello del database
+        self.last_filters = self.last_filtered = None
+        self.results_count_label.setText(f"Detentori trovati: {self.model.totale()}")
+        self.update_button_states()
+
+    def done(self, result):
+        # La finestra chiusa non segue più le modifiche
+        try:
+            bus_modifiche().modifiche.disconnect(self.applica_modifiche)
+        except TypeError:
+            pass
+        super().done(result)
+
+    def export_csv(self, tutti_i_campi=False):
         filename, _ = QFileDialog.getSaveFileName(
             self, "Esporta Detentori", "", "File CSV (*.csv)"
         )
@@ -432,87 +520,88 @@ class DetentoriListDialog(QDialog):
         if not filename:
             return
 
-        try:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-
-                # Intestazioni
-                headers = [self.table.horizontalHeaderItem(i).text() for i in range(self.table.columnCount())]
-                writer.writerow(headers)
-
-                # Dati
-                for row in range(self.table.rowCount()):
-                    if not self.table.isRowHidden(row):
-                        row_data = []
-                        for col in range(self.table.columnCount()):
-                            item = self.table.item(row, col)
-                            row_data.append(item.text() if item else "")
-                        writer.writerow(row_data)
-
-            self.update_status(f"Dati esportati con successo in {filename}")
-        except Exception as e:
-            QMessageBox.critical(self, "Errore", f"Errore durante l'esportazione:\n{e}")
+        if tutti_i_campi:
+            campi = TUTTI_I_CAMPI
+        else:
+            # Colonne della vista; il comune si esporta senza la sigla, che ha il suo campo
+            campi = []
+            for titolo, chiave in self.model.colonne():
+                campi.append((titolo, chiave))
+                if chiave == "comuneResidenza":
+                    campi.append(("Sigla Provincia", "siglaProvinciaResidenza"))
+
+        # Stessi filtri della lista, riletti dal database: la lista in memoria non serve
+        filters = self.current_filters()
+        if self.view_mode.currentIndex() == 2:
+            filters['soloPortoArmi'] = True
+
+        progress = QProgressDialog("Esportazione dei detentori in corso...", "Annulla", 0, 0, self)
+        progress.setWindowTitle("Esporta Detentori")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        annulla = threading.Event()
+        progress.canceled.connect(annulla.set)
+        avanzamento = [0, 0]  # righe scritte, righe totali: aggiornato dal thread di lavoro
+
+        def aggiorna(scritte, totale):
+            avanzamento[0], avanzamento[1] = scritte, totale
+
+        def esegui():
+            try:
+                return esporta_csv(filename, campi, filters, aggiorna, annulla)
+            finally:
+                # La connessione è del thread di lavoro, che termina con l'esportazione
+                DatabaseManager().close_connection()
+
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="esporta")
+        futuro = executor.submit(esegui)
+        executor.shutdown(wait=False)
+
+        timer = QTimer(self)
+
+        def controlla():
+            scritte, totale = avanzamento
+            if totale:
+                progress.setMaximum(totale)
+                progress.setValue(scritte)
+                progress.setLabelText(f"Esportati {scritte} di {totale} detentori...")
+            if not futuro.done():
+                return
+            timer.stop()
+            progress.close()
+            try:
+                righe = futuro.result()
+            except EsportazioneAnnullata:
+                self.update_status("Esportazione annullata")
+                return
+            except Exception as e:
+                QMessageBox.critical(self, "Errore", f"Errore durante l'esportazione:\n{e}")
+                return
+            elapsed = time.perf_counter() - start
+            self.update_status(f"Esportati {righe} detentori in {filename} ({elapsed:.1f} s)")
+
+        timer.timeout.connect(controlla)
+        timer.start(self.INTERVALLO_ESPORTAZIONE_MS)
 
     def print_preview(self):
+        from PyQt5.QtPrintSupport import QPrintPreviewDialog, QPrinter
+
         printer = QPrinter(QPrinter.HighResolution)
         dialog = QPrintPreviewDialog(printer, self)
         dialog.paintRequested.connect(self.print_table)
         dialog.exec_()
 
     def print_table(self, printer):
-        from PyQt5.QtGui import QTextDocument
-
-        document = QTextDocument()
-
-        html = """
-        <html>
-        <head>
-            <style>
-                body { font-family: Arial, sans-serif; }
-                h1 { font-size: 18pt; color: #333; text-align: center; }
-                table { border-collapse: collapse; width: 100%; margin-top: 20px; }
-                th { background-color: #f2f2f2; padding: 10px; text-align: left; border: 1px solid #ddd; }
-                td { padding: 8px; border: 1px solid #ddd; }
-                .footer { font-size: 9pt; text-align: center; margin-top: 20px; color: #777; }
-            </style>
-        </head>
-        <body>
-            <h1>Lista Detentori</h1>
-        """
-
-        # Aggiunge la tabella
-        html += "<table>"
-
-        # Intestazioni
-        html += "<tr>"
-        for col in range(1, self.table.columnCount()):  # Salta la colonna ID
-            header_item = self.table.horizontalHeaderItem(col)
-            html += f"<th>{header_item.text()}</th>"
-        html += "</tr>"
-
-        # Dati
-        for row in range(self.table.rowCount()):
-            if not self.table.isRowHidden(row):
-                html += "<tr>"
-                for col in range(1, self.table.columnCount()):  # Salta la colonna ID
-                    item = self.table.item(row, col)
-                    html += f"<td>{item.text() if item else ''}</td>"
-                html += "</tr>"
-
-        html += "</table>"
-
-        # Footer con data e ora
-        now = datetime.now()
-        html += f"""
-        <div class='footer'>
-            Stampato il {now.strftime('%d/%m/%Y')} alle {now.strftime('%H:%M')}
-        </div>
-        </body>
-        </html>
-        """
-
-        document.setHtml(html)
-        document.print_(printer)
+        from StampaTabella import StampaTabella
+
+        # Pagine disegnate direttamente dal modello, senza documento HTML intermedio
+        colonne = self.model.colonne()[1:]  # Salta la colonna ID
+        StampaTabella("Lista Detentori", colonne, self.model.totale(), self.model.testo,
+                      centrate=CHIAVI_CENTRATE).stampa(printer)
 
     def update_status(self, message):
         self.status_label.setText(message)
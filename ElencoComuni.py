@@ -0,0 +1,226 @@
+# ElencoComuni.py
+# Elenco in memoria di comuni e province: caricato una sola volta dal database,
+# risponde alle ricerche per nome e per codice catastale senza altre query
+
+import os
+import sys
+import zlib
+import marshal
+import struct
+import threading
+import time
+import logging
+from collections import namedtuple
+from typing import Dict, List, Optional, Iterable
+
+from Database import ComuniRepository
+from IndiceTesto import IndiceTesto
+
+logger = logging.getLogger("ElencoComuni")
+
+DatiComune = namedtuple("DatiComune", ["nome", "sigla", "catastale", "istat", "regione", "provincia"])
+
+# Istantanea su disco delle tabelle di riferimento, accanto al database:
+# intestazione, formato e CRC32 del contenuto, poi (versione, comuni, province) in marshal
+ESTENSIONE_ISTANTANEA = ".riferimenti"
+FORMATO_ISTANTANEA = 1
+_INTESTAZIONE = b"GARIF\x00"
+_STRUTTURA = struct.Struct("<BI")
+
+
+def percorso_istantanea(db_path: str) -> str:
+    return db_path + ESTENSIONE_ISTANTANEA
+
+
+def _interna(righe: Iterable[tuple]) -> tuple:
+    """Righe come tuple con le stringhe internate: sigle, regioni e province ripetute sono un solo oggetto."""
+    return tuple(tuple(sys.intern(v) if isinstance(v, str) else v for v in riga) for riga in righe)
+
+
+def leggi_istantanea(percorso: str, versione: tuple):
+    """(righe comuni, righe province) dall'istantanea, None se manca, è danneggiata o di un'altra versione."""
+    try:
+        with open(percorso, "rb") as f:
+            dati = f.read()
+    except OSError:
+        return None
+    inizio = len(_INTESTAZIONE) + _STRUTTURA.size
+    if len(dati) < inizio or not dati.startswith(_INTESTAZIONE):
+        return None
+    formato, crc = _STRUTTURA.unpack_from(dati, len(_INTESTAZIONE))
+    contenuto = memoryview(dati)[inizio:]
+    if formato != FORMATO_ISTANTANEA or zlib.crc32(contenuto) != crc:
+        return None
+    try:
+        versione_salvata, comuni, province = marshal.loads(contenuto)
+    except (ValueError, EOFError, TypeError):
+        return None
+    if tuple(versione_salvata) != tuple(versione):
+        return None
+    return comuni, province
+
+
+def scrivi_istantanea(percorso: str, versione: tuple, comuni: Iterable[tuple], province: Iterable[tuple]):
+    """Scrive l'istantanea (su un file temporaneo poi rinominato, così non resta mai a metà)."""
+    contenuto = marshal.dumps((tuple(versione), _interna(comuni), _interna(province)))
+    temporaneo = percorso + ".tmp"
+    try:
+        with open(temporaneo, "wb") as f:
+            f.write(_INTESTAZIONE + _STRUTTURA.pack(FORMATO_ISTANTANEA, zlib.crc32(contenuto)) + contenuto)
+        os.replace(temporaneo, percorso)
+    except OSError as e:
+        # Cartella in sola lettura: si continua a leggere dal database
+        logger.warning(f"Impossibile scrivere l'istantanea dei comuni {percorso}: {e}")
+
+
+def normalizza_comune(nome: Optional[str]) -> str:
+    """Chiave di ricerca di un comune: maiuscole e spazi singoli (come UPPER() nelle vecchie query)."""
+    if not nome:
+        return ""
+    return " ".join(str(nome).upper().split())
+
+
+class ElencoComuni:
+    """
+    Dizionari costruiti dalle tabelle comuni e province:
+
+    - nome normalizzato -> DatiComune (sigla, codice catastale, codice ISTAT, regione)
+    - codice catastale -> DatiComune, per risalire al comune da un codice fiscale
+    - nome provincia normalizzato -> sigla
+
+    Per i comuni omonimi (es. CASTRO BG e CASTRO LE) la ricerca per nome restituisce
+    il primo nell'ordine della tabella, come faceva la query con fetchone();
+    tutti restano raggiungibili per codice catastale e con omonimi().
+
+    indice_comuni e indice_province sono gli IndiceTesto per filtrare le combo,
+    costruiti al primo utilizzo.
+    """
+
+    _istanza = None
+    _lock_istanza = threading.Lock()
+
+    def __init__(self, righe_comuni: Iterable[tuple], righe_province: Iterable[tuple],
+                 versione: Optional[tuple] = None):
+        self.versione = versione
+        self.comuni: List[str] = []
+        self.province: List[str] = []
+        self._per_nome: Dict[str, DatiComune] = {}
+        self._omonimi: Dict[str, List[DatiComune]] = {}
+        self._per_catastale: Dict[str, DatiComune] = {}
+        self._sigle_province: Dict[str, str] = {}
+        self._indice_comuni: Optional[IndiceTesto] = None
+        self._indice_province: Optional[IndiceTesto] = None
+
+        for indice, (nome, sigla, catastale, istat, regione, provincia) in enumerate(righe_comuni):
+            if not nome:
+                continue
+            nome = str(nome).upper()
+            dati = DatiComune(
+                nome=nome,
+                sigla=sys.intern((sigla or "").upper()),
+                catastale=(catastale or "").upper(),
+                istat=f"{int(istat):06d}" if isinstance(istat, int) else str(istat or ""),
+                regione=sys.intern(regione or ""),
+                provincia=sys.intern((provincia or "").upper()),
+            )
+            # Il primo record della tabella non compare nella lista (vedi ComuniRepository.lista_comuni)
+            if indice > 0:
+                self.comuni.append(nome)
+            chiave = normalizza_comune(nome)
+            self._per_nome.setdefault(chiave, dati)
+            self._omonimi.setdefault(chiave, []).append(dati)
+            if dati.catastale:
+                self._per_catastale.setdefault(dati.catastale, dati)
+
+        for nome, sigla in righe_province:
+            if not nome:
+                continue
+            self.province.append(str(nome).upper())
+            self._sigle_province[normalizza_comune(nome)] = (sigla or "").upper()
+
+    @classmethod
+    def carica(cls, repository: Optional[ComuniRepository] = None) -> "ElencoComuni":
+        """
+        Carica comuni e province dall'istantanea accanto al database se corrisponde
+        alla versione corrente delle tabelle, altrimenti dal database, e in quel
+        caso riscrive l'istantanea.
+        """
+        repository = repository or ComuniRepository()
+        inizio = time.perf_counter()
+        versione = repository.versione()
+        percorso = percorso_istantanea(repository.db.db_path)
+        righe = leggi_istantanea(percorso, versione)
+        origine = "istantanea"
+        if righe is None:
+            righe = (repository.elenco_comuni(), repository.elenco_province())
+            scrivi_istantanea(percorso, versione, *righe)
+            origine = "database"
+        elenco = cls(*righe, versione=versione)
+        logger.info(f"Elenco comuni ({origine}): {len(elenco._per_catastale)} comuni e "
+                    f"{len(elenco.province)} province in {(time.perf_counter() - inizio) * 1000:.0f} ms")
+        return elenco
+
+    @classmethod
+    def condiviso(cls) -> "ElencoComuni":
+        """Elenco condiviso da tutto il processo, caricato al primo utilizzo."""
+        with cls._lock_istanza:
+            if cls._istanza is None:
+                cls._istanza = cls.carica()
+            return cls._istanza
+
+    @classmethod
+    def invalida(cls, repository: Optional[ComuniRepository] = None) -> bool:
+        """
+        Scarta l'elenco condiviso se comuni o province sono cambiati dal caricamento;
+        il prossimo utilizzo lo ricarica e rigenera l'istantanea.
+        Restituisce True se l'elenco è stato scartato.
+        """
+        with cls._lock_istanza:
+            if cls._istanza is None:
+                return False
+            if cls._istanza.versione == (repository or ComuniRepository()).versione():
+                return False
+            cls._istanza = None
+            return True
+
+    @property
+    def indice_comuni(self) -> IndiceTesto:
+        if self._indice_comuni is None:
+            self._indice_comuni = IndiceTesto(self.comuni)
+        return self._indice_comuni
+
+    @property
+    def indice_province(self) -> IndiceTesto:
+        if self._indice_province is None:
+            self._indice_province = IndiceTesto(self.province)
+        return self._indice_province
+
+    def comune(self, nome: str) -> Optional[DatiComune]:
+        return self._per_nome.get(normalizza_comune(nome))
+
+    def omonimi(self, nome: str) -> List[DatiComune]:
+        return list(self._omonimi.get(normalizza_comune(nome), []))
+
+    def da_catastale(self, codice: str) -> Optional[DatiComune]:
+        """Comune con il codice catastale indicato (es. 'H501' -> ROMA)."""
+        return self._per_catastale.get((codice or "").strip().upper())
+
+    def sigla_provincia(self, comune: str) -> str:
+        dati = self.comune(comune)
+        return dati.sigla if dati else ""
+
+    def codice_catastale(self, comune: str) -> str:
+        dati = self.comune(comune)
+        return dati.catastale if dati else ""
+
+    def codice_istat(self, comune: str) -> str:
+        dati = self.comune(comune)
+        return dati.istat if dati else ""
+
+    def regione(self, comune: str) -> str:
+        dati = self.comune(comune)
+        return dati.regione if dati else ""
+
+    def sigla_da_provincia(self, provincia: str) -> str:
+        """Sigla automobilistica dal nome della provincia."""
+        return self._sigle_province.get(normalizza_comune(provincia), "")
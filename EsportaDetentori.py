@@ -0,0 +1,78 @@
+# EsportaDetentori.py
+# Esportazione CSV dei detentori letta direttamente dal database a blocchi:
+# memoria costante, avanzamento e annullamento, pensata per girare in un thread di lavoro
+
+import os
+import csv
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Database import DetentoriRepository, CAMPI_DETENTORE, CAMPI_RIEPILOGO_DETENTORE
+
+# Excel con impostazioni italiane apre correttamente un CSV con il BOM UTF-8 e il punto e virgola
+CODIFICA_CSV = "utf-8-sig"
+SEPARATORE_CSV = ";"
+
+# Tutti i campi del detentore, la scadenza del porto d'armi e il riepilogo delle armi:
+# (intestazione, chiave), con i nomi delle colonne del database
+TUTTI_I_CAMPI: List[Tuple[str, str]] = [(colonna, chiave) for colonna, chiave in
+                                        CAMPI_DETENTORE + [("ScadenzaPortoArmi", "scadenza")] + CAMPI_RIEPILOGO_DETENTORE]
+
+
+class EsportazioneAnnullata(Exception):
+    """L'esportazione è stata interrotta su richiesta: il file di destinazione non viene scritto."""
+
+
+def campi_esportabili(campi: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """I soli campi (intestazione, chiave) che il database sa esportare."""
+    return [(titolo, chiave) for titolo, chiave in campi if chiave in DetentoriRepository.ESPRESSIONI_CAMPI]
+
+
+def esporta_csv(percorso: str, campi: List[Tuple[str, str]], filtri: Optional[Dict[str, str]] = None,
+                avanzamento: Optional[Callable[[int, int], None]] = None,
+                annulla: Optional[threading.Event] = None,
+                repository: Optional[DetentoriRepository] = None) -> int:
+    """
+    Scrive in percorso i detentori che soddisfano i filtri, con i campi indicati.
+
+    Le righe arrivano dal cursore a blocchi e vengono scritte subito, su un file
+    temporaneo rinominato solo alla fine: un'esportazione annullata o fallita
+    non lascia un file a metà.
+
+    Args:
+        percorso: File CSV da scrivere
+        campi: Lista di (intestazione, chiave), vedi DetentoriRepository.ESPRESSIONI_CAMPI
+        filtri: Filtri della lista detentori (vedi DetentoriRepository.lista_colonne)
+        avanzamento: Chiamata dopo ogni blocco con (righe scritte, righe totali)
+        annulla: Evento che, se impostato, interrompe l'esportazione al blocco successivo
+
+    Returns:
+        Numero di righe esportate
+
+    Raises:
+        EsportazioneAnnullata: se annulla è stato impostato
+    """
+    repository = repository or DetentoriRepository()
+    campi = campi_esportabili(campi)
+    totale = repository.conta(filtri)
+    temporaneo = percorso + ".tmp"
+    scritte = 0
+    try:
+        with open(temporaneo, "w", newline="", encoding=CODIFICA_CSV) as f:
+            writer = csv.writer(f, delimiter=SEPARATORE_CSV)
+            writer.writerow([titolo for titolo, _ in campi])
+            for righe in repository.blocchi_righe([chiave for _, chiave in campi], filtri):
+                if annulla is not None and annulla.is_set():
+                    raise EsportazioneAnnullata()
+                writer.writerows(("" if v is None else v for v in riga) for riga in righe)
+                scritte += len(righe)
+                if avanzamento:
+                    avanzamento(scritte, max(totale, scritte))
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        try:
+            os.remove(temporaneo)
+        except OSError:
+            pass
+        raise
+    return scritte
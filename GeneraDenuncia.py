@@ -1,7 +1,6 @@
 # GeneraDenuncia.py
 # Generatore di documenti di denuncia per detenzione armi
 
-import sqlite3
 from datetime import datetime
 import os
 import sys
@@ -11,32 +10,39 @@ import logging
 from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
+from Database import DatabaseManager, data_italiana
+
 # Importa i widget PyQt5 necessari per i dialoghi
 from PyQt5.QtWidgets import QMessageBox, QFileDialog, QDialog, QProgressDialog
 from PyQt5.QtCore import Qt
 
-# Importa la libreria per gestire i template Word
-from docxtpl import DocxTemplate
-import jinja2
-
-# Configurazione del logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Livello DEBUG per log più dettagliati
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("denunce.log"),
-        logging.StreamHandler()
-    ]
-)
+# docxtpl, jinja2 e python-docx vengono importati solo nelle funzioni che
+# generano i documenti: caricarli costa e la maggior parte delle sessioni non stampa denunce
+
 logger = logging.getLogger("GeneraDenuncia")
 
 
-def get_detentore_data(cursor, detentore_id: int) -> Optional[Dict[str, Any]]:
+def configura_logging():
+    """
+    Log dettagliato delle denunce nel file denunce.log, aggiunto al logger di questo
+    modulo alla prima denuncia e non all'import. Il logger radice resta quello
+    configurato dall'applicazione (vedi main.py).
+    """
+    # Il FileHandler si crea una volta sola: ogni denuncia successiva lo ritrova
+    if any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
+        return
+    handler = logging.FileHandler("denunce.log")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)  # Livello DEBUG per log più dettagliati
+
+
+def get_detentore_data(db: DatabaseManager, detentore_id: int) -> Optional[Dict[str, Any]]:
     """
     Recupera i dati completi del detentore dal database.
 
     Args:
-        cursor: Cursore del database
+        db: Gestore del database (connessione del thread corrente)
         detentore_id: ID del detentore
 
     Returns:
@@ -54,8 +60,7 @@ def get_detentore_data(cursor, detentore_id: int) -> Optional[Dict[str, Any]]:
             WHERE ID_Detentore = ?
         """
         logger.debug(f"Esecuzione query detentore con ID: {detentore_id}")
-        cursor.execute(query_detentore, (detentore_id,))
-        row = cursor.fetchone()
+        row = db.fetchone(query_detentore, (detentore_id,))
 
         if not row:
             logger.warning(f"Nessun detentore trovato con ID: {detentore_id}")
@@ -66,7 +71,7 @@ def get_detentore_data(cursor, detentore_id: int) -> Optional[Dict[str, Any]]:
             'cognome': row[0] or "",
             'nome': row[1] or "",
             'codice_fiscale': row[2] or "",
-            'data_nascita': row[3] or "",
+            'data_nascita': data_italiana(row[3]),
             'luogo_nascita': row[4] or "",
             'provincia_nascita': row[5] or "",
             'comune_residenza': row[6] or "",
@@ -77,7 +82,7 @@ def get_detentore_data(cursor, detentore_id: int) -> Optional[Dict[str, Any]]:
             'telefono': row[11] or "",
             'tipologia_titolo': row[12] or "NESSUN TITOLO",
             'numero_porto_armi': row[13] or "N/D",
-            'data_rilascio': row[14] or "N/D",
+            'data_rilascio': data_italiana(row[14]) or "N/D",
             'ente_rilascio': row[15] or "N/D",
             'comune_detenzione': row[16] or "",
             'tipo_via_detenzione': row[17] or "",
@@ -92,12 +97,12 @@ def get_detentore_data(cursor, detentore_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 
-def get_armi_data(cursor, detentore_id: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+def get_armi_data(db: DatabaseManager, detentore_id: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
     """
     Recupera le armi associate al detentore e le raggruppa per categoria.
 
     Args:
-        cursor: Cursore del database
+        db: Gestore del database (connessione del thread corrente)
         detentore_id: ID del detentore
 
     Returns:
@@ -105,8 +110,7 @@ def get_armi_data(cursor, detentore_id: int) -> Tuple[List[Dict[str, Any]], Dict
     """
     try:
         # Prima verifichiamo quante armi ha il detentore con una query semplice
-        cursor.execute("SELECT COUNT(*) FROM armi WHERE ID_Detentore = ?", (detentore_id,))
-        count = cursor.fetchone()[0]
+        count = db.fetchone("SELECT COUNT(*) FROM armi WHERE ID_Detentore = ?", (detentore_id,))[0]
         logger.debug(f"Il detentore con ID {detentore_id} ha {count} armi nel database")
 
         # Query completa per recuperare tutti i dati delle armi
@@ -122,8 +126,7 @@ def get_armi_data(cursor, detentore_id: int) -> Tuple[List[Dict[str, Any]], Dict
         logger.debug(f"Esecuzione query armi per detentore ID: {detentore_id}")
         logger.debug(f"Query: {query_armi}")
 
-        cursor.execute(query_armi, (detentore_id,))
-        armi_db = cursor.fetchall()
+        armi_db = db.fetchall(query_armi, (detentore_id,))
 
         logger.debug(f"Numero di armi trovate: {len(armi_db)}")
 
@@ -447,6 +450,17 @@ def crea_documento_denuncia(detentore_id: int, parent_widget=None) -> Tuple[bool
     Returns:
         Tuple (successo, messaggio)
     """
+    configura_logging()
+    try:
+        # Librerie per i template Word, caricate alla prima denuncia
+        from docxtpl import DocxTemplate
+        import jinja2
+    except ImportError as e:
+        logger.error(f"Libreria per i documenti Word non disponibile: {e}")
+        QMessageBox.critical(parent_widget, "Errore",
+                             f"Impossibile generare la denuncia, libreria mancante:\n{e}")
+        return False, f"Libreria mancante: {e}"
+
     if not detentore_id:
         logger.error("ID detentore non valido")
         QMessageBox.warning(parent_widget, "Attenzione", "ID detentore non valido.")
@@ -463,170 +477,169 @@ def crea_documento_denuncia(detentore_id: int, parent_widget=None) -> Tuple[bool
         progress.setValue(0)
         progress.show()
 
-        # Connessione al database
-        with sqlite3.connect("gestione_armi.db") as conn:
-            cursor = conn.cursor()
+        # Solo letture, sulla connessione condivisa del thread
+        db = DatabaseManager()
 
-            # 1. Recupera i dati del detentore
-            progress.setValue(1)
-            detentore = get_detentore_data(cursor, detentore_id)
-            if not detentore:
-                progress.close()
-                msg = f"Detentore con ID {detentore_id} non trovato nel database"
-                QMessageBox.warning(parent_widget, "Attenzione", msg)
-                return False, msg
+        # 1. Recupera i dati del detentore
+        progress.setValue(1)
+        detentore = get_detentore_data(db, detentore_id)
+        if not detentore:
+            progress.close()
+            msg = f"Detentore con ID {detentore_id} non trovato nel database"
+            QMessageBox.warning(parent_widget, "Attenzione", msg)
+            return False, msg
 
-            # 2. Recupera le armi
-            progress.setValue(2)
-            armi, armi_per_categoria = get_armi_data(cursor, detentore_id)
-
-            if not armi:
-                msg = f"Attenzione: nessuna arma trovata per il detentore {detentore['nome']} {detentore['cognome']}"
-                logger.warning(msg)
-
-                # Chiedi conferma per continuare senza armi
-                progress.close()
-                reply = QMessageBox.question(
-                    parent_widget,
-                    "Nessuna arma trovata",
-                    f"Non sono state trovate armi per {detentore['nome']} {detentore['cognome']}.\n\nVuoi continuare comunque con la generazione della denuncia?",
-                    QMessageBox.Yes | QMessageBox.No,
-                    QMessageBox.No
-                )
-
-                if reply == QMessageBox.No:
-                    return False, "Operazione annullata: nessuna arma trovata"
-
-                # Ricrea il dialogo di progresso
-                progress = QProgressDialog("Generazione denuncia in corso...", "Annulla", 0, 5, parent_widget)
-                progress.setWindowTitle("Generazione Denuncia")
-                progress.setWindowModality(Qt.WindowModal)
-                progress.setValue(2)
-                progress.show()
-
-            # 3. Trova il template
-            progress.setValue(3)
-            template_candidates = [
-                "denuncia_professionale_template.docx",
-                "Denuncia_armi_completo.docx"
-            ]
-
-            template_path = None
-            for template_name in template_candidates:
-                template_path = find_template_path(template_name)
-                if template_path:
-                    break
-
-            if not template_path:
-                # Crea un template base se non ne esiste uno
-                logger.info("Nessun template trovato, creazione di un template base")
-                template_path = crea_template_professionale()
-
-            if not template_path:
-                progress.close()
-                msg = f"Impossibile trovare o creare un template per la denuncia."
-                QMessageBox.critical(parent_widget, "Errore", msg)
-                return False, msg
-
-            # 4. Prepara il contesto e genera il documento
-            logger.info(f"Usando template: {template_path}")
-            progress.setValue(4)
-
-            context = prepare_context(detentore, armi, armi_per_categoria)
-
-            # Debug del contesto per verificare la presenza delle armi
-            logger.debug(f"Contesto per il template: {context}")
-            logger.debug(f"Numero di armi nel contesto: {len(context['armi'])}")
-            logger.debug(f"Numero di categorie nel contesto: {len(context['categorie'])}")
-
-            # Carica e renderizza il template
-            try:
-                doc = DocxTemplate(template_path)
-                doc.render(context)
-            except jinja2.exceptions.UndefinedError as e:
-                progress.close()
-                logger.error(f"Errore durante la renderizzazione del template: {e}")
-                logger.error(traceback.format_exc())
-
-                # Chiedi all'utente se vuole usare un template base semplificato
-                reply = QMessageBox.question(
-                    parent_widget,
-                    "Errore nel template",
-                    f"Il template attuale ha un problema: {str(e)}.\n\nVuoi utilizzare un template base semplificato?",
-                    QMessageBox.Yes | QMessageBox.No,
-                    QMessageBox.Yes
-                )
-
-                if reply == QMessageBox.Yes:
-                    try:
-                        # Crea un template base
-                        template_path = crea_template_professionale()
-                        if template_path:
-                            # Riprova con il nuovo template
-                            doc = DocxTemplate(template_path)
-                            doc.render(context)
-                        else:
-                            return False, "Impossibile creare un template base"
-                    except Exception as new_e:
-                        logger.error(f"Errore con il template base: {new_e}")
-                        return False, f"Errore con il template base: {str(new_e)}"
-                else:
-                    return False, f"Errore durante la generazione del documento: {str(e)}"
+        # 2. Recupera le armi
+        progress.setValue(2)
+        armi, armi_per_categoria = get_armi_data(db, detentore_id)
 
-            except Exception as e:
-                progress.close()
-                logger.error(f"Errore durante la renderizzazione del template: {e}")
-                logger.error(traceback.format_exc())
-                QMessageBox.critical(
-                    parent_widget,
-                    "Errore",
-                    f"Errore durante la generazione del documento: {str(e)}"
-                )
-                return False, f"Errore durante la generazione del documento: {str(e)}"
+        if not armi:
+            msg = f"Attenzione: nessuna arma trovata per il detentore {detentore['nome']} {detentore['cognome']}"
+            logger.warning(msg)
 
-            # 5. Salva il documento
-            nome_file_default = f"Denuncia_Armi_{detentore['cognome']}_{detentore['nome']}_{datetime.now().strftime('%d_%m_%Y')}.docx"
-            file_path, _ = QFileDialog.getSaveFileName(
+            # Chiedi conferma per continuare senza armi
+            progress.close()
+            reply = QMessageBox.question(
                 parent_widget,
-                "Salva documento",
-                nome_file_default,
-                "Documenti Word (*.docx);;Tutti i file (*)"
+                "Nessuna arma trovata",
+                f"Non sono state trovate armi per {detentore['nome']} {detentore['cognome']}.\n\nVuoi continuare comunque con la generazione della denuncia?",
+                QMessageBox.Yes | QMessageBox.No,
+                QMessageBox.No
             )
 
-            if not file_path:
-                progress.close()
-                return False, "Operazione annullata dall'utente"
+            if reply == QMessageBox.No:
+                return False, "Operazione annullata: nessuna arma trovata"
 
-            progress.setValue(5)
-            doc.save(file_path)
-            logger.info(f"Documento salvato in: {file_path}")
+            # Ricrea il dialogo di progresso
+            progress = QProgressDialog("Generazione denuncia in corso...", "Annulla", 0, 5, parent_widget)
+            progress.setWindowTitle("Generazione Denuncia")
+            progress.setWindowModality(Qt.WindowModal)
+            progress.setValue(2)
+            progress.show()
+
+        # 3. Trova il template
+        progress.setValue(3)
+        template_candidates = [
+            "denuncia_professionale_template.docx",
+            "Denuncia_armi_completo.docx"
+        ]
+
+        template_path = None
+        for template_name in template_candidates:
+            template_path = find_template_path(template_name)
+            if template_path:
+                break
+
+        if not template_path:
+            # Crea un template base se non ne esiste uno
+            logger.info("Nessun template trovato, creazione di un template base")
+            template_path = crea_template_professionale()
+
+        if not template_path:
+            progress.close()
+            msg = f"Impossibile trovare o creare un template per la denuncia."
+            QMessageBox.critical(parent_widget, "Errore", msg)
+            return False, msg
+
+        # 4. Prepara il contesto e genera il documento
+        logger.info(f"Usando template: {template_path}")
+        progress.setValue(4)
+
+        context = prepare_context(detentore, armi, armi_per_categoria)
+
+        # Debug del contesto per verificare la presenza delle armi
+        logger.debug(f"Contesto per il template: {context}")
+        logger.debug(f"Numero di armi nel contesto: {len(context['armi'])}")
+        logger.debug(f"Numero di categorie nel contesto: {len(context['categorie'])}")
 
-            # Chiudi il dialogo di progresso
+        # Carica e renderizza il template
+        try:
+            doc = DocxTemplate(template_path)
+            doc.render(context)
+        except jinja2.exceptions.UndefinedError as e:
             progress.close()
+            logger.error(f"Errore durante la renderizzazione del template: {e}")
+            logger.error(traceback.format_exc())
 
-            # Chiedi all'utente se vuole aprire il documento
+            # Chiedi all'utente se vuole usare un template base semplificato
             reply = QMessageBox.question(
                 parent_widget,
-                "Documento generato",
-                f"Il documento è stato salvato con successo.\nVuoi aprire il documento?",
+                "Errore nel template",
+                f"Il template attuale ha un problema: {str(e)}.\n\nVuoi utilizzare un template base semplificato?",
                 QMessageBox.Yes | QMessageBox.No,
                 QMessageBox.Yes
             )
 
             if reply == QMessageBox.Yes:
-                logger.info("Apertura documento...")
                 try:
-                    if sys.platform == "win32":
-                        os.startfile(file_path)
-                    elif sys.platform == "darwin":  # macOS
-                        subprocess.call(('open', file_path))
-                    else:  # linux/unix
-                        subprocess.call(('xdg-open', file_path))
-                except Exception as e:
-                    logger.error(f"Errore durante l'apertura del documento: {e}")
-                    return True, f"Documento salvato in: {file_path}\nImpossibile aprire automaticamente il file: {str(e)}"
-
-            return True, f"Documento salvato con successo in: {file_path}"
+                    # Crea un template base
+                    template_path = crea_template_professionale()
+                    if template_path:
+                        # Riprova con il nuovo template
+                        doc = DocxTemplate(template_path)
+                        doc.render(context)
+                    else:
+                        return False, "Impossibile creare un template base"
+                except Exception as new_e:
+                    logger.error(f"Errore con il template base: {new_e}")
+                    return False, f"Errore con il template base: {str(new_e)}"
+            else:
+                return False, f"Errore durante la generazione del documento: {str(e)}"
+
+        except Exception as e:
+            progress.close()
+            logger.error(f"Errore durante la renderizzazione del template: {e}")
+            logger.error(traceback.format_exc())
+            QMessageBox.critical(
+                parent_widget,
+                "Errore",
+                f"Errore durante la generazione del documento: {str(e)}"
+            )
+            return False, f"Errore durante la generazione del documento: {str(e)}"
+
+        # 5. Salva il documento
+        nome_file_default = f"Denuncia_Armi_{detentore['cognome']}_{detentore['nome']}_{datetime.now().strftime('%d_%m_%Y')}.docx"
+        file_path, _ = QFileDialog.getSaveFileName(
+            parent_widget,
+            "Salva documento",
+            nome_file_default,
+            "Documenti Word (*.docx);;Tutti i file (*)"
+        )
+
+        if not file_path:
+            progress.close()
+            return False, "Operazione annullata dall'utente"
+
+        progress.setValue(5)
+        doc.save(file_path)
+        logger.info(f"Documento salvato in: {file_path}")
+
+        # Chiudi il dialogo di progresso
+        progress.close()
+
+        # Chiedi all'utente se vuole aprire il documento
+        reply = QMessageBox.question(
+            parent_widget,
+            "Documento generato",
+            f"Il documento è stato salvato con successo.\nVuoi aprire il documento?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+
+        if reply == QMessageBox.Yes:
+            logger.info("Apertura documento...")
+            try:
+                if sys.platform == "win32":
+                    os.startfile(file_path)
+                elif sys.platform == "darwin":  # macOS
+                    subprocess.call(('open', file_path))
+                else:  # linux/unix
+                    subprocess.call(('xdg-open', file_path))
+            except Exception as e:
+                logger.error(f"Errore durante l'apertura del documento: {e}")
+                return True, f"Documento salvato in: {file_path}\nImpossibile aprire automaticamente il file: {str(e)}"
+
+        return True, f"Documento salvato con successo in: {file_path}"
 
     except Exception as e:
         logger.error("Errore durante la generazione della denuncia")
@@ -645,36 +658,33 @@ def debug_db(detentore_id: int) -> None:
         detentore_id: ID del detentore
     """
     try:
-        with sqlite3.connect("gestione_armi.db") as conn:
-            cursor = conn.cursor()
-
-            # Verifica i dati del detentore
-            cursor.execute("SELECT * FROM detentori WHERE ID_Detentore = ?", (detentore_id,))
-            detentore = cursor.fetchone()
-            if detentore:
-                print(f"Detentore trovato: ID={detentore_id}")
-
-                # Verifica le armi
-                cursor.execute("SELECT * FROM armi WHERE ID_Detentore = ?", (detentore_id,))
-                armi = cursor.fetchall()
-                print(f"Armi trovate: {len(armi)}")
-
-                # Raggruppa le armi per categoria
-                categorie = {}
-                for arma in armi:
-                    categoria = arma[7] if len(arma) > 7 and arma[7] else "ALTRA CATEGORIA"
-                    if categoria not in categorie:
-                        categorie[categoria] = []
-                    categorie[categoria].append(arma)
-
-                # Mostra le armi raggruppate per categoria
-                print("\nArmi raggruppate per categoria:")
-                for categoria, armi_cat in categorie.items():
-                    print(f"\n{categoria} ({len(armi_cat)} armi):")
-                    for i, arma in enumerate(armi_cat):
-                        print(f"  {i + 1}. {arma[3]} {arma[4]} - Matricola: {arma[6]}")
-            else:
-                print(f"Nessun detentore trovato con ID {detentore_id}")
+        db = DatabaseManager()
+
+        # Verifica i dati del detentore
+        detentore = db.fetchone("SELECT * FROM detentori WHERE ID_Detentore = ?", (detentore_id,))
+        if detentore:
+            print(f"Detentore trovato: ID={detentore_id}")
+
+            # Verifica le armi
+            armi = db.fetchall("SELECT * FROM armi WHERE ID_Detentore = ?", (detentore_id,))
+            print(f"Armi trovate: {len(armi)}")
+
+            # Raggruppa le armi per categoria
+            categorie = {}
+            for arma in armi:
+                categoria = arma[7] if len(arma) > 7 and arma[7] else "ALTRA CATEGORIA"
+                if categoria not in categorie:
+                    categorie[categoria] = []
+                categorie[categoria].append(arma)
+
+            # Mostra le armi raggruppate per categoria
+            print("\nArmi raggruppate per categoria:")
+            for categoria, armi_cat in categorie.items():
+                print(f"\n{categoria} ({len(armi_cat)} armi):")
+                for i, arma in enumerate(armi_cat):
+                    print(f"  {i + 1}. {arma[3]} {arma[4]} - Matricola: {arma[6]}")
+        else:
+            print(f"Nessun detentore trovato con ID {detentore_id}")
     except Exception as e:
         print(f"Errore durante il debug del database: {e}")
 
@@ -682,28 +692,25 @@ def debug_db(detentore_id: int) -> None:
 def test_connection():
     """Verifica la connessione al database e la struttura delle tabelle"""
     try:
-        with sqlite3.connect("gestione_armi.db") as conn:
-            cursor = conn.cursor()
+        db = DatabaseManager()
 
-            # Verifica la tabella detentori
-            cursor.execute("PRAGMA table_info(detentori)")
-            columns_detentori = [col[1] for col in cursor.fetchall()]
-            required_detentori = ["ID_Detentore", "Nome", "Cognome", "CodiceFiscale"]
+        # Verifica la tabella detentori
+        columns_detentori = [col[1] for col in db.fetchall("PRAGMA table_info(detentori)")]
+        required_detentori = ["ID_Detentore", "Nome", "Cognome", "CodiceFiscale"]
 
-            for col in required_detentori:
-                if col not in columns_detentori:
-                    return False, f"Colonna {col} mancante nella tabella detentori"
+        for col in required_detentori:
+            if col not in columns_detentori:
+                return False, f"Colonna {col} mancante nella tabella detentori"
 
-            # Verifica la tabella armi
-            cursor.execute("PRAGMA table_info(armi)")
-            columns_armi = [col[1] for col in cursor.fetchall()]
-            required_armi = ["ID_ArmaDetenuta", "ID_Detentore", "Matricola"]
+        # Verifica la tabella armi
+        columns_armi = [col[1] for col in db.fetchall("PRAGMA table_info(armi)")]
+        required_armi = ["ID_ArmaDetenuta", "ID_Detentore", "Matricola"]
 
-            for col in required_armi:
-                if col not in columns_armi:
-                    return False, f"Colonna {col} mancante nella tabella armi"
+        for col in required_armi:
+            if col not in columns_armi:
+                return False, f"Colonna {col} mancante nella tabella armi"
 
-            return True, "Connessione al database verificata con successo"
+        return True, "Connessione al database verificata con successo"
     except Exception as e:
         return False, f"Errore durante la verifica del database: {str(e)}"
 
@@ -713,6 +720,8 @@ if __name__ == "__main__":
     from PyQt5.QtWidgets import QApplication
 
     app = QApplication(sys.argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    configura_logging()
 
     # Verifica la connessione al database
     success, message = test_connection()
@@ -0,0 +1,112 @@
+# IndiceTesto.py
+# Ricerca per prefisso e per sottostringa su elenchi di nomi (comuni, province)
+# con array ordinato e indice di n-grammi, per il filtro delle combo
+
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+# Lunghezza massima degli n-grammi indicizzati: i testi fino a questa lunghezza
+# hanno l'elenco esatto, quelli più lunghi partono dal trigramma più raro
+LUNGHEZZA_NGRAMMI = 3
+
+# Carattere maggiore di qualsiasi lettera: chiave + _FINE delimita i nomi con quel prefisso
+_FINE = "\uffff"
+
+
+def normalizza_testo(testo: Optional[str]) -> str:
+    """Chiave di confronto: maiuscole e spazi singoli."""
+    if not testo:
+        return ""
+    return " ".join(str(testo).upper().split())
+
+
+class IndiceTesto:
+    """
+    Elenco di stringhe ordinato per chiave normalizzata, con un indice di n-grammi
+    (lettere singole, coppie e terne) che per ognuno elenca le stringhe che lo contengono.
+
+    Le stringhe sono numerate nell'ordine delle chiavi, quindi ogni elenco di
+    numeri ordinato è anche in ordine alfabetico e i nomi con un dato prefisso
+    occupano un intervallo contiguo, trovato con bisect. I risultati di una
+    ricerca mostrano prima i nomi che iniziano con il testo cercato, poi quelli
+    che lo contengono, entrambi in ordine alfabetico.
+
+    Se il testo cercato allunga quello della ricerca precedente, si filtrano solo
+    i risultati precedenti (mentre si digita l'insieme si restringe a ogni tasto).
+    Con un limite la ricerca si ferma appena ha abbastanza risultati: se bastano i
+    nomi che iniziano con il testo non si guarda nemmeno l'indice.
+    """
+
+    def __init__(self, elementi: Iterable[str]):
+        coppie = sorted({(normalizza_testo(e), e) for e in elementi if e})
+        self._chiavi: List[str] = [chiave for chiave, _ in coppie]
+        self._elementi: List[str] = [elemento for _, elemento in coppie]
+        self._ngrammi: Dict[str, array] = {}
+        for numero, chiave in enumerate(self._chiavi):
+            ngrammi = {chiave[i:i + n] for n in range(1, LUNGHEZZA_NGRAMMI + 1)
+                       for i in range(len(chiave) - n + 1)}
+            for ngramma in ngrammi:
+                lista = self._ngrammi.get(ngramma)
+                if lista is None:
+                    lista = self._ngrammi[ngramma] = array("I")
+                lista.append(numero)
+        self._ultima_ricerca = ("", None)
+
+    def __len__(self):
+        return len(self._elementi)
+
+    @property
+    def elementi(self) -> List[str]:
+        return self._elementi
+
+    def _candidati(self, cercato: str):
+        """
+        (numeri ordinati delle stringhe che possono contenere cercato, True se sono
+        già tutte e sole quelle che lo contengono).
+        """
+        precedente, trovati = self._ultima_ricerca
+        if trovati is not None and precedente and cercato.startswith(precedente):
+            return trovati, cercato == precedente
+        if len(cercato) <= LUNGHEZZA_NGRAMMI:
+            return self._ngrammi.get(cercato, ()), True
+        # Basta il trigramma più raro: il resto lo verifica il confronto diretto
+        n = LUNGHEZZA_NGRAMMI
+        liste = [self._ngrammi.get(cercato[i:i + n]) for i in range(len(cercato) - n + 1)]
+        if any(lista is None for lista in liste):
+            return (), True
+        return min(liste, key=len), False
+
+    def cerca(self, testo: str, limite: Optional[int] = None) -> List[str]:
+        """
+        Stringhe che contengono il testo (senza distinzione tra maiuscole e minuscole),
+        prima quelle che iniziano con il testo. Con testo vuoto restituisce tutto l'elenco.
+        """
+        cercato = normalizza_testo(testo)
+        if not cercato:
+            self._ultima_ricerca = ("", None)
+            return self._elementi[:limite]
+
+        inizio = bisect_left(self._chiavi, cercato)
+        fine = bisect_left(self._chiavi, cercato + _FINE, inizio)
+        prefissi = range(inizio, fine)
+        if limite is not None and len(prefissi) >= limite:
+            self._ultima_ricerca = ("", None)
+            return self._elementi[inizio:inizio + limite]
+
+        candidati, esatti = self._candidati(cercato)
+        chiavi = self._chiavi
+        # Chi contiene il testo senza iniziare con esso, in ordine alfabetico
+        altri = (numero for numero in candidati
+                 if not inizio <= numero < fine and (esatti or cercato in chiavi[numero]))
+        if limite is None:
+            altri = list(altri)
+        else:
+            altri = list(islice(altri, limite - len(prefissi)))
+        if limite is None or len(prefissi) + len(altri) < limite:
+            self._ultima_ricerca = (cercato, sorted([*prefissi, *altri]))
+        else:
+            # Ricerca interrotta al limite: l'insieme non è completo e non si può restringere
+            self._ultima_ricerca = ("", None)
+        return [self._elementi[numero] for numero in prefissi] + [self._elementi[numero] for numero in altri]
@@ -0,0 +1,622 @@
+# Migrazioni.py
+# Migrazioni dello schema del database, versionate tramite PRAGMA user_version
+
+import sys
+import logging
+from typing import List, Tuple, Callable
+
+logger = logging.getLogger("Migrazioni")
+
+
+def _crea_marche_armi(conn):
+    """Tabella delle marche (prima veniva creata a ogni apertura di ArmaDialog)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS marche_armi (
+            ID_MarcaArma INTEGER PRIMARY KEY AUTOINCREMENT,
+            NomeMarca TEXT NOT NULL UNIQUE,
+            StatoProduzione TEXT
+        )
+    """)
+
+
+def _crea_indici_principali(conn):
+    """Indici per le ricerche più frequenti, che altrimenti scandiscono l'intera tabella."""
+    # carica_armi, get_armi_data, delete_detentore
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_armi_detentore ON armi (ID_Detentore)")
+    # ricerca per matricola
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_armi_matricola ON armi (Matricola)")
+    # storico movimenti per matricola, già nell'ordine richiesto dalla ORDER BY
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_trasferimenti_matricola
+        ON trasferimenti (Matricola, Data_Trasferimento, Timestamp_Registrazione)
+    """)
+    # lista detentori ordinata per cognome e nome
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detentori_cognome_nome ON detentori (Cognome, Nome)")
+    # ricerca per codice fiscale
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detentori_codice_fiscale ON detentori (CodiceFiscale)")
+
+
+def _analizza(conn):
+    """Aggiorna le statistiche usate dal query planner."""
+    conn.execute("ANALYZE")
+
+
+# Indice full-text delle armi: una riga per arma attiva (rowid = ID_ArmaDetenuta)
+# e una per ogni eliminazione registrata (rowid = -ID_Trasferimento).
+# Il tokenizer trigram permette la ricerca per sottostringa (minimo 3 caratteri).
+SQL_DOC_ARMA_ATTIVA = """
+    INSERT INTO ricerca_armi (rowid, marca, modello, matricola, calibro, tipo, detentore)
+    SELECT a.ID_ArmaDetenuta, a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma, a.TipoArma,
+           TRIM(COALESCE(d.Cognome, '') || ' ' || COALESCE(d.Nome, ''))
+    FROM armi a
+    LEFT JOIN detentori d ON d.ID_Detentore = a.ID_Detentore
+"""
+
+SQL_DOC_ARMA_ELIMINATA = """
+    INSERT INTO ricerca_armi (rowid, marca, modello, matricola, calibro, tipo, detentore)
+    SELECT -t.ID_Trasferimento, t.MarcaArma, t.ModelloArma, t.Matricola, t.CalibroArma, t.TipoArma,
+           TRIM(COALESCE(t.Cedente_Cognome, '') || ' ' || COALESCE(t.Cedente_Nome, '') || ' ' ||
+                COALESCE(t.Ricevente_Cognome, '') || ' ' || COALESCE(t.Ricevente_Nome, ''))
+    FROM trasferimenti t
+    WHERE t.Motivo_Trasferimento = 'ELIMINAZIONE'
+"""
+
+
+def ricostruisci_indice_ricerca(conn):
+    """Ripopola da zero l'indice full-text delle armi."""
+    conn.execute("DELETE FROM ricerca_armi")
+    conn.execute(SQL_DOC_ARMA_ATTIVA)
+    conn.execute(SQL_DOC_ARMA_ELIMINATA)
+
+
+def _crea_indice_ricerca(conn):
+    """Tabella FTS5 per RicercaArmaDialog e trigger che la mantengono allineata."""
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ricerca_armi USING fts5(
+                marca, modello, matricola, calibro, tipo, detentore,
+                tokenize = 'trigram'
+            )
+        """)
+    except Exception as e:
+        # SQLite senza FTS5 o senza tokenizer trigram (< 3.34): la ricerca resta su LIKE
+        logger.warning(f"Indice di ricerca full-text non disponibile: {e}")
+        return
+
+    trigger = {
+        "trg_ricerca_armi_ins": f"""
+            AFTER INSERT ON armi BEGIN
+                {SQL_DOC_ARMA_ATTIVA} WHERE a.ID_ArmaDetenuta = NEW.ID_ArmaDetenuta;
+            END""",
+        "trg_ricerca_armi_upd": f"""
+            AFTER UPDATE ON armi BEGIN
+                DELETE FROM ricerca_armi WHERE rowid = OLD.ID_ArmaDetenuta;
+                {SQL_DOC_ARMA_ATTIVA} WHERE a.ID_ArmaDetenuta = NEW.ID_ArmaDetenuta;
+            END""",
+        "trg_ricerca_armi_del": """
+            AFTER DELETE ON armi BEGIN
+                DELETE FROM ricerca_armi WHERE rowid = OLD.ID_ArmaDetenuta;
+            END""",
+        "trg_ricerca_detentori_upd": f"""
+            AFTER UPDATE OF Cognome, Nome ON detentori BEGIN
+                DELETE FROM ricerca_armi
+                WHERE rowid IN (SELECT ID_ArmaDetenuta FROM armi WHERE ID_Detentore = NEW.ID_Detentore);
+                {SQL_DOC_ARMA_ATTIVA} WHERE a.ID_Detentore = NEW.ID_Detentore;
+            END""",
+        "trg_ricerca_trasferimenti_ins": f"""
+            AFTER INSERT ON trasferimenti WHEN NEW.Motivo_Trasferimento = 'ELIMINAZIONE' BEGIN
+                {SQL_DOC_ARMA_ELIMINATA} AND t.ID_Trasferimento = NEW.ID_Trasferimento;
+            END""",
+        "trg_ricerca_trasferimenti_upd": f"""
+            AFTER UPDATE ON trasferimenti BEGIN
+                DELETE FROM ricerca_armi WHERE rowid = -OLD.ID_Trasferimento;
+                {SQL_DOC_ARMA_ELIMINATA} AND t.ID_Trasferimento = NEW.ID_Trasferimento;
+            END""",
+        "trg_ricerca_trasferimenti_del": """
+            AFTER DELETE ON trasferimenti BEGIN
+                DELETE FROM ricerca_armi WHERE rowid = -OLD.ID_Trasferimento;
+            END""",
+    }
+    for nome, corpo in trigger.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}")
+
+    ricostruisci_indice_ricerca(conn)
+
+
+# Stato di ciascuna matricola (attiva, eliminata o non più presente), con l'ultimo
+# movimento e l'ultima eliminazione registrati. Viene ricalcolato per la sola
+# matricola toccata da ogni scrittura su armi e trasferimenti, con ricerche
+# puntuali sugli indici idx_armi_matricola e idx_trasferimenti_matricola.
+SQL_RICALCOLA_STATO = """
+    INSERT INTO stato_armi
+        (Matricola, Stato, ID_Arma, ID_UltimoTrasferimento, ID_Eliminazione, DataEliminazione)
+    SELECT s.Matricola,
+           CASE WHEN s.ID_Attiva IS NOT NULL THEN 'ATTIVA'
+                WHEN e.ID_Trasferimento IS NOT NULL THEN 'ELIMINATA'
+                ELSE 'NON PRESENTE' END,
+           COALESCE(s.ID_Attiva, e.ID_Arma),
+           s.ID_Ultimo, e.ID_Trasferimento, e.Data_Trasferimento
+    FROM (
+        SELECT m.Matricola,
+               (SELECT MAX(a.ID_ArmaDetenuta) FROM armi a WHERE a.Matricola = m.Matricola) AS ID_Attiva,
+               (SELECT t.ID_Trasferimento FROM trasferimenti t
+                WHERE t.Matricola = m.Matricola
+                ORDER BY t.Data_Trasferimento DESC, t.Timestamp_Registrazione DESC
+                LIMIT 1) AS ID_Ultimo,
+               (SELECT t.ID_Trasferimento FROM trasferimenti t
+                WHERE t.Matricola = m.Matricola AND t.Motivo_Trasferimento = 'ELIMINAZIONE'
+                ORDER BY t.Data_Trasferimento DESC, t.Timestamp_Registrazione DESC
+                LIMIT 1) AS ID_Eliminazione
+        FROM ({sorgente}) m
+        WHERE m.Matricola IS NOT NULL AND m.Matricola <> ''
+    ) s
+    LEFT JOIN trasferimenti e ON e.ID_Trasferimento = s.ID_Eliminazione
+    WHERE s.ID_Attiva IS NOT NULL OR s.ID_Ultimo IS NOT NULL
+"""
+
+
+def _ricalcola_stato(riferimento: str) -> str:
+    """Istruzioni di trigger che ricalcolano lo stato della matricola OLD/NEW indicata."""
+    return f"""
+                DELETE FROM stato_armi WHERE Matricola = {riferimento};
+                {SQL_RICALCOLA_STATO.format(sorgente=f"SELECT {riferimento} AS Matricola")};"""
+
+
+def _crea_stato_armi(conn):
+    """Tabella stato_armi, trigger che la mantengono e popolamento iniziale."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stato_armi (
+            Matricola TEXT PRIMARY KEY,
+            Stato TEXT NOT NULL,
+            ID_Arma INTEGER,
+            ID_UltimoTrasferimento INTEGER,
+            ID_Eliminazione INTEGER,
+            DataEliminazione TEXT
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stato_armi_stato ON stato_armi (Stato)")
+
+    trigger = {
+        "trg_stato_armi_ins": f"""
+            AFTER INSERT ON armi BEGIN {_ricalcola_stato("NEW.Matricola")}
+            END""",
+        "trg_stato_armi_upd": f"""
+            AFTER UPDATE OF Matricola ON armi BEGIN {_ricalcola_stato("OLD.Matricola")} {_ricalcola_stato("NEW.Matricola")}
+            END""",
+        "trg_stato_armi_del": f"""
+            AFTER DELETE ON armi BEGIN {_ricalcola_stato("OLD.Matricola")}
+            END""",
+        "trg_stato_trasferimenti_ins": f"""
+            AFTER INSERT ON trasferimenti BEGIN {_ricalcola_stato("NEW.Matricola")}
+            END""",
+        "trg_stato_trasferimenti_upd": f"""
+            AFTER UPDATE OF Matricola, Motivo_Trasferimento, Data_Trasferimento, Timestamp_Registrazione
+            ON trasferimenti BEGIN {_ricalcola_stato("OLD.Matricola")} {_ricalcola_stato("NEW.Matricola")}
+            END""",
+        "trg_stato_trasferimenti_del": f"""
+            AFTER DELETE ON trasferimenti BEGIN {_ricalcola_stato("OLD.Matricola")}
+            END""",
+    }
+    for nome, corpo in trigger.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}")
+
+    conn.execute("DELETE FROM stato_armi")
+    conn.execute(SQL_RICALCOLA_STATO.format(
+        sorgente="SELECT Matricola FROM armi UNION SELECT Matricola FROM trasferimenti"))
+
+
+def _rimuovi_trigger_snapshot(conn):
+    """
+    Il trigger popolamento_dati_trasferimento rileggeva con 11 sottoquery arma e
+    detentori e aggiornava la riga appena inserita, sovrascrivendo i dati del
+    ricevente esterno. Lo snapshot ora è scritto dall'inserimento stesso
+    (TrasferimentiRepository.scrivi_trasferimento).
+    """
+    conn.execute("DROP TRIGGER IF EXISTS popolamento_dati_trasferimento")
+    # Colonne aggiunte a mano su alcuni archivi e scritte da ogni trasferimento
+    presenti = {row[1] for row in conn.execute("PRAGMA table_info(trasferimenti)")}
+    for colonna in ("ID_DetentorePrecedente", "ID_NuovoDetentore"):
+        if colonna not in presenti:
+            conn.execute(f"ALTER TABLE trasferimenti ADD COLUMN {colonna} INTEGER")
+
+
+def _date_canoniche(conn):
+    """
+    Porta tutte le colonne data (COLONNE_DATA) al formato yyyy-MM-dd e aggiunge
+    gli indici per le ricerche per intervallo. I valori che non sono date
+    riconoscibili restano invariati e vengono solo segnalati nel log.
+    """
+    from Database import COLONNE_DATA, data_iso
+
+    conn.create_function("data_iso", 1, data_iso, deterministic=True)
+    for tabella, colonne in COLONNE_DATA.items():
+        presenti = {row[1] for row in conn.execute(f"PRAGMA table_info({tabella})")}
+        for colonna in colonne:
+            if colonna not in presenti:
+                continue
+            aggiornate = conn.execute(f"""
+                UPDATE {tabella} SET {colonna} = data_iso({colonna})
+                WHERE {colonna} IS NOT NULL AND {colonna} <> data_iso({colonna})
+            """).rowcount
+            # Dopo la conversione una data valida è lunga 10 caratteri con i trattini in posizione
+            non_valide = conn.execute(f"""
+                SELECT COUNT(*) FROM {tabella}
+                WHERE {colonna} IS NOT NULL AND {colonna} <> ''
+                  AND {colonna} NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+            """).fetchone()[0]
+            logger.info(f"{tabella}.{colonna}: {aggiornate} date convertite, {non_valide} non riconosciute")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detentori_data_nascita ON detentori (DataNascita)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_armi_data_acquisto ON armi (DataAcquisto)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_trasferimenti_arma_data
+        ON trasferimenti (ID_Arma, Data_Trasferimento, Timestamp_Registrazione)
+    """)
+    conn.execute("ANALYZE")
+
+
+def _crea_versioni_riferimento(conn):
+    """
+    Contatore delle modifiche alle tabelle di riferimento (comuni, province),
+    incrementato dai trigger. Insieme a schema_version e al numero di righe
+    decide se l'istantanea su disco di ElencoComuni è ancora valida.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS versioni_riferimento (
+            Tabella  TEXT PRIMARY KEY,
+            Versione INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for tabella in ("comuni", "province"):
+        conn.execute("INSERT OR IGNORE INTO versioni_riferimento (Tabella) VALUES (?)", (tabella,))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_versione_{tabella}_{evento.lower()}
+                AFTER {evento} ON {tabella}
+                BEGIN
+                    UPDATE versioni_riferimento SET Versione = Versione + 1 WHERE Tabella = '{tabella}';
+                END
+            """)
+
+
+# Indice full-text dei detentori per i filtri della lista (rowid = ID_Detentore)
+SQL_DOC_DETENTORE = """
+    INSERT INTO ricerca_detentori (rowid, cognome, nome, codice_fiscale, comune)
+    SELECT ID_Detentore, Cognome, Nome, CodiceFiscale, ComuneResidenza
+    FROM detentori
+"""
+
+
+def _crea_ricerca_detentori(conn):
+    """Tabella FTS5 (trigram) per i filtri di DetentoriListDialog e trigger che la mantengono allineata."""
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ricerca_detentori USING fts5(
+                cognome, nome, codice_fiscale, comune,
+                tokenize = 'trigram'
+            )
+        """)
+    except Exception as e:
+        # Come per ricerca_armi: senza FTS5 i filtri restano su LIKE
+        logger.warning(f"Indice di ricerca dei detentori non disponibile: {e}")
+        return
+
+    trigger = {
+        "trg_ricerca_detentori_ins": f"""
+            AFTER INSERT ON detentori BEGIN
+                {SQL_DOC_DETENTORE} WHERE ID_Detentore = NEW.ID_Detentore;
+            END""",
+        "trg_ricerca_detentori_lista_upd": f"""
+            AFTER UPDATE OF Cognome, Nome, CodiceFiscale, ComuneResidenza ON detentori BEGIN
+                DELETE FROM ricerca_detentori WHERE rowid = OLD.ID_Detentore;
+                {SQL_DOC_DETENTORE} WHERE ID_Detentore = NEW.ID_Detentore;
+            END""",
+        "trg_ricerca_detentori_del": """
+            AFTER DELETE ON detentori BEGIN
+                DELETE FROM ricerca_detentori WHERE rowid = OLD.ID_Detentore;
+            END""",
+    }
+    for nome, corpo in trigger.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}")
+
+    conn.execute("DELETE FROM ricerca_detentori")
+    conn.execute(SQL_DOC_DETENTORE)
+
+
+# Riepilogo delle armi di ciascun detentore (numero, categorie, munizioni, ultimo
+# trasferimento) per le colonne della lista detentori. Come stato_armi viene
+# ricalcolato dai trigger per i soli detentori toccati da ogni scrittura su armi
+# e trasferimenti, con ricerche puntuali su idx_armi_detentore e sugli indici
+# di cedente e ricevente dei trasferimenti.
+SQL_RICALCOLA_CATEGORIE = """
+    INSERT INTO riepilogo_categorie (ID_Detentore, CategoriaArma, NumeroArmi)
+    SELECT a.ID_Detentore, COALESCE(NULLIF(TRIM(a.CategoriaArma), ''), 'NON INDICATA'), COUNT(*)
+    FROM armi a
+    WHERE a.ID_Detentore IN ({sorgente})
+    GROUP BY 1, 2
+"""
+
+# QuantitaMunizioni è testo libero: si sommano solo i valori interamente numerici.
+# L'ultimo trasferimento si cerca separatamente come cedente e come ricevente, ciascuno
+# sul proprio indice: con MAX diretto il planner scandirebbe idx_trasferimenti_data
+SQL_RICALCOLA_RIEPILOGO = """
+    INSERT OR REPLACE INTO riepilogo_detentori
+        (ID_Detentore, NumeroArmi, CategorieArmi, Munizioni, UltimoTrasferimento)
+    SELECT d.ID_Detentore,
+           (SELECT COUNT(*) FROM armi a WHERE a.ID_Detentore = d.ID_Detentore),
+           (SELECT GROUP_CONCAT(c.CategoriaArma || ': ' || c.NumeroArmi, ', ')
+            FROM riepilogo_categorie c WHERE c.ID_Detentore = d.ID_Detentore),
+           (SELECT COALESCE(SUM(CAST(TRIM(a.QuantitaMunizioni) AS INTEGER)), 0)
+            FROM armi a
+            WHERE a.ID_Detentore = d.ID_Detentore
+              AND TRIM(a.QuantitaMunizioni) GLOB '[0-9]*'
+              AND TRIM(a.QuantitaMunizioni) NOT GLOB '*[^0-9]*'),
+           (SELECT MAX(m.Data) FROM (
+                SELECT t.Data_Trasferimento AS Data FROM trasferimenti t
+                WHERE t.ID_Detentore_Cedente = d.ID_Detentore
+                UNION ALL
+                SELECT t.Data_Trasferimento FROM trasferimenti t
+                WHERE t.ID_Detentore_Ricevente = d.ID_Detentore
+            ) m WHERE m.Data GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]')
+    FROM detentori d
+    WHERE d.ID_Detentore IN ({sorgente})
+"""
+
+
+def _ricalcola_riepilogo(*riferimenti: str) -> str:
+    """Istruzioni di trigger che ricalcolano il riepilogo dei detentori OLD/NEW indicati."""
+    sorgente = ", ".join(riferimenti)
+    return f"""
+                DELETE FROM riepilogo_categorie WHERE ID_Detentore IN ({sorgente});
+                {SQL_RICALCOLA_CATEGORIE.format(sorgente=sorgente)};
+                {SQL_RICALCOLA_RIEPILOGO.format(sorgente=sorgente)};"""
+
+
+def _crea_riepilogo_detentori(conn):
+    """Tabelle riepilogo_detentori e riepilogo_categorie, trigger che le mantengono e popolamento iniziale."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS riepilogo_detentori (
+            ID_Detentore INTEGER PRIMARY KEY,
+            NumeroArmi INTEGER NOT NULL DEFAULT 0,
+            CategorieArmi TEXT,
+            Munizioni INTEGER NOT NULL DEFAULT 0,
+            UltimoTrasferimento TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS riepilogo_categorie (
+            ID_Detentore INTEGER NOT NULL,
+            CategoriaArma TEXT NOT NULL,
+            NumeroArmi INTEGER NOT NULL,
+            PRIMARY KEY (ID_Detentore, CategoriaArma)
+        ) WITHOUT ROWID
+    """)
+    # "Detentori con almeno N armi" e "detentori con armi della categoria" senza scandire le tabelle
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_riepilogo_numero_armi ON riepilogo_detentori (NumeroArmi)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_riepilogo_categorie_categoria
+        ON riepilogo_categorie (CategoriaArma, NumeroArmi)
+    """)
+
+    trigger = {
+        "trg_riepilogo_armi_ins": f"""
+            AFTER INSERT ON armi BEGIN {_ricalcola_riepilogo("NEW.ID_Detentore")}
+            END""",
+        "trg_riepilogo_armi_upd": f"""
+            AFTER UPDATE OF ID_Detentore, CategoriaArma, QuantitaMunizioni ON armi
+            BEGIN {_ricalcola_riepilogo("OLD.ID_Detentore", "NEW.ID_Detentore")}
+            END""",
+        "trg_riepilogo_armi_del": f"""
+            AFTER DELETE ON armi BEGIN {_ricalcola_riepilogo("OLD.ID_Detentore")}
+            END""",
+        "trg_riepilogo_trasferimenti_ins": f"""
+            AFTER INSERT ON trasferimenti
+            BEGIN {_ricalcola_riepilogo("NEW.ID_Detentore_Cedente", "NEW.ID_Detentore_Ricevente")}
+            END""",
+        "trg_riepilogo_trasferimenti_upd": f"""
+            AFTER UPDATE OF ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento ON trasferimenti
+            BEGIN {_ricalcola_riepilogo("OLD.ID_Detentore_Cedente", "OLD.ID_Detentore_Ricevente",
+                                        "NEW.ID_Detentore_Cedente", "NEW.ID_Detentore_Ricevente")}
+            END""",
+        "trg_riepilogo_trasferimenti_del": f"""
+            AFTER DELETE ON trasferimenti
+            BEGIN {_ricalcola_riepilogo("OLD.ID_Detentore_Cedente", "OLD.ID_Detentore_Ricevente")}
+            END""",
+        "trg_riepilogo_detentori_del": """
+            AFTER DELETE ON detentori BEGIN
+                DELETE FROM riepilogo_categorie WHERE ID_Detentore = OLD.ID_Detentore;
+                DELETE FROM riepilogo_detentori WHERE ID_Detentore = OLD.ID_Detentore;
+            END""",
+    }
+    for nome, corpo in trigger.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}")
+
+    conn.execute("DELETE FROM riepilogo_categorie")
+    conn.execute("DELETE FROM riepilogo_detentori")
+    tutti = "SELECT ID_Detentore FROM armi UNION SELECT ID_Detentore_Cedente FROM trasferimenti " \
+            "UNION SELECT ID_Detentore_Ricevente FROM trasferimenti"
+    conn.execute(SQL_RICALCOLA_CATEGORIE.format(sorgente=tutti))
+    conn.execute(SQL_RICALCOLA_RIEPILOGO.format(sorgente=tutti))
+    conn.execute("ANALYZE riepilogo_detentori")
+    conn.execute("ANALYZE riepilogo_categorie")
+
+
+def _crea_scadenza_porto_armi(conn):
+    """
+    Colonna ScadenzaPortoArmi di detentori (yyyy-MM-dd), calcolata da DataRilascio e
+    TipologiaTitolo secondo VALIDITA_PORTO_ARMI e ricalcolata dai trigger a ogni
+    salvataggio, con l'indice per la ricerca dei porti d'armi in scadenza.
+    """
+    from Database import sql_scadenza_porto_armi
+
+    presenti = {row[1] for row in conn.execute("PRAGMA table_info(detentori)")}
+    if "ScadenzaPortoArmi" not in presenti:
+        conn.execute("ALTER TABLE detentori ADD COLUMN ScadenzaPortoArmi TEXT")
+
+    trigger = {
+        "trg_scadenza_porto_armi_ins": "AFTER INSERT ON detentori",
+        "trg_scadenza_porto_armi_upd": "AFTER UPDATE OF DataRilascio, TipologiaTitolo ON detentori",
+    }
+    for nome, evento in trigger.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {nome} {evento} BEGIN
+                UPDATE detentori
+                SET ScadenzaPortoArmi = {sql_scadenza_porto_armi("NEW.TipologiaTitolo", "NEW.DataRilascio")}
+                WHERE ID_Detentore = NEW.ID_Detentore;
+            END
+        """)
+
+    conn.execute(f"UPDATE detentori SET ScadenzaPortoArmi = "
+                 f"{sql_scadenza_porto_armi('TipologiaTitolo', 'DataRilascio')}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detentori_scadenza_porto ON detentori (ScadenzaPortoArmi)")
+    conn.execute("ANALYZE detentori")
+
+
+# Righe conservate in registro_modifiche: chi resta indietro di più ricarica tutto
+MODIFICHE_CONSERVATE = 10000
+
+
+def _crea_registro_modifiche(conn):
+    """
+    Tabella registro_modifiche: una riga per ogni inserimento, modifica o eliminazione
+    di detentori, armi e trasferimenti, scritta dai trigger nella stessa transazione.
+    Le finestre leggono solo le righe successive all'ultima vista e aggiornano le righe
+    interessate (vedi NotificheModifiche). ID_Detentore e ID_DetentorePrecedente sono i
+    detentori coinvolti: per le armi quello attuale e quello prima della modifica, per i
+    trasferimenti ricevente e cedente.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS registro_modifiche (
+            ID_Modifica INTEGER PRIMARY KEY AUTOINCREMENT,
+            Tabella TEXT NOT NULL,
+            Operazione TEXT NOT NULL CHECK (Operazione IN ('I', 'U', 'D')),
+            ID_Riga INTEGER NOT NULL,
+            ID_Detentore INTEGER,
+            ID_DetentorePrecedente INTEGER
+        )
+    """)
+
+    def registra(tabella, operazione, riga, detentore="NULL", precedente="NULL"):
+        return (f"INSERT INTO registro_modifiche (Tabella, Operazione, ID_Riga, ID_Detentore, "
+                f"ID_DetentorePrecedente) VALUES ('{tabella}', '{operazione}', {riga}, {detentore}, {precedente});")
+
+    from Database import CAMPI_DETENTORE
+
+    # Colonne scritte dalle finestre: ScadenzaPortoArmi, ricalcolata dal trigger della
+    # migrazione 11 subito dopo ogni inserimento, non genera una seconda riga
+    colonne_detentore = ", ".join(colonna for colonna, _ in CAMPI_DETENTORE[1:])
+
+    trigger = {
+        "trg_registro_detentori_ins": f"""
+            AFTER INSERT ON detentori
+            BEGIN {registra("detentori", "I", "NEW.ID_Detentore", "NEW.ID_Detentore")} END""",
+        "trg_registro_detentori_upd": f"""
+            AFTER UPDATE OF {colonne_detentore} ON detentori
+            BEGIN {registra("detentori", "U", "NEW.ID_Detentore", "NEW.ID_Detentore", "OLD.ID_Detentore")} END""",
+        "trg_registro_detentori_del": f"""
+            AFTER DELETE ON detentori
+            BEGIN {registra("detentori", "D", "OLD.ID_Detentore", "OLD.ID_Detentore")} END""",
+        "trg_registro_armi_ins": f"""
+            AFTER INSERT ON armi
+            BEGIN {registra("armi", "I", "NEW.ID_ArmaDetenuta", "NEW.ID_Detentore")} END""",
+        "trg_registro_armi_upd": f"""
+            AFTER UPDATE ON armi
+            BEGIN {registra("armi", "U", "NEW.ID_ArmaDetenuta", "NEW.ID_Detentore", "OLD.ID_Detentore")} END""",
+        "trg_registro_armi_del": f"""
+            AFTER DELETE ON armi
+            BEGIN {registra("armi", "D", "OLD.ID_ArmaDetenuta", "OLD.ID_Detentore")} END""",
+        "trg_registro_trasferimenti_ins": f"""
+            AFTER INSERT ON trasferimenti
+            BEGIN {registra("trasferimenti", "I", "NEW.ID_Trasferimento",
+                            "NEW.ID_Detentore_Ricevente", "NEW.ID_Detentore_Cedente")} END""",
+        # Le stesse colonne di trg_riepilogo_trasferimenti_upd: sono le sole che cambiano
+        # una riga della lista detentori (detentori coinvolti e data dell'ultimo trasferimento);
+        # note e dati copiati dell'arma e dei detentori non interessano nessuna finestra
+        "trg_registro_trasferimenti_upd": f"""
+            AFTER UPDATE OF ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento ON trasferimenti
+            BEGIN {registra("trasferimenti", "U", "OLD.ID_Trasferimento",
+                            "OLD.ID_Detentore_Ricevente", "OLD.ID_Detentore_Cedente")}
+                  {registra("trasferimenti", "U", "NEW.ID_Trasferimento",
+                            "NEW.ID_Detentore_Ricevente", "NEW.ID_Detentore_Cedente")} END""",
+        "trg_registro_trasferimenti_del": f"""
+            AFTER DELETE ON trasferimenti
+            BEGIN {registra("trasferimenti", "D", "OLD.ID_Trasferimento",
+                            "OLD.ID_Detentore_Ricevente", "OLD.ID_Detentore_Cedente")} END""",
+        # Il registro non cresce oltre MODIFICHE_CONSERVATE righe
+        "trg_registro_modifiche_pulizia": f"""
+            AFTER INSERT ON registro_modifiche BEGIN
+                DELETE FROM registro_modifiche WHERE ID_Modifica <= NEW.ID_Modifica - {MODIFICHE_CONSERVATE};
+            END""",
+    }
+    for nome, corpo in trigger.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}")
+
+
+# Elenco ordinato delle migrazioni: (versione, descrizione, funzione).
+# Ogni funzione deve essere idempotente; le nuove migrazioni vanno aggiunte in fondo
+# con una versione maggiore dell'ultima.
+MIGRAZIONI: List[Tuple[int, str, Callable]] = [
+    (1, "Tabella marche_armi", _crea_marche_armi),
+    (2, "Indici su armi, trasferimenti e detentori", _crea_indici_principali),
+    (3, "Statistiche del query planner", _analizza),
+    (4, "Indice full-text per la ricerca armi", _crea_indice_ricerca),
+    (5, "Stato per matricola (attiva/eliminata) mantenuto dai trigger", _crea_stato_armi),
+    (6, "Snapshot dei trasferimenti scritto in un solo inserimento", _rimuovi_trigger_snapshot),
+    (7, "Date in formato yyyy-MM-dd e indici per intervallo", _date_canoniche),
+    (8, "Versione delle tabelle comuni e province", _crea_versioni_riferimento),
+    (9, "Indice full-text per i filtri della lista detentori", _crea_ricerca_detentori),
+    (10, "Riepilogo delle armi per detentore mantenuto dai trigger", _crea_riepilogo_detentori),
+    (11, "Scadenza del porto d'armi calcolata e indicizzata", _crea_scadenza_porto_armi),
+    (12, "Registro delle modifiche per l'aggiornamento incrementale delle finestre", _crea_registro_modifiche),
+]
+
+
+def versione_corrente(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def versione_richiesta() -> int:
+    return MIGRAZIONI[-1][0] if MIGRAZIONI else 0
+
+
+def applica_migrazioni(conn) -> int:
+    """
+    Applica in ordine le migrazioni con versione maggiore di PRAGMA user_version.
+    Ogni migrazione gira nella propria transazione insieme all'aggiornamento
+    di user_version, così un'interruzione non lascia lo schema a metà.
+
+    Args:
+        conn: Connessione sqlite3 al database
+
+    Returns:
+        Versione dello schema dopo l'aggiornamento
+    """
+    versione = versione_corrente(conn)
+    for numero, descrizione, funzione in MIGRAZIONI:
+        if numero <= versione:
+            continue
+        logger.info(f"Applicazione migrazione {numero}: {descrizione}")
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            funzione(conn)
+            conn.execute(f"PRAGMA user_version = {int(numero)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Migrazione {numero} fallita: {e}")
+            raise
+        versione = numero
+    return versione
+
+
+if __name__ == "__main__":
+    import sqlite3
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    percorso = sys.argv[1] if len(sys.argv) > 1 else "gestione_armi.db"
+    with sqlite3.connect(percorso) as connessione:
+        prima = versione_corrente(connessione)
+        dopo = applica_migrazioni(connessione)
+        print(f"Schema {percorso}: versione {prima} -> {dopo}")
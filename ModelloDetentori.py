@@ -0,0 +1,411 @@
+# ModelloDetentori.py
+# Modello Qt per la lista dei detentori: dati per colonne, righe consegnate
+# alla vista a pagine (canFetchMore/fetchMore) e colori applicati da un delegate
+
+from array import array
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor, QPalette
+from PyQt5.QtWidgets import QStyledItemDelegate
+
+from Database import CAMPI_LISTA_DETENTORE, CAMPI_RIEPILOGO_DETENTORE
+
+# Campi caricati per la lista, nell'ordine delle colonne del risultato (vedi DetentoriRepository.lista_colonne)
+CHIAVI_LISTA = [chiave for _, chiave in CAMPI_LISTA_DETENTORE + CAMPI_RIEPILOGO_DETENTORE]
+
+# Colonne delle viste: (intestazione, chiave); le chiavi composte come "indirizzo" sono calcolate in testo()
+COLONNE_BASE = [
+    ("ID", "id"), ("Cognome", "cognome"), ("Nome", "nome"), ("Codice Fiscale", "codiceFiscale"),
+    ("Comune Residenza", "comuneResidenza"), ("Telefono", "telefono"), ("Armi", "numeroArmi"),
+]
+COLONNE_COMPLETE = [
+    ("ID", "id"), ("Cognome", "cognome"), ("Nome", "nome"), ("Codice Fiscale", "codiceFiscale"),
+    ("Data Nascita", "dataNascita"), ("Luogo Nascita", "luogoNascita"),
+    ("Comune Residenza", "comuneResidenza"), ("Indirizzo", "indirizzo"), ("Telefono", "telefono"),
+    ("Porto d'Armi", "numeroPortoArmi"), ("Scadenza", "scadenza"),
+    ("Armi", "numeroArmi"), ("Categorie Armi", "categorieArmi"), ("Munizioni", "munizioni"),
+    ("Ultimo Trasferimento", "ultimoTrasferimento"),
+]
+
+CHIAVI_CENTRATE = {"id", "codiceFiscale", "telefono", "dataNascita", "numeroPortoArmi", "scadenza",
+                   "numeroArmi", "munizioni", "ultimoTrasferimento"}
+# Ordinamento per valore numerico e per data (dd/MM/yyyy) invece che alfabetico
+CHIAVI_NUMERICHE = {"id", "numeroArmi", "munizioni"}
+CHIAVI_DATA = {"dataNascita", "scadenza", "ultimoTrasferimento"}
+
+# Ruolo con lo stato della riga, letto dal delegate per i colori
+RUOLO_STATO = Qt.UserRole + 1
+STATO_NORMALE, STATO_PORTO_ARMI, STATO_INCOMPLETO = 0, 1, 2
+
+
+class RisultatoColonnare:
+    """
+    Risultato di una query conservato per colonne: una lista per campo invece di
+    un dizionario per riga. Le stringhe ripetute (comuni, sigle) restano un solo oggetto.
+
+    Le righe si aggiornano una alla volta per ID (imposta_riga, rimuovi_riga): chi
+    rimuove una riga sposta l'ultima al suo posto, le altre non cambiano posizione.
+    """
+
+    # Chiave con l'identificativo delle righe
+    CHIAVE_ID = "id"
+
+    def __init__(self, chiavi: Sequence[str], colonne: Sequence[Sequence[Any]]):
+        self.chiavi = list(chiavi)
+        if not colonne:
+            colonne = [[] for _ in self.chiavi]
+        # Le colonne non vengono copiate: liste o tuple, che chi le passa non deve più modificare
+        self._colonne = dict(zip(self.chiavi, colonne))
+        self._righe = len(colonne[0]) if colonne else 0
+        # ID -> posizione, costruito al primo aggiornamento
+        self._posizioni = None
+
+    @classmethod
+    def da_righe(cls, chiavi: Sequence[str], righe: Iterable[Sequence[Any]]) -> "RisultatoColonnare":
+        return cls(chiavi, list(zip(*righe)))
+
+    def __len__(self):
+        return self._righe
+
+    def colonna(self, chiave: str) -> List[Any]:
+        return self._colonne[chiave]
+
+    def valore(self, riga: int, chiave: str) -> Any:
+        return self._colonne[chiave][riga]
+
+    def sottoinsieme(self, righe: Iterable[int]) -> "RisultatoColonnare":
+        """Nuovo risultato con le sole righe indicate, nell'ordine dato."""
+        righe = list(righe)
+        return RisultatoColonnare(self.chiavi, [[colonna[r] for r in righe]
+                                                for colonna in (self._colonne[c] for c in self.chiavi)])
+
+    def righe_con(self, chiave: str, testo: str, righe: Optional[Iterable[int]] = None) -> List[int]:
+        """Righe (tra quelle indicate, o tutte) il cui campo contiene testo, senza distinguere maiuscole e minuscole."""
+        colonna = self._colonne[chiave]
+        testo = testo.lower()
+        return [r for r in (range(self._righe) if righe is None else righe)
+                if testo in (colonna[r] or "").lower()]
+
+    def righe_almeno(self, chiave: str, minimo: int, righe: Optional[Iterable[int]] = None) -> List[int]:
+        """Righe (tra quelle indicate, o tutte) il cui campo numerico vale almeno minimo."""
+        colonna = self._colonne[chiave]
+        return [r for r in (range(self._righe) if righe is None else righe) if (colonna[r] or 0) >= minimo]
+
+    # --- Aggiornamenti per riga ---
+
+    def riga(self, posizione: int) -> List[Any]:
+        """Valori della riga nell'ordine di chiavi."""
+        return [self._colonne[chiave][posizione] for chiave in self.chiavi]
+
+    def id_riga(self, valori: Sequence[Any]) -> Any:
+        return valori[self.chiavi.index(self.CHIAVE_ID)]
+
+    def posizione(self, id_riga: Any) -> Optional[int]:
+        """Posizione della riga con l'ID indicato, None se non c'è."""
+        if self._posizioni is None:
+            self._posizioni = {valore: posizione for posizione, valore in enumerate(self._colonne[self.CHIAVE_ID])}
+        return self._posizioni.get(id_riga)
+
+    def _modificabile(self):
+        # Le colonne ricevute come tuple diventano liste alla prima modifica
+        for chiave, colonna in self._colonne.items():
+            if not isinstance(colonna, list):
+                self._colonne[chiave] = list(colonna)
+
+    def imposta_riga(self, valori: Sequence[Any]) -> Tuple[int, bool]:
+        """
+        Scrive i valori (nell'ordine di chiavi) sulla riga con lo stesso ID, o in fondo
+        se non c'è. Restituisce (posizione, True se la riga è nuova).
+        """
+        self._modificabile()
+        id_riga = self.id_riga(valori)
+        posizione = self.posizione(id_riga)
+        if posizione is not None:
+            for chiave, valore in zip(self.chiavi, valori):
+                self._colonne[chiave][posizione] = valore
+            return posizione, False
+        for chiave, valore in zip(self.chiavi, valori):
+            self._colonne[chiave].append(valore)
+        posizione = self._righe
+        self._righe += 1
+        self._posizioni[id_riga] = posizione
+        return posizione, True
+
+    def rimuovi_riga(self, id_riga: Any) -> Optional[Tuple[int, int]]:
+        """
+        Toglie la riga con l'ID indicato mettendo l'ultima al suo posto. Restituisce
+        (posizione tolta, posizione che aveva la riga spostata), None se l'ID non c'è.
+        """
+        posizione = self.posizione(id_riga)
+        if posizione is None:
+            return None
+        self._modificabile()
+        ultima = self._righe - 1
+        for colonna in self._colonne.values():
+            colonna[posizione] = colonna[ultima]
+            colonna.pop()
+        del self._posizioni[id_riga]
+        if ultima != posizione:
+            self._posizioni[self._colonne[self.CHIAVE_ID][posizione]] = posizione
+        self._righe -= 1
+        return posizione, ultima
+
+    def aggiorna(self, nuove: "RisultatoColonnare", ids: Iterable[Any]):
+        """Le righe di nuove sostituiscono quelle con lo stesso ID o si aggiungono; gli altri ids si tolgono."""
+        presenti = set()
+        for posizione in range(len(nuove)):
+            valori = nuove.riga(posizione)
+            presenti.add(self.id_riga(valori))
+            self.imposta_riga(valori)
+        for id_riga in set(ids) - presenti:
+            self.rimuovi_riga(id_riga)
+
+
+def chiave_data(testo: Optional[str]) -> str:
+    """Chiave di ordinamento cronologico per una data dd/MM/yyyy (gli altri testi restano invariati)."""
+    if testo and len(testo) == 10 and testo[2] == "/" and testo[5] == "/":
+        return testo[6:] + testo[3:5] + testo[:2]
+    return testo or ""
+
+
+class DetentoriTableModel(QAbstractTableModel):
+    """
+    Modello della tabella detentori. Tutte le righe del risultato sono in memoria
+    (per colonne), ma la vista ne riceve PAGINA alla volta man mano che scorre:
+    aprire la lista costa come mostrare la prima pagina anche con 200.000 detentori.
+    """
+
+    PAGINA = 500
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._dati = RisultatoColonnare(CHIAVI_LISTA, [])
+        self._colonne: List[Tuple[str, str]] = list(COLONNE_BASE)
+        self._ordine = array("I")
+        self._caricate = 0
+        # (chiave, decrescente) dell'ultimo sort(), None se le righe sono nell'ordine del risultato
+        self._ordinamento = None
+
+    # --- Dati ---
+
+    def imposta_dati(self, dati: RisultatoColonnare):
+        """Sostituisce il risultato mostrato (l'ordinamento è quello del risultato)."""
+        self.beginResetModel()
+        self._dati = dati
+        self._ordine = array("I", range(len(dati)))
+        self._caricate = min(self.PAGINA, len(dati))
+        self._ordinamento = None
+        self.endResetModel()
+
+    def aggiorna_righe(self, nuove: RisultatoColonnare, ids: Iterable[int]):
+        """
+        Applica una modifica parziale senza reset del modello: le righe di nuove
+        sostituiscono quelle con lo stesso ID o si inseriscono al loro posto
+        nell'ordinamento corrente, gli altri ids si tolgono. La vista riceve solo
+        le righe inserite, tolte o cambiate.
+        """
+        presenti = set()
+        for posizione in range(len(nuove)):
+            valori = nuove.riga(posizione)
+            presenti.add(self._dati.id_riga(valori))
+            self._imposta_riga(valori)
+        for id_riga in set(ids) - presenti:
+            self._rimuovi_riga(id_riga)
+
+    def _imposta_riga(self, valori: Sequence[Any]):
+        dati = self._dati
+        posizione = dati.posizione(dati.id_riga(valori))
+        if posizione is None:
+            posizione, _ = dati.imposta_riga(valori)
+            self._inserisci_nella_vista(posizione)
+            return
+        valore = self._funzione_ordinamento()
+        prima = valore(posizione)
+        dati.imposta_riga(valori)
+        riga = self._ordine.index(posizione)
+        if valore(posizione) == prima:
+            if riga < self._caricate:
+                self.dataChanged.emit(self.index(riga, 0), self.index(riga, len(self._colonne) - 1))
+            return
+        # Cambia il valore ordinato: la riga si sposta
+        self._togli_dalla_vista(riga)
+        self._inserisci_nella_vista(posizione)
+
+    def _rimuovi_riga(self, id_riga: int):
+        posizione = self._dati.posizione(id_riga)
+        if posizione is None:
+            return
+        self._togli_dalla_vista(self._ordine.index(posizione))
+        _, spostata = self._dati.rimuovi_riga(id_riga)
+        if spostata != posizione:
+            self._ordine[self._ordine.index(spostata)] = posizione
+
+    def _inserisci_nella_vista(self, posizione: int):
+        riga = self._riga_ordinata(posizione)
+        # Oltre le righe consegnate la nuova arriverà con fetchMore, salvo che siano già tutte nella vista
+        visibile = riga < self._caricate or self._caricate == len(self._ordine)
+        if visibile:
+            self.beginInsertRows(QModelIndex(), riga, riga)
+        self._ordine.insert(riga, posizione)
+        if visibile:
+            self._caricate += 1
+            self.endInsertRows()
+
+    def _togli_dalla_vista(self, riga: int):
+        visibile = riga < self._caricate
+        if visibile:
+            self.beginRemoveRows(QModelIndex(), riga, riga)
+        del self._ordine[riga]
+        if visibile:
+            self._caricate -= 1
+            self.endRemoveRows()
+
+    def _riga_ordinata(self, posizione: int) -> int:
+        """Riga in cui va la posizione secondo l'ordinamento corrente (dopo quelle con lo stesso valore)."""
+        if self._ordinamento is None:
+            return len(self._ordine)
+        decrescente = self._ordinamento[1]
+        valore = self._funzione_ordinamento()
+        cercato = valore(posizione)
+        ordine = self._ordine
+        basso, alto = 0, len(ordine)
+        while basso < alto:
+            medio = (basso + alto) // 2
+            if (cercato > valore(ordine[medio])) if decrescente else (cercato < valore(ordine[medio])):
+                alto = medio
+            else:
+                basso = medio + 1
+        return basso
+
+    def imposta_colonne(self, colonne: Sequence[Tuple[str, str]]):
+        self.beginResetModel()
+        self._colonne = list(colonne)
+        self.endResetModel()
+
+    def totale(self) -> int:
+        """Numero di righe del risultato, comprese quelle non ancora consegnate alla vista."""
+        return len(self._ordine)
+
+    def colonne(self) -> List[Tuple[str, str]]:
+        return list(self._colonne)
+
+    def id_detentore(self, riga: int) -> int:
+        return self._dati.valore(self._ordine[riga], "id")
+
+    def testo(self, riga: int, chiave: str) -> str:
+        """Testo mostrato per la chiave alla riga (nell'ordine corrente) del risultato."""
+        return self._testo(self._ordine[riga], chiave)
+
+    def _testo(self, posizione: int, chiave: str) -> str:
+        dati = self._dati
+        if chiave == "comuneResidenza":
+            comune = dati.valore(posizione, "comuneResidenza") or ""
+            sigla = dati.valore(posizione, "siglaProvinciaResidenza")
+            return f"{comune} ({sigla})" if sigla else comune
+        if chiave == "indirizzo":
+            parti = (dati.valore(posizione, c) for c in ("tipoVia", "via", "civico"))
+            return " ".join(str(p) for p in parti if p)
+        if chiave not in dati.chiavi:
+            return ""
+        valore = dati.valore(posizione, chiave)
+        return "" if valore is None else str(valore)
+
+    def _stato(self, posizione: int) -> int:
+        dati = self._dati
+        if not dati.valore(posizione, "codiceFiscale") or not dati.valore(posizione, "comuneResidenza"):
+            return STATO_INCOMPLETO
+        if dati.valore(posizione, "numeroPortoArmi"):
+            return STATO_PORTO_ARMI
+        return STATO_NORMALE
+
+    # --- QAbstractTableModel ---
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._caricate
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._colonne)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        chiave = self._colonne[index.column()][1]
+        posizione = self._ordine[index.row()]
+        if role == Qt.DisplayRole:
+            return self._testo(posizione, chiave)
+        if role == Qt.TextAlignmentRole and chiave in CHIAVI_CENTRATE:
+            return Qt.AlignCenter
+        if role == RUOLO_STATO:
+            return self._stato(posizione)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and section < len(self._colonne):
+            return self._colonne[section][0]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._caricate < len(self._ordine)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        nuove = min(self.PAGINA, len(self._ordine) - self._caricate)
+        if nuove <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._caricate, self._caricate + nuove - 1)
+        self._caricate += nuove
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Ordina tutto il risultato (non solo le righe consegnate) sulla colonna indicata."""
+        if column < 0 or column >= len(self._colonne):
+            return
+        chiave = self._colonne[column][1]
+        if chiave in CHIAVI_NUMERICHE:
+            chiavi_ordinamento = [v or 0 for v in self._dati.colonna(chiave)]
+        elif chiave in CHIAVI_DATA:
+            chiavi_ordinamento = [chiave_data(v) for v in self._dati.colonna(chiave)]
+        elif chiave in self._dati.chiavi:
+            chiavi_ordinamento = ["" if v is None else str(v).lower() for v in self._dati.colonna(chiave)]
+        else:
+            chiavi_ordinamento = [self._testo(p, chiave).lower() for p in range(len(self._dati))]
+        self.beginResetModel()
+        self._ordine = array("I", sorted(range(len(self._dati)), key=chiavi_ordinamento.__getitem__,
+                                         reverse=(order == Qt.DescendingOrder)))
+        self._ordinamento = (chiave, order == Qt.DescendingOrder)
+        self.endResetModel()
+
+    def _funzione_ordinamento(self):
+        """posizione -> valore ordinato da sort() per una riga (lo stesso calcolo, su una riga sola)."""
+        if self._ordinamento is None:
+            return lambda posizione: 0
+        chiave = self._ordinamento[0]
+        dati = self._dati
+        if chiave in CHIAVI_NUMERICHE:
+            return lambda posizione: dati.valore(posizione, chiave) or 0
+        if chiave in CHIAVI_DATA:
+            return lambda posizione: chiave_data(dati.valore(posizione, chiave))
+        if chiave in dati.chiavi:
+            return lambda posizione: "" if dati.valore(posizione, chiave) is None \
+                else str(dati.valore(posizione, chiave)).lower()
+        return lambda posizione: self._testo(posizione, chiave).lower()
+
+
+class DelegatoDetentori(QStyledItemDelegate):
+    """
+    Colora le righe secondo RUOLO_STATO: grigio per i dati incompleti (senza codice
+    fiscale o comune), ID in verde per i titolari di porto d'armi.
+    """
+
+    COLORE_INCOMPLETO = QColor(128, 128, 128)
+    COLORE_PORTO_ARMI = QColor(0, 128, 0)
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        stato = index.data(RUOLO_STATO)
+        if stato == STATO_INCOMPLETO:
+            option.palette.setColor(QPalette.Text, self.COLORE_INCOMPLETO)
+        elif stato == STATO_PORTO_ARMI and index.column() == 0:
+            option.palette.setColor(QPalette.Text, self.COLORE_PORTO_ARMI)
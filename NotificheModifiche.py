@@ -0,0 +1,114 @@
+# NotificheModifiche.py
+# Notifica alle finestre aperte delle righe inserite, modificate o eliminate, lette da
+# registro_modifiche: subito dopo le scritture di questo processo e, per quelle delle
+# altre postazioni, quando PRAGMA data_version indica un commit di un'altra connessione
+
+from typing import Iterable, List, Set
+
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+
+from Database import (
+    DatabaseManager, RegistroModificheRepository, EventoModifica, INSERITA, AGGIORNATA, ELIMINATA
+)
+
+
+class ModificheDati:
+    """
+    Modifiche lette in un controllo del registro. Con ricarica vera gli eventi non sono
+    completi (il registro è già stato ripulito oltre l'ultima modifica vista, o le
+    modifiche sono troppe): chi le riceve deve rileggere tutto.
+    """
+
+    def __init__(self, eventi: List[EventoModifica], ricarica: bool = False):
+        self.eventi = eventi
+        self.ricarica = ricarica
+
+    def ids(self, tabella: str, operazioni: Iterable[str] = (INSERITA, AGGIORNATA, ELIMINATA)) -> Set[int]:
+        """ID delle righe di tabella con una delle operazioni indicate."""
+        operazioni = set(operazioni)
+        return {e.id_riga for e in self.eventi if e.tabella == tabella and e.operazione in operazioni}
+
+    def detentori(self) -> Set[int]:
+        """Detentori la cui riga nella lista (anagrafica o riepilogo delle armi) può essere cambiata."""
+        ids = set()
+        for evento in self.eventi:
+            ids.add(evento.id_detentore)
+            ids.add(evento.id_detentore_precedente)
+        ids.discard(None)
+        return ids
+
+    def armi_di(self, detentore_id: int) -> Set[int]:
+        """Armi aggiunte, modificate o tolte al detentore."""
+        return {e.id_riga for e in self.eventi
+                if e.tabella == "armi" and detentore_id in (e.id_detentore, e.id_detentore_precedente)}
+
+
+class BusModifiche(QObject):
+    """
+    Unico lettore del registro per tutto il processo: le finestre si collegano a
+    modifiche e ricevono ogni gruppo di eventi una sola volta, nel thread dell'interfaccia.
+
+    Il registro si rilegge dopo ogni scrittura dell'applicazione (osservatore di
+    DatabaseManager) e, ogni INTERVALLO_CONTROLLO_MS, se data_version è cambiata:
+    il controllo periodico costa un PRAGMA finché nessun altro scrive.
+    """
+
+    # ModificheDati
+    modifiche = pyqtSignal(object)
+    # Emesso dal thread che ha scritto, ricevuto nel thread dell'interfaccia
+    _scrittura = pyqtSignal()
+
+    INTERVALLO_CONTROLLO_MS = 1000
+    # Oltre questo numero di modifiche in un controllo conviene rileggere tutto
+    MASSIMO_EVENTI = 2000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._registro = RegistroModificheRepository()
+        self._versione = self._registro.versione_dati()
+        self._ultima = self._registro.ultima()
+
+        self._scrittura.connect(self.controlla, Qt.QueuedConnection)
+        DatabaseManager().aggiungi_osservatore_scritture(self._scrittura.emit)
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._controlla_versione)
+        self._timer.start(self.INTERVALLO_CONTROLLO_MS)
+
+    def _controlla_versione(self):
+        """Controllo periodico: il registro si legge solo se un'altra connessione ha scritto."""
+        try:
+            versione = self._registro.versione_dati()
+        except Exception as e:
+            print(f"Errore nel controllo delle modifiche: {e}")
+            return
+        if versione != self._versione:
+            self.controlla()
+
+    def controlla(self):
+        """Legge le modifiche successive all'ultima vista e le notifica."""
+        try:
+            # Prima la versione: un commit che arriva tra le due letture si rilegge al controllo successivo
+            self._versione = self._registro.versione_dati()
+            eventi = self._registro.successive(self._ultima, self.MASSIMO_EVENTI + 1)
+            if not eventi:
+                return
+            # Gli ID del registro sono consecutivi: se manca il successivo dell'ultimo visto
+            # le righe intermedie sono già state eliminate dalla pulizia
+            ricarica = eventi[0].id != self._ultima + 1 or len(eventi) > self.MASSIMO_EVENTI
+            self._ultima = self._registro.ultima() if ricarica else eventi[-1].id
+        except Exception as e:
+            print(f"Errore nella lettura del registro delle modifiche: {e}")
+            return
+        self.modifiche.emit(ModificheDati([] if ricarica else eventi, ricarica))
+
+
+_bus = None
+
+
+def bus_modifiche() -> BusModifiche:
+    """Il bus del processo, creato al primo uso (dal thread dell'interfaccia)."""
+    global _bus
+    if _bus is None:
+        _bus = BusModifiche()
+    return _bus
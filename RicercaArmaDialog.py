@@ -1,12 +1,17 @@
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
     QTableWidget, QTableWidgetItem, QMessageBox, QHeaderView, QGroupBox,
-    QGridLayout, QApplication, QComboBox
+    QGridLayout, QApplication, QComboBox, QSpinBox
 )
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont, QColor
 from Storico_Movimenti_Armi import StoricoMovimentiArmaDialog
+from Database import DatabaseManager, RicercaArmiRepository
+from Avvio import caricamento_avvio
+from Utility import attendi_futuro
+from RicercaMatricole import RicercaMatricole, DISTANZA_PREDEFINITA, DISTANZA_MASSIMA
 
 
 class RicercaArmaDialog(QDialog):
@@ -16,6 +21,23 @@ class RicercaArmaDialog(QDialog):
         self.resize(900, 600)
         self.setWindowFlags(self.windowFlags() | Qt.WindowMaximizeButtonHint)
         self.setup_ui()
+        # L'indice delle matricole si carica in background alla prima apertura, sul thread
+        # dei caricamenti di avvio (che tiene la sua connessione per tutta la sessione)
+        avvio = caricamento_avvio()
+        if avvio is not None:
+            self.caricamento_matricole = avvio.avvia("matricole", RicercaMatricole.condivisa().aggiorna)
+        else:
+            esecutore = ThreadPoolExecutor(max_workers=1, thread_name_prefix="matricole")
+            self.caricamento_matricole = esecutore.submit(self.aggiorna_matricole)
+            esecutore.shutdown(wait=False)
+
+    @staticmethod
+    def aggiorna_matricole():
+        """Aggiornamento dell'indice su un thread dedicato, che chiude la sua connessione alla fine"""
+        try:
+            RicercaMatricole.condivisa().aggiorna()
+        finally:
+            DatabaseManager().close_connection()
 
     def setup_ui(self):
         main_layout = QVBoxLayout(self)
@@ -82,6 +104,16 @@ class RicercaArmaDialog(QDialog):
         self.reset_button.setIcon(QApplication.style().standardIcon(QApplication.style().SP_DialogResetButton))
         search_layout.addWidget(self.reset_button, 2, 4)
 
+        # Quarta riga: tolleranza della ricerca per matricola (0 = solo corrispondenze esatte)
+        self.tolleranza_label = QLabel("Tolleranza matricola:")
+        self.tolleranza_spin = QSpinBox()
+        self.tolleranza_spin.setRange(0, DISTANZA_MASSIMA)
+        self.tolleranza_spin.setValue(DISTANZA_PREDEFINITA)
+        self.tolleranza_spin.setToolTip("Numero di caratteri sbagliati, mancanti o scambiati ammessi.\n"
+                                        "O/0, I/L/1, S/5, Z/2, B/8 e G/6 sono considerati uguali.")
+        search_layout.addWidget(self.tolleranza_label, 3, 0)
+        search_layout.addWidget(self.tolleranza_spin, 3, 1)
+
         search_group.setLayout(search_layout)
         main_layout.addWidget(search_group)
 
@@ -150,105 +182,18 @@ class RicercaArmaDialog(QDialog):
         all_results = []
 
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # PARTE 1: Cerca nelle armi attive
-            if include_deleted != "Solo cancellate":
-                where_clauses = []
-                params = []
-                if marca:
-                    where_clauses.append("LOWER(a.MarcaArma) LIKE ?")
-                    params.append(f"%{marca.lower()}%")
-                if modello:
-                    where_clauses.append("LOWER(a.ModelloArma) LIKE ?")
-                    params.append(f"%{modello.lower()}%")
-                if matricola:
-                    where_clauses.append("LOWER(a.Matricola) LIKE ?")
-                    params.append(f"%{matricola.lower()}%")
-                if calibro:
-                    where_clauses.append("LOWER(a.CalibroArma) LIKE ?")
-                    params.append(f"%{calibro.lower()}%")
-                if tipo and tipo != "Tutti":
-                    where_clauses.append("a.TipoArma = ?")
-                    params.append(tipo)
-                if detentore:
-                    where_clauses.append("LOWER(d.Cognome) LIKE ?")
-                    params.append(f"%{detentore.lower()}%")
-
-                where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
-
-                # Query corretta con tutte le colonne specificate
-                query = f"""
-                    SELECT a.ID_ArmaDetenuta, a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma, 
-                           a.TipoArma, d.Cognome || ' ' || d.Nome, 'Attiva' as Stato
-                    FROM armi a
-                    LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
-                    WHERE {where_clause}
-                """
-                print("Query attive:", query, params)
-                cursor.execute(query, params)
-                active_results = cursor.fetchall()
-                print("Risultati attive:", active_results)
-                all_results.extend(active_results)
-
-            # PARTE 2: Cerca nelle armi cancellate
-            if include_deleted != "No":
-                t_where_clauses = []
-                t_params = []
-                t_where_clauses.append("t.Motivo_Trasferimento = 'ELIMINAZIONE'")
-                if marca:
-                    t_where_clauses.append("LOWER(t.MarcaArma) LIKE ?")
-                    t_params.append(f"%{marca.lower()}%")
-                if modello:
-                    t_where_clauses.append("LOWER(t.ModelloArma) LIKE ?")
-                    t_params.append(f"%{modello.lower()}%")
-                if matricola:
-                    t_where_clauses.append("LOWER(t.Matricola) LIKE ?")
-                    t_params.append(f"%{matricola.lower()}%")
-                if calibro:
-                    t_where_clauses.append("LOWER(t.CalibroArma) LIKE ?")
-                    t_params.append(f"%{calibro.lower()}%")
-                if tipo and tipo != "Tutti":
-                    t_where_clauses.append("t.TipoArma = ?")
-                    t_params.append(tipo)
-                if detentore:
-                    t_where_clauses.append("(LOWER(t.Cedente_Cognome) LIKE ? OR LOWER(t.Ricevente_Cognome) LIKE ?)")
-                    t_params.append(f"%{detentore.lower()}%")
-                    t_params.append(f"%{detentore.lower()}%")
-
-                t_where_clause = " AND ".join(t_where_clauses)
-                query = f"""
-                    SELECT 
-                        t.ID_Arma as ID_ArmaDetenuta, 
-                        t.MarcaArma, 
-                        t.ModelloArma, 
-                        t.Matricola, 
-                        t.CalibroArma, 
-                        t.TipoArma, 
-                        t.Cedente_Cognome || ' ' || t.Cedente_Nome as Detentore,
-                        'Cancellata (' || t.Data_Trasferimento || ')' as Stato
-                    FROM trasferimenti t
-                    INNER JOIN (
-                        SELECT Matricola, MAX(Data_Trasferimento) as MaxData, MAX(Timestamp_Registrazione) as MaxTimestamp
-                        FROM trasferimenti
-                        WHERE Motivo_Trasferimento = 'ELIMINAZIONE'
-                        GROUP BY Matricola
-                    ) latest ON t.Matricola = latest.Matricola 
-                        AND t.Data_Trasferimento = latest.MaxData
-                        AND t.Timestamp_Registrazione = latest.MaxTimestamp
-                    WHERE {t_where_clause}
-                """
-                print("Query cancellate:", query, t_params)
-                cursor.execute(query, t_params)
-                deleted_results = cursor.fetchall()
-                print("Risultati cancellate:", deleted_results)
-                active_matricole = set(row[3] for row in all_results)
-                filtered_deleted = [row for row in deleted_results if row[3] not in active_matricole]
-                all_results.extend(filtered_deleted)
-
-            conn.close()
-            print("Risultati totali:", all_results)
+            filtri = {"marca": marca, "modello": modello, "matricola": matricola, "calibro": calibro,
+                      "tipo": tipo if tipo != "Tutti" else "", "detentore": detentore}
+
+            # Ricerca sull'indice full-text (armi attive e cancellate), ordinata per rilevanza
+            all_results = RicercaArmiRepository().cerca(
+                filtri,
+                attive=include_deleted != "Solo cancellate",
+                eliminate=include_deleted != "No"
+            )
+            if matricola and self.tolleranza_spin.value() > 0:
+                all_results.extend(self.search_matricole_simili(filtri, all_results, include_deleted))
+            print("Risultati totali:", len(all_results))
 
             self.result_table.setRowCount(len(all_results))
             for row_idx, row in enumerate(all_results):
@@ -269,6 +214,42 @@ class RicercaArmaDialog(QDialog):
             print("Errore durante la ricerca:", e)
             QMessageBox.critical(self, "Errore", f"Errore durante la ricerca:\n{e}")
 
+    def search_matricole_simili(self, filtri, risultati_esatti, include_deleted):
+        """Armi con matricola simile a quella cercata, escluse quelle già trovate"""
+        # Alla prima ricerca l'indice può essere ancora in caricamento: si attende mostrando l'attesa
+        try:
+            attendi_futuro(self.caricamento_matricole, self, "Caricamento dell'indice delle matricole...")
+        except Exception as e:
+            print("Errore nel caricamento dell'indice delle matricole:", e)
+        simili = RicercaMatricole.condivisa().cerca(filtri["matricola"], self.tolleranza_spin.value())
+        distanze = {}
+        for matricola_simile, distanza in simili:
+            distanze.setdefault(matricola_simile, distanza)
+        if not distanze:
+            return []
+
+        righe = RicercaArmiRepository().cerca_per_matricole(
+            list(distanze),
+            tipo=filtri["tipo"],
+            attive=include_deleted != "Solo cancellate",
+            eliminate=include_deleted != "No"
+        )
+        gia_trovate = set((row[0], row[3]) for row in risultati_esatti)
+        # Gli altri filtri di testo restano validi anche sui risultati approssimati
+        colonne_filtri = (("marca", 1), ("modello", 2), ("calibro", 4), ("detentore", 6))
+        risultati = []
+        for row in righe:
+            if (row[0], row[3]) in gia_trovate:
+                continue
+            if any(filtri[chiave] and filtri[chiave].lower() not in str(row[colonna] or '').lower()
+                   for chiave, colonna in colonne_filtri):
+                continue
+            # row[8] è la matricola della canna, che può essere quella trovata
+            distanza = min(distanze.get(row[3], DISTANZA_MASSIMA + 1), distanze.get(row[8], DISTANZA_MASSIMA + 1))
+            risultati.append((distanza, tuple(row[:7]) + (f"{row[7]} - simile (distanza {distanza})",)))
+        risultati.sort(key=lambda r: r[0])
+        return [row for _, row in risultati]
+
     def reset_filters(self):
         self.marca_input.clear()
         self.modello_input.clear()
@@ -277,6 +258,7 @@ class RicercaArmaDialog(QDialog):
         self.tipo_combo.setCurrentIndex(0)
         self.detentore_input.clear()
         self.include_deleted_checkbox.setCurrentIndex(0)
+        self.tolleranza_spin.setValue(DISTANZA_PREDEFINITA)
         self.result_table.setRowCount(0)
         self.view_button.setEnabled(False)
 
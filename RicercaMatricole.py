@@ -0,0 +1,298 @@
+# RicercaMatricole.py
+# Ricerca approssimata delle matricole (armi e canne) con indice a trigrammi
+# e ordinamento per distanza di Damerau-Levenshtein
+
+import threading
+import time
+import logging
+from array import array
+from collections import Counter
+from typing import List, Tuple, Optional, Iterable
+
+from Database import DatabaseManager
+
+logger = logging.getLogger("RicercaMatricole")
+
+# Distanza massima predefinita (numero di caratteri sbagliati, mancanti o scambiati)
+DISTANZA_PREDEFINITA = 1
+DISTANZA_MASSIMA = 3
+
+# Caratteri che l'OCR e la trascrizione a mano confondono spesso: vengono
+# ricondotti allo stesso simbolo prima di indicizzare e di confrontare
+EQUIVALENZE_OCR = str.maketrans({
+    "O": "0", "Q": "0",
+    "I": "1", "L": "1",
+    "Z": "2",
+    "S": "5",
+    "G": "6",
+    "B": "8",
+})
+
+# Delimitatori aggiunti a inizio e fine matricola per generare i trigrammi di bordo
+_INIZIO = "\x02\x02"
+_FINE = "\x03\x03"
+
+# Un errore di Damerau-Levenshtein altera al massimo 4 trigrammi (lo scambio di
+# due caratteri adiacenti tocca i 3 trigrammi di ciascuno, 4 distinti in tutto)
+# e sposta i successivi al più di una posizione
+_TRIGRAMMI_PER_ERRORE = 4
+
+
+def normalizza_matricola(matricola: Optional[str]) -> str:
+    """
+    Porta la matricola in forma canonica: maiuscole, senza spazi, trattini,
+    punti o barre, con i caratteri confondibili ricondotti alla stessa cifra.
+    """
+    if not matricola:
+        return ""
+    testo = "".join(c for c in str(matricola).upper() if c.isalnum())
+    return testo.translate(EQUIVALENZE_OCR)
+
+
+def trigrammi(normalizzata: str) -> List[Tuple[str, int]]:
+    """Trigrammi (con delimitatori di bordo) di una matricola normalizzata, con la loro posizione."""
+    testo = _INIZIO + normalizzata + _FINE
+    return [(testo[i:i + 3], i) for i in range(len(testo) - 2)]
+
+
+def distanza_limitata(a: str, b: str, limite: int) -> int:
+    """
+    Distanza di Damerau-Levenshtein (variante optimal string alignment) tra a e b.
+    Il calcolo si ferma appena supera il limite e in quel caso restituisce limite + 1.
+    """
+    if a == b:
+        return 0
+    la, lb = len(a), len(b)
+    if abs(la - lb) > limite:
+        return limite + 1
+    oltre = limite + 1
+
+    precedente = None
+    riga_prec = list(range(lb + 1))
+    for i in range(1, la + 1):
+        riga = [i] + [oltre] * lb
+        # Solo la fascia diagonale |i - j| <= limite può restare entro il limite
+        inizio = max(1, i - limite)
+        fine = min(lb, i + limite)
+        minimo = riga[0] if inizio == 1 else oltre
+        ca = a[i - 1]
+        for j in range(inizio, fine + 1):
+            costo = 0 if ca == b[j - 1] else 1
+            valore = min(riga_prec[j] + 1, riga[j - 1] + 1, riga_prec[j - 1] + costo)
+            if (precedente is not None and j > 1 and ca == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                valore = min(valore, precedente[j - 2] + 1)
+            riga[j] = valore
+            if valore < minimo:
+                minimo = valore
+        if minimo > limite:
+            return oltre
+        precedente, riga_prec = riga_prec, riga
+    return min(riga_prec[lb], oltre)
+
+
+class IndiceMatricole:
+    """
+    Indice invertito a trigrammi sulle matricole normalizzate.
+
+    Ogni matricola normalizzata distinta riceve un numero progressivo; per ogni
+    coppia (trigramma, posizione) si conserva l'elenco (array di interi) delle
+    matricole che la contengono. Una ricerca conta i trigrammi in comune con la
+    matricola cercata entro uno spostamento pari alla distanza, scarta le
+    candidate che ne condividono troppo pochi per stare entro quella distanza
+    e calcola la distanza esatta solo sulle rimanenti.
+    """
+
+    def __init__(self):
+        self._normalizzate: List[str] = []
+        self._originali: List[List[str]] = []
+        self._posizioni = {}
+        self._liste = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._normalizzate)
+
+    def aggiungi(self, matricole: Iterable[Optional[str]]):
+        """Aggiunge all'indice le matricole non ancora presenti."""
+        with self._lock:
+            for originale in matricole:
+                if not originale:
+                    continue
+                originale = str(originale).strip()
+                normalizzata = normalizza_matricola(originale)
+                if not normalizzata:
+                    continue
+                posizione = self._posizioni.get(normalizzata)
+                if posizione is not None:
+                    if originale not in self._originali[posizione]:
+                        self._originali[posizione].append(originale)
+                    continue
+                posizione = len(self._normalizzate)
+                self._posizioni[normalizzata] = posizione
+                self._normalizzate.append(normalizzata)
+                self._originali.append([originale])
+                for chiave in trigrammi(normalizzata):
+                    lista = self._liste.get(chiave)
+                    if lista is None:
+                        lista = self._liste[chiave] = array("I")
+                    lista.append(posizione)
+
+    def cerca(self, matricola: str, distanza: int = DISTANZA_PREDEFINITA,
+              limite_risultati: int = 50) -> List[Tuple[str, int]]:
+        """
+        Restituisce le matricole originali entro la distanza indicata,
+        ordinate per distanza e poi per differenza di lunghezza.
+
+        Args:
+            matricola: Matricola cercata (anche parziale o con errori di lettura)
+            distanza: Distanza massima di Damerau-Levenshtein dopo la normalizzazione
+                (ridotta a un errore ogni quattro caratteri)
+            limite_risultati: Numero massimo di matricole normalizzate restituite
+
+        Returns:
+            Lista di (matricola originale, distanza)
+        """
+        cercata = normalizza_matricola(matricola)
+        if not cercata:
+            return []
+        # Oltre un errore ogni quattro caratteri le matricole "simili" non sono più
+        # significative e il filtro sui trigrammi non scarta quasi nulla
+        distanza = max(0, min(int(distanza), DISTANZA_MASSIMA, max(1, len(cercata) // 4)))
+
+        with self._lock:
+            grammi = trigrammi(cercata)
+            # Filtro sul conteggio: una matricola entro la distanza conserva almeno
+            # soglia trigrammi di quella cercata, spostati al più di distanza posizioni.
+            # Per matricole molto corte la soglia teorica scende a zero e si
+            # richiede almeno un trigramma comune.
+            soglia = max(1, len(grammi) - _TRIGRAMMI_PER_ERRORE * distanza)
+            conteggi = Counter()
+            for trigramma, inizio in grammi:
+                for posizione in range(max(0, inizio - distanza), inizio + distanza + 1):
+                    lista = self._liste.get((trigramma, posizione))
+                    if lista is not None:
+                        conteggi.update(lista)
+
+            # Le candidate con più trigrammi in comune sono le più vicine: si verificano
+            # per prime e ci si ferma quando le restanti, che per il conteggio hanno
+            # distanza almeno minima, non possono più entrare tra i risultati
+            candidate = sorted(((comuni, posizione) for posizione, comuni in conteggi.items()
+                                if comuni >= soglia), reverse=True)
+            lunghezza = len(cercata)
+            per_distanza = [0] * (distanza + 1)
+            trovate = []
+            for comuni, posizione in candidate:
+                minima = -(-(len(grammi) - comuni) // _TRIGRAMMI_PER_ERRORE)
+                if sum(per_distanza[:minima]) >= limite_risultati:
+                    break
+                candidata = self._normalizzate[posizione]
+                if abs(len(candidata) - lunghezza) > distanza:
+                    continue
+                d = distanza_limitata(cercata, candidata, distanza)
+                if d <= distanza:
+                    per_distanza[d] += 1
+                    trovate.append((d, abs(len(candidata) - lunghezza), candidata, posizione))
+
+            trovate.sort()
+            risultati = []
+            for d, _, _, posizione in trovate[:limite_risultati]:
+                for originale in self._originali[posizione]:
+                    risultati.append((originale, d))
+            return risultati
+
+
+class RicercaMatricole:
+    """
+    Indice delle matricole di armi (Matricola e MatricolaCanna) e trasferimenti,
+    caricato al primo utilizzo e condiviso da tutto il processo.
+
+    Le righe aggiunte dopo il caricamento vengono lette in modo incrementale
+    (rowid maggiore dell'ultimo letto) alla ricerca successiva; le matricole
+    modificate vanno segnalate con registra_matricole(). Le voci rimaste
+    dopo una modifica o un'eliminazione non producono risultati spuri perché
+    le armi vengono poi cercate nel database per matricola esatta.
+    """
+
+    SQL_ULTIMI_ROWID = """
+        SELECT (SELECT COALESCE(MAX(rowid), 0) FROM armi),
+               (SELECT COALESCE(MAX(rowid), 0) FROM trasferimenti)
+    """
+    SQL_MATRICOLE_ARMI = "SELECT Matricola, MatricolaCanna FROM armi WHERE rowid > ?"
+    SQL_MATRICOLE_TRASFERIMENTI = "SELECT Matricola FROM trasferimenti WHERE rowid > ?"
+
+    _istanza = None
+    _lock_istanza = threading.Lock()
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or DatabaseManager()
+        self.indice = IndiceMatricole()
+        self._ultimo_arma = 0
+        self._ultimo_trasferimento = 0
+        # Un aggiornamento alla volta; _lock protegge solo lo scambio dell'indice
+        self._lock_aggiornamento = threading.Lock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def condivisa(cls) -> "RicercaMatricole":
+        with cls._lock_istanza:
+            if cls._istanza is None:
+                cls._istanza = cls()
+            return cls._istanza
+
+    @classmethod
+    def caricata(cls) -> bool:
+        return cls._istanza is not None and len(cls._istanza.indice) > 0
+
+    def aggiorna(self):
+        """Legge le matricole inserite dopo l'ultimo aggiornamento."""
+        with self._lock_aggiornamento:
+            self._aggiorna()
+
+    def _aggiorna(self):
+        ultimo_arma, ultimo_trasferimento = self.db.fetchone(self.SQL_ULTIMI_ROWID)
+        if ultimo_arma == self._ultimo_arma and ultimo_trasferimento == self._ultimo_trasferimento:
+            return
+        inizio = time.perf_counter()
+        # Il primo caricamento (lungo) riempie un indice nuovo, senza tenere _lock:
+        # le ricerche intanto usano quello attuale, sostituito solo alla fine
+        primo = self._ultimo_arma == 0 and self._ultimo_trasferimento == 0
+        indice = IndiceMatricole() if primo else self.indice
+        prima = len(indice)
+        if ultimo_arma > self._ultimo_arma:
+            for matricola, matricola_canna in self.db.fetchall(self.SQL_MATRICOLE_ARMI, (self._ultimo_arma,)):
+                indice.aggiungi((matricola, matricola_canna))
+        if ultimo_trasferimento > self._ultimo_trasferimento:
+            righe = self.db.fetchall(self.SQL_MATRICOLE_TRASFERIMENTI, (self._ultimo_trasferimento,))
+            indice.aggiungi(row[0] for row in righe)
+        with self._lock:
+            self.indice = indice
+            self._ultimo_arma = ultimo_arma
+            self._ultimo_trasferimento = ultimo_trasferimento
+        logger.info(f"Indice matricole: {len(indice) - prima} nuove voci "
+                    f"({len(indice)} totali) in {(time.perf_counter() - inizio) * 1000:.0f} ms")
+
+    def cerca(self, matricola: str, distanza: int = DISTANZA_PREDEFINITA) -> List[Tuple[str, int]]:
+        """
+        Cerca nell'indice attuale. Le righe nuove si leggono prima della ricerca solo se
+        nessun altro aggiornamento è in corso: la ricerca non attende mai il caricamento.
+        """
+        if self._lock_aggiornamento.acquire(blocking=False):
+            try:
+                self._aggiorna()
+            finally:
+                self._lock_aggiornamento.release()
+        with self._lock:
+            indice = self.indice
+        return indice.cerca(matricola, distanza)
+
+
+def registra_matricole(*matricole: Optional[str]):
+    """Aggiunge all'indice condiviso, se già caricato, matricole inserite o modificate."""
+    if RicercaMatricole.caricata():
+        RicercaMatricole.condivisa().indice.aggiungi(matricole)
+
+
+def cerca_matricole_simili(matricola: str, distanza: int = DISTANZA_PREDEFINITA) -> List[Tuple[str, int]]:
+    """Scorciatoia sull'indice condiviso: (matricola originale, distanza) ordinate."""
+    return RicercaMatricole.condivisa().cerca(matricola, distanza)
@@ -0,0 +1,145 @@
+# StampaTabella.py
+# Stampa di tabelle lunghe disegnata pagina per pagina con QPainter, leggendo
+# le celle direttamente dal modello invece di costruire un documento HTML
+
+import math
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QPainter, QFont, QFontMetricsF, QColor, QPen
+
+
+class StampaTabella:
+    """
+    Impaginazione di una tabella a righe di altezza fissa: le larghezze delle
+    colonne si calcolano una sola volta (su un campione delle righe) e ogni pagina
+    contiene lo stesso numero di righe, quindi la pagina n si disegna senza
+    impaginare le precedenti. Il testo troppo lungo per la colonna viene troncato.
+    """
+
+    FONT = "Arial"
+    PUNTI_TITOLO = 16
+    PUNTI_TESTO = 9
+    PUNTI_PIEDE = 8
+    # Righe misurate per stimare le larghezze delle colonne
+    CAMPIONE_LARGHEZZE = 1000
+
+    COLORE_TITOLO = QColor(51, 51, 51)
+    COLORE_INTESTAZIONE = QColor(242, 242, 242)
+    COLORE_BORDO = QColor(221, 221, 221)
+    COLORE_PIEDE = QColor(119, 119, 119)
+
+    def __init__(self, titolo: str, colonne: Sequence[Tuple[str, str]], righe: int,
+                 testo: Callable[[int, str], str], centrate: Iterable[str] = ()):
+        """
+        Args:
+            titolo: Titolo ripetuto in cima a ogni pagina
+            colonne: Lista di (intestazione, chiave)
+            righe: Numero di righe della tabella
+            testo: testo(riga, chiave), il testo della cella
+            centrate: Chiavi delle colonne da centrare
+        """
+        self.titolo = titolo
+        self.colonne = list(colonne)
+        self.righe = righe
+        self.testo = testo
+        self.centrate = set(centrate)
+
+    def stampa(self, printer):
+        """Disegna sul printer le pagine richieste (tutte, o l'intervallo scelto nel dialogo di stampa)."""
+        painter = QPainter()
+        if not painter.begin(printer):
+            return
+        try:
+            self._impagina(painter)
+            prima = max(printer.fromPage(), 1)
+            ultima = min(printer.toPage() or self.pagine, self.pagine)
+            for pagina in range(prima - 1, ultima):
+                if pagina > prima - 1:
+                    printer.newPage()
+                self._disegna_pagina(painter, pagina)
+        finally:
+            painter.end()
+
+    def _impagina(self, painter):
+        """Font, altezze, larghezze delle colonne e righe per pagina per il dispositivo del painter."""
+        dispositivo = painter.device()
+        self._area = QRectF(painter.viewport())
+
+        self._font_titolo = QFont(self.FONT, self.PUNTI_TITOLO, QFont.Bold)
+        self._font_testo = QFont(self.FONT, self.PUNTI_TESTO)
+        self._font_intestazione = QFont(self.FONT, self.PUNTI_TESTO, QFont.Bold)
+        self._font_piede = QFont(self.FONT, self.PUNTI_PIEDE)
+        metriche = QFontMetricsF(self._font_testo, dispositivo)
+        metriche_intestazione = QFontMetricsF(self._font_intestazione, dispositivo)
+
+        self._spazio = metriche.averageCharWidth()
+        self._altezza_titolo = QFontMetricsF(self._font_titolo, dispositivo).height() * 2
+        self._altezza_piede = QFontMetricsF(self._font_piede, dispositivo).height() * 2
+        self._altezza_riga = metriche.height() * 1.6
+
+        # Larghezza naturale di ogni colonna, poi scalata per riempire la pagina
+        campione = self._righe_campione()
+        larghezze = []
+        for titolo, chiave in self.colonne:
+            larghezza = metriche_intestazione.horizontalAdvance(titolo)
+            for riga in campione:
+                larghezza = max(larghezza, metriche.horizontalAdvance(self.testo(riga, chiave)))
+            larghezze.append(larghezza + 2 * self._spazio)
+        fattore = self._area.width() / sum(larghezze) if larghezze else 1
+        self._larghezze: List[float] = [larghezza * fattore for larghezza in larghezze]
+
+        spazio_righe = self._area.height() - self._altezza_titolo - self._altezza_piede - self._altezza_riga
+        self.righe_per_pagina = max(1, int(spazio_righe // self._altezza_riga))
+        self.pagine = max(1, math.ceil(self.righe / self.righe_per_pagina))
+        self._stampato = datetime.now()
+
+    def _righe_campione(self) -> range:
+        """Righe distribuite su tutta la tabella, al più CAMPIONE_LARGHEZZE."""
+        passo = max(1, math.ceil(self.righe / self.CAMPIONE_LARGHEZZE))
+        return range(0, self.righe, passo)
+
+    def _disegna_pagina(self, painter, pagina: int):
+        area = self._area
+        x0, y = area.left(), area.top()
+
+        painter.setFont(self._font_titolo)
+        painter.setPen(self.COLORE_TITOLO)
+        painter.drawText(QRectF(x0, y, area.width(), self._altezza_titolo), Qt.AlignHCenter | Qt.AlignTop, self.titolo)
+        y += self._altezza_titolo
+
+        # Intestazioni
+        painter.setFont(self._font_intestazione)
+        self._disegna_riga(painter, y, [titolo for titolo, _ in self.colonne], self.COLORE_INTESTAZIONE)
+        y += self._altezza_riga
+
+        # Righe della pagina
+        painter.setFont(self._font_testo)
+        inizio = pagina * self.righe_per_pagina
+        for riga in range(inizio, min(inizio + self.righe_per_pagina, self.righe)):
+            self._disegna_riga(painter, y, [self.testo(riga, chiave) for _, chiave in self.colonne])
+            y += self._altezza_riga
+
+        # Piede con data, ora e numero di pagina
+        painter.setFont(self._font_piede)
+        painter.setPen(self.COLORE_PIEDE)
+        piede = (f"Stampato il {self._stampato.strftime('%d/%m/%Y')} alle {self._stampato.strftime('%H:%M')}"
+                 f" - Pagina {pagina + 1} di {self.pagine}")
+        painter.drawText(QRectF(x0, area.bottom() - self._altezza_piede, area.width(), self._altezza_piede),
+                         Qt.AlignHCenter | Qt.AlignBottom, piede)
+
+    def _disegna_riga(self, painter, y: float, testi: List[str], sfondo: Optional[QColor] = None):
+        metriche = painter.fontMetrics()
+        x = self._area.left()
+        for (_, chiave), larghezza, testo in zip(self.colonne, self._larghezze, testi):
+            cella = QRectF(x, y, larghezza, self._altezza_riga)
+            if sfondo is not None:
+                painter.fillRect(cella, sfondo)
+            painter.setPen(QPen(self.COLORE_BORDO, 0))
+            painter.drawRect(cella)
+            painter.setPen(Qt.black)
+            allineamento = Qt.AlignHCenter if chiave in self.centrate and sfondo is None else Qt.AlignLeft
+            testo = metriche.elidedText(testo, Qt.ElideRight, int(larghezza - 2 * self._spazio))
+            painter.drawText(cella.adjusted(self._spazio, 0, -self._spazio, 0), allineamento | Qt.AlignVCenter, testo)
+            x += larghezza
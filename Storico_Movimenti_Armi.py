@@ -1,4 +1,3 @@
-import sqlite3
 from datetime import datetime
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
@@ -7,7 +6,8 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, QSize, QDate
 from PyQt5.QtGui import QFont, QIcon, QPixmap, QColor
-from PyQt5.QtPrintSupport import QPrintPreviewDialog, QPrinter
+
+from Database import ArmiRepository, TrasferimentiRepository
 
 
 class StoricoMovimentiArmaDialog(QDialog):
@@ -191,25 +191,15 @@ class StoricoMovimentiArmaDialog(QDialog):
     def load_arma_details(self):
         """Carica i dettagli dell'arma selezionata, gestendo anche le armi cancellate"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
+            trasferimenti_repo = TrasferimentiRepository()
+
+            # Lo stato della matricola (stato_armi) indica se l'arma è stata eliminata
+            stato = trasferimenti_repo.stato(self.matricola) if self.matricola else None
+            if stato:
+                self.is_deleted = stato[1] == 'ELIMINATA'
 
             if self.is_deleted and self.matricola:
-                cursor.execute("""
-                    SELECT t.MarcaArma, t.ModelloArma, t.Matricola, t.CalibroArma, t.TipoArma,
-                           t.Motivo_Trasferimento, t.Data_Trasferimento, t.Note, t.ID_Arma
-                    FROM trasferimenti t
-                    INNER JOIN (
-                        SELECT Matricola, MAX(Data_Trasferimento) as MaxData, MAX(Timestamp_Registrazione) as MaxTimestamp
-                        FROM trasferimenti
-                        WHERE Matricola = ? AND Motivo_Trasferimento = 'ELIMINAZIONE'
-                        GROUP BY Matricola
-                    ) latest ON t.Matricola = latest.Matricola 
-                        AND t.Data_Trasferimento = latest.MaxData
-                        AND t.Timestamp_Registrazione = latest.MaxTimestamp
-                    WHERE t.Matricola = ?
-                """, (self.matricola, self.matricola))
-                row_trasf = cursor.fetchone()
+                row_trasf = trasferimenti_repo.ultima_eliminazione(self.matricola)
                 if row_trasf:
                     self.arma_exists = False
                     self.id_arma = row_trasf[8]
@@ -233,18 +223,10 @@ class StoricoMovimentiArmaDialog(QDialog):
                     stato_text = f"ELIMINATA in data {self.arma_details['data_eliminazione']}"
                     self.statoArmaValue.setText(stato_text)
                     self.statoArmaValue.setStyleSheet("color: red; font-weight: bold;")
-                    conn.close()
                     return
 
             # Se l'arma non risulta cancellata, cerchiamo nella tabella armi
-            cursor.execute("""
-                SELECT a.MarcaArma, a.ModelloArma, a.Matricola, a.CalibroArma, a.TipoArma,
-                       d.Cognome, d.Nome, d.CodiceFiscale
-                FROM armi a
-                LEFT JOIN detentori d ON a.ID_Detentore = d.ID_Detentore
-                WHERE a.ID_ArmaDetenuta = ?
-            """, (self.id_arma,))
-            row = cursor.fetchone()
+            row = ArmiRepository().dettagli_con_detentore(self.id_arma)
             if row:
                 self.arma_exists = True
                 self.matricola = row[2] or ""
@@ -272,15 +254,7 @@ class StoricoMovimentiArmaDialog(QDialog):
             else:
                 # Se non trovata per ID, proviamo a cercare per matricola
                 if self.matricola:
-                    cursor.execute("""
-                        SELECT MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma, 
-                               Motivo_Trasferimento, Data_Trasferimento, Note, ID_Arma
-                        FROM trasferimenti
-                        WHERE Matricola = ? AND Motivo_Trasferimento = 'ELIMINAZIONE'
-                        ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
-                        LIMIT 1
-                    """, (self.matricola,))
-                    row_trasf = cursor.fetchone()
+                    row_trasf = trasferimenti_repo.ultima_eliminazione(self.matricola)
                     if row_trasf:
                         self.arma_exists = False
                         self.id_arma = row_trasf[8]
@@ -309,7 +283,6 @@ class StoricoMovimentiArmaDialog(QDialog):
                         QMessageBox.warning(self, "Arma non trovata",
                                             f"Non è stato possibile trovare l'arma con ID {self.id_arma} o matricola {self.matricola}.")
                         self.reject()
-            conn.close()
         except Exception as e:
             print(f"Errore nel caricamento dei dettagli dell'arma: {e}")
             QMessageBox.critical(self, "Errore", f"Impossibile caricare i dettagli dell'arma:\n{e}")
@@ -317,67 +290,12 @@ class StoricoMovimentiArmaDialog(QDialog):
     def load_data(self):
         """Carica i dati dei trasferimenti dalla tabella trasferimenti"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
             if self.matricola:
-                cursor.execute("""
-                    SELECT ID_Trasferimento, Data_Trasferimento, Motivo_Trasferimento,
-                           Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
-                           Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
-                           Note
-                    FROM trasferimenti
-                    WHERE Matricola = ?
-                    ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
-                """, (self.matricola,))
+                rows = TrasferimentiRepository().storico_per_matricola(self.matricola)
             else:
-                cursor.execute("""
-                    SELECT ID_Trasferimento, Data_Trasferimento, Motivo_Trasferimento,
-                           Cedente_Cognome, Cedente_Nome, Cedente_CodiceFiscale,
-                           Ricevente_Cognome, Ricevente_Nome, Ricevente_CodiceFiscale,
-                           Note
-                    FROM trasferimenti
-                    WHERE ID_Arma = ?
-                    ORDER BY Data_Trasferimento DESC, Timestamp_Registrazione DESC
-                """, (self.id_arma,))
-            rows = cursor.fetchall()
-            conn.close()
-
-            self.table.setRowCount(len(rows))
-            for row_idx, row in enumerate(rows):
-                id_item = QTableWidgetItem(str(row[0]))
-                id_item.setTextAlignment(Qt.AlignCenter)
-                self.table.setItem(row_idx, 0, id_item)
-
-                data_item = QTableWidgetItem(str(row[1] or ''))
-                data_item.setTextAlignment(Qt.AlignCenter)
-                self.table.setItem(row_idx, 1, data_item)
-
-                motivo_item = QTableWidgetItem(str(row[2] or ''))
-                motivo_item.setTextAlignment(Qt.AlignCenter)
-                if row[2] == "ELIMINAZIONE":
-                    motivo_item.setForeground(QColor(255, 0, 0))
-                    motivo_item.setFont(QFont("Arial", weight=QFont.Bold))
-                self.table.setItem(row_idx, 2, motivo_item)
-
-                cedente = f"{row[3] or ''} {row[4] or ''}".strip()
-                cedente_item = QTableWidgetItem(cedente)
-                self.table.setItem(row_idx, 3, cedente_item)
-
-                cf_cedente_item = QTableWidgetItem(str(row[5] or ''))
-                cf_cedente_item.setTextAlignment(Qt.AlignCenter)
-                self.table.setItem(row_idx, 4, cf_cedente_item)
-
-                ricevente = f"{row[6] or ''} {row[7] or ''}".strip()
-                ricevente_item = QTableWidgetItem(ricevente)
-                self.table.setItem(row_idx, 5, ricevente_item)
-
-                cf_ricevente_item = QTableWidgetItem(str(row[8] or ''))
-                cf_ricevente_item.setTextAlignment(Qt.AlignCenter)
-                self.table.setItem(row_idx, 6, cf_ricevente_item)
-
-                note_item = QTableWidgetItem(str(row[9] or ''))
-                self.table.setItem(row_idx, 7, note_item)
+                rows = TrasferimentiRepository().storico_per_arma(self.id_arma)
+
+            self.populate_table(rows)
 
             if len(rows) == 0:
                 QMessageBox.information(self, "Informazione",
@@ -386,64 +304,84 @@ class StoricoMovimentiArmaDialog(QDialog):
             print(f"Errore nel caricamento dei trasferimenti: {e}")
             QMessageBox.critical(self, "Errore", f"Impossibile caricare i dati dei trasferimenti:\n{e}")
 
+    def populate_table(self, rows):
+        """Riempie la tabella con le righe dello storico (colonne di storico_per_matricola)"""
+        self.table.setRowCount(len(rows))
+        for row_idx, row in enumerate(rows):
+            id_item = QTableWidgetItem(str(row[0]))
+            id_item.setTextAlignment(Qt.AlignCenter)
+            self.table.setItem(row_idx, 0, id_item)
+
+            data_item = QTableWidgetItem(str(row[1] or ''))
+            data_item.setTextAlignment(Qt.AlignCenter)
+            self.table.setItem(row_idx, 1, data_item)
+
+            motivo_item = QTableWidgetItem(str(row[2] or ''))
+            motivo_item.setTextAlignment(Qt.AlignCenter)
+            if row[2] == "ELIMINAZIONE":
+                motivo_item.setForeground(QColor(255, 0, 0))
+                motivo_item.setFont(QFont("Arial", weight=QFont.Bold))
+            self.table.setItem(row_idx, 2, motivo_item)
+
+            cedente = f"{row[3] or ''} {row[4] or ''}".strip()
+            cedente_item = QTableWidgetItem(cedente)
+            self.table.setItem(row_idx, 3, cedente_item)
+
+            cf_cedente_item = QTableWidgetItem(str(row[5] or ''))
+            cf_cedente_item.setTextAlignment(Qt.AlignCenter)
+            self.table.setItem(row_idx, 4, cf_cedente_item)
+
+            ricevente = f"{row[6] or ''} {row[7] or ''}".strip()
+            ricevente_item = QTableWidgetItem(ricevente)
+            self.table.setItem(row_idx, 5, ricevente_item)
+
+            cf_ricevente_item = QTableWidgetItem(str(row[8] or ''))
+            cf_ricevente_item.setTextAlignment(Qt.AlignCenter)
+            self.table.setItem(row_idx, 6, cf_ricevente_item)
+
+            note_item = QTableWidgetItem(str(row[9] or ''))
+            self.table.setItem(row_idx, 7, note_item)
 
     def apply_filters(self):
-        """Applica i filtri alla tabella"""
-        search_text = self.cercaInput.text().lower()
+        """Applica i filtri rileggendo lo storico dal database (date in formato yyyy-MM-dd)"""
         selected_motivo = self.motivoCombo.currentText()
-        data_iniziale = self.dataIniziale.date().toString("yyyy-MM-dd")
-        data_finale = self.dataFinale.date().toString("yyyy-MM-dd")
-
-        for row in range(self.table.rowCount()):
-            show_row = True
-
-            # Filtro per data
-            data_trasferimento = self.table.item(row, 1).text()
-            try:
-                # Converti la data dal formato visualizzato al formato per confronto
-                if data_trasferimento:
-                    # Assumi che il formato nella tabella possa essere dd/MM/yyyy o yyyy-MM-dd
-                    if "/" in data_trasferimento:
-                        parts = data_trasferimento.split('/')
-                        if len(parts) == 3:
-                            data_trasferimento = f"{parts[2]}-{parts[1]}-{parts[0]}"
-
-                    # Ora confronta
-                    if data_trasferimento < data_iniziale or data_trasferimento > data_finale:
-                        show_row = False
-            except:
-                # In caso di errore nel confronto date, mostra comunque la riga
-                pass
-
-            # Filtro per motivo
-            motivo = self.table.item(row, 2).text()
-            if selected_motivo != "Tutti" and motivo.upper() != selected_motivo.upper():
-                show_row = False
-
-            # Filtro per testo di ricerca
-            if search_text:
-                row_text = ""
-                for col in [3, 4, 5, 6, 7]:  # Colonne con testo da cercare
-                    row_text += self.table.item(row, col).text().lower() + " "
-
-                if search_text not in row_text:
-                    show_row = False
-
-            self.table.setRowHidden(row, not show_row)
+        try:
+            rows = TrasferimentiRepository().storico_filtrato(
+                matricola=self.matricola,
+                arma_id=self.id_arma,
+                data_da=self.dataIniziale.date().toString("yyyy-MM-dd"),
+                data_a=self.dataFinale.date().toString("yyyy-MM-dd"),
+                motivo=None if selected_motivo == "Tutti" else selected_motivo,
+                testo=self.cercaInput.text().strip() or None
+            )
+            self.populate_table(rows)
+        except Exception as e:
+            print(f"Errore nel filtraggio dei trasferimenti: {e}")
+            QMessageBox.critical(self, "Errore", f"Impossibile filtrare i trasferimenti:\n{e}")
 
     def reset_filters(self):
-        """Reimposta i filtri ai valori predefiniti"""
+        """Reimposta i filtri ai valori predefiniti e ricarica tutto lo storico"""
+        self.cercaInput.blockSignals(True)
         self.dataIniziale.setDate(QDate.currentDate().addYears(-10))
         self.dataFinale.setDate(QDate.currentDate())
         self.motivoCombo.setCurrentIndex(0)  # "Tutti"
         self.cercaInput.clear()
+        self.cercaInput.blockSignals(False)
 
-        # Mostra tutte le righe
-        for row in range(self.table.rowCount()):
-            self.table.setRowHidden(row, False)
+        try:
+            if self.matricola:
+                rows = TrasferimentiRepository().storico_per_matricola(self.matricola)
+            else:
+                rows = TrasferimentiRepository().storico_per_arma(self.id_arma)
+            self.populate_table(rows)
+        except Exception as e:
+            print(f"Errore nel caricamento dei trasferimenti: {e}")
+            QMessageBox.critical(self, "Errore", f"Impossibile caricare i dati dei trasferimenti:\n{e}")
 
     def print_report(self):
         """Visualizza l'anteprima di stampa del report"""
+        from PyQt5.QtPrintSupport import QPrintPreviewDialog, QPrinter
+
         printer = QPrinter(QPrinter.HighResolution)
         preview = QPrintPreviewDialog(printer, self)
         preview.paintRequested.connect(self.print_preview)
@@ -1,4 +1,3 @@
-import sqlite3
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit,
     QLabel, QPushButton, QComboBox, QMessageBox, QDateEdit,
@@ -7,6 +6,71 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import QDate, QDateTime, Qt, QSortFilterProxyModel, QStringListModel
 from Utility import convert_all_lineedits_to_uppercase
+from Database import DatabaseManager, TrasferimentiRepository
+
+
+# Campi logici usati dal trasferimento e possibili nomi delle colonne corrispondenti
+CAMPI_ARMA_TRASFERIMENTO = {
+    'TipoArma': ['TipoArma'],
+    'MarcaArma': ['MarcaArma'],
+    'ModelloArma': ['ModelloArma'],
+    'Matricola': ['Matricola'],
+    'CalibroArma': ['CalibroArma'],
+}
+
+CAMPI_DETENTORE_TRASFERIMENTO = {
+    'Cognome': ['Cognome'],
+    'Nome': ['Nome'],
+    'CodiceFiscale': ['CodiceFiscale', 'CodFiscale', 'CF'],
+    'DataNascita': ['DataNascita', 'DataDiNascita'],
+    'LuogoNascita': ['LuogoNascita', 'LuogoDiNascita'],
+    'SiglaProvinciaNascita': ['SiglaProvinciaNascita', 'ProvinciaNascita'],
+    'ComuneResidenza': ['ComuneResidenza', 'Comune'],
+    'SiglaProvinciaResidenza': ['SiglaProvinciaResidenza', 'ProvinciaResidenza', 'Provincia'],
+    'TipoViaResidenza': ['TipoViaResidenza', 'TipoVia'],
+    'IndirizzoResidenza': ['IndirizzoResidenza', 'Indirizzo', 'Via'],
+    'CivicoResidenza': ['CivicoResidenza', 'Civico', 'NumeroCivico'],
+    'Telefono': ['Telefono', 'Tel', 'Cellulare']
+}
+
+CAMPI_LISTA_DETENTORI = {
+    'ID_Detentore': ['ID_Detentore'],
+    'Cognome': ['Cognome'],
+    'Nome': ['Nome'],
+    'CodiceFiscale': ['CodiceFiscale', 'CodFiscale', 'CF'],
+}
+
+# Campi del detentore attuale -> colonne del cedente nella tabella armi
+CAMPI_CEDENTE_ARMA = {
+    'Cognome': ['CognomeCedente'],
+    'Nome': ['NomeCedente'],
+    'DataNascita': ['DataNascitaCedente'],
+    'LuogoNascita': ['LuogoNascitaCedente'],
+    'SiglaProvinciaNascita': ['SiglaProvinciaNascitaCedente'],
+    'ComuneResidenza': ['ComuneResidenzaCedente'],
+    'SiglaProvinciaResidenza': ['SiglaProvinciaResidenzaCedente'],
+    'TipoViaResidenza': ['TipoViaResidenzaCedente'],
+    'IndirizzoResidenza': ['IndirizzoResidenzaCedente'],
+    'CivicoResidenza': ['CivicoResidenzaCedente'],
+    'Telefono': ['TelefonoCedente']
+}
+
+# Statement del trasferimento, costruiti una volta dal catalogo dello schema e richiamati per nome
+STATEMENT_TRASFERIMENTO = {
+    "trasferimento.arma": lambda cat: cat.select(
+        "armi", CAMPI_ARMA_TRASFERIMENTO, "ID_ArmaDetenuta = ?"),
+    "trasferimento.detentore": lambda cat: cat.select(
+        "detentori", CAMPI_DETENTORE_TRASFERIMENTO, "ID_Detentore = ?"),
+    "trasferimento.altri_detentori": lambda cat: cat.select(
+        "detentori", CAMPI_LISTA_DETENTORI, "ID_Detentore != ?", order_by=["Cognome", "Nome"]),
+    "trasferimento.cedente": lambda cat: cat.update(
+        "armi", CAMPI_CEDENTE_ARMA, "ID_ArmaDetenuta = ?"),
+}
+
+
+def statement_trasferimento(nome):
+    """Restituisce uno statement del trasferimento dal catalogo condiviso."""
+    return DatabaseManager().catalogo().statement(nome, STATEMENT_TRASFERIMENTO[nome])
 
 
 class TransferimentoDialog(QDialog):
@@ -37,118 +101,32 @@ class TransferimentoDialog(QDialog):
     def load_arma_data(self):
         """Carica i dati dell'arma dal database"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Prima verifica che la colonna esista
-            cursor.execute("PRAGMA table_info(armi)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Costruisci la query dinamicamente in base alle colonne esistenti
-            query = "SELECT "
-            fields = []
-
-            if "TipoArma" in columns:
-                fields.append("TipoArma")
-            if "MarcaArma" in columns:
-                fields.append("MarcaArma")
-            if "ModelloArma" in columns:
-                fields.append("ModelloArma")
-            if "Matricola" in columns:
-                fields.append("Matricola")
-            if "CalibroArma" in columns:
-                fields.append("CalibroArma")
-
-            # Se non ci sono campi, usa un campo fittizio
-            if not fields:
-                query += "1"
-            else:
-                query += ", ".join(fields)
-
-            query += " FROM armi WHERE ID_ArmaDetenuta = ?"
-
-            cursor.execute(query, (self.arma_id,))
-
-            result = cursor.fetchone()
+            stmt = statement_trasferimento("trasferimento.arma")
+            result = DatabaseManager().fetchone(stmt.sql, (self.arma_id,))
             if result:
                 self.arma_data = {}
 
-                for i, field in enumerate(fields):
+                for i, field in enumerate(stmt.campi):
                     self.arma_data[field] = result[i] if result[i] else ''
             else:
                 print(f"Nessun dato trovato per l'arma con ID {self.arma_id}")
         except Exception as e:
             print(f"Errore nel caricamento dei dati dell'arma: {e}")
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def load_current_detentore_data(self):
         """Carica i dati del detentore attuale"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Prima ottieni la struttura della tabella detentori
-            cursor.execute("PRAGMA table_info(detentori)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Mappa i campi che ci servono ai nomi delle colonne reali
-            fields_mapping = {
-                'Cognome': ['Cognome'],
-                'Nome': ['Nome'],
-                'CodiceFiscale': ['CodiceFiscale', 'CodFiscale', 'CF'],
-                'DataNascita': ['DataNascita', 'DataDiNascita'],
-                'LuogoNascita': ['LuogoNascita', 'LuogoDiNascita'],
-                'SiglaProvinciaNascita': ['SiglaProvinciaNascita', 'ProvinciaNascita'],
-                'ComuneResidenza': ['ComuneResidenza', 'Comune'],
-                'SiglaProvinciaResidenza': ['SiglaProvinciaResidenza', 'ProvinciaResidenza', 'Provincia'],
-                'TipoViaResidenza': ['TipoViaResidenza', 'TipoVia'],
-                'IndirizzoResidenza': ['IndirizzoResidenza', 'Indirizzo', 'Via'],
-                'CivicoResidenza': ['CivicoResidenza', 'Civico', 'NumeroCivico'],
-                'Telefono': ['Telefono', 'Tel', 'Cellulare']
-            }
-
-            # Costruisci la query con le colonne che esistono realmente
-            query = "SELECT "
-            fields = []
-            field_names = []
-
-            for field, possible_columns in fields_mapping.items():
-                found = False
-                for col in possible_columns:
-                    if col in columns:
-                        fields.append(col)
-                        field_names.append(field)
-                        found = True
-                        break
-
-                if not found:
-                    print(f"Attenzione: nessuna colonna trovata per '{field}'")
-
-            # Se non ci sono campi, usa un campo fittizio
-            if not fields:
-                query += "1"
-            else:
-                query += ", ".join(fields)
-
-            query += " FROM detentori WHERE ID_Detentore = ?"
-
-            cursor.execute(query, (self.current_detentore,))
-
-            result = cursor.fetchone()
+            stmt = statement_trasferimento("trasferimento.detentore")
+            result = DatabaseManager().fetchone(stmt.sql, (self.current_detentore,))
             if result:
                 self.current_detentore_data = {}
 
-                for i, field in enumerate(field_names):
+                for i, field in enumerate(stmt.campi):
                     self.current_detentore_data[field] = result[i] if result[i] else ''
             else:
                 print(f"Nessun dato trovato per il detentore con ID {self.current_detentore}")
         except Exception as e:
             print(f"Errore nel caricamento dei dati del detentore: {e}")
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def _create_widgets(self):
         """Crea i widget per il trasferimento"""
@@ -361,46 +339,9 @@ class TransferimentoDialog(QDialog):
     def _load_detentori(self):
         """Carica tutti i detentori tranne quello attuale"""
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Prima ottieni la struttura della tabella detentori
-            cursor.execute("PRAGMA table_info(detentori)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Costruisci la query con le colonne che esistono realmente
-            query = "SELECT ID_Detentore"
-
-            if "Cognome" in columns:
-                query += ", Cognome"
-            if "Nome" in columns:
-                query += ", Nome"
-
-            # Aggiungi CodiceFiscale se esiste con vari nomi possibili
-            cf_column = None
-            for col in ["CodiceFiscale", "CodFiscale", "CF"]:
-                if col in columns:
-                    query += f", {col}"
-                    cf_column = col
-                    break
-
-            query += " FROM detentori WHERE ID_Detentore != ? ORDER BY "
-
-            # Ordina per Cognome e Nome se esistono
-            order_by = []
-            if "Cognome" in columns:
-                order_by.append("Cognome")
-            if "Nome" in columns:
-                order_by.append("Nome")
-
-            if order_by:
-                query += ", ".join(order_by)
-            else:
-                query += "ID_Detentore"  # Ordina per ID se non ci sono Cognome/Nome
-
-            cursor.execute(query, (self.current_detentore,))
-
-            detentori = cursor.fetchall()
+            stmt = statement_trasferimento("trasferimento.altri_detentori")
+            detentori = [dict(zip(stmt.campi, row))
+                         for row in DatabaseManager().fetchall(stmt.sql, (self.current_detentore,))]
 
             if not detentori:
                 QMessageBox.warning(self, "Nessun Detentore",
@@ -417,24 +358,14 @@ class TransferimentoDialog(QDialog):
             self.detentoriCombo.clear()
 
             for detentore in detentori:
-                id_detentore = detentore[0]
+                id_detentore = detentore['ID_Detentore']
 
                 # Prepara i dati con controllo di sicurezza
-                dati_detentore = {'Cognome': '', 'Nome': '', 'CodiceFiscale': ''}
-
-                # Popola i dati in base alle colonne restituite
-                col_index = 1  # Inizia da 1 perché l'indice 0 è ID_Detentore
-
-                if "Cognome" in columns and col_index < len(detentore):
-                    dati_detentore['Cognome'] = detentore[col_index] if detentore[col_index] else ''
-                    col_index += 1
-
-                if "Nome" in columns and col_index < len(detentore):
-                    dati_detentore['Nome'] = detentore[col_index] if detentore[col_index] else ''
-                    col_index += 1
-
-                if cf_column and col_index < len(detentore):
-                    dati_detentore['CodiceFiscale'] = detentore[col_index] if detentore[col_index] else ''
+                dati_detentore = {
+                    'Cognome': detentore.get('Cognome') or '',
+                    'Nome': detentore.get('Nome') or '',
+                    'CodiceFiscale': detentore.get('CodiceFiscale') or ''
+                }
 
                 self.detentori_id.append(id_detentore)
                 self.detentori_data[id_detentore] = dati_detentore
@@ -464,9 +395,6 @@ class TransferimentoDialog(QDialog):
             print(f"Errore nel caricamento dei detentori: {e}")
             QMessageBox.critical(self, "Errore", f"Errore nel caricamento dei detentori: {e}")
             self.reject()
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def update_cedente_data(self, nuovo_detentore_id):
         """Aggiorna i dati del cedente con i dati del detentore attuale"""
@@ -477,58 +405,22 @@ class TransferimentoDialog(QDialog):
             if not self.current_detentore_data:
                 return False
 
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Prima ottieni la struttura della tabella armi
-            cursor.execute("PRAGMA table_info(armi)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Mappa i campi del detentore ai campi dell'arma con possibili varianti
-            field_mapping = {
-                'Cognome': ['CognomeCedente'],
-                'Nome': ['NomeCedente'],
-                'DataNascita': ['DataNascitaCedente'],
-                'LuogoNascita': ['LuogoNascitaCedente'],
-                'SiglaProvinciaNascita': ['SiglaProvinciaNascitaCedente'],
-                'ComuneResidenza': ['ComuneResidenzaCedente'],
-                'SiglaProvinciaResidenza': ['SiglaProvinciaResidenzaCedente'],
-                'TipoViaResidenza': ['TipoViaResidenzaCedente'],
-                'IndirizzoResidenza': ['IndirizzoResidenzaCedente'],
-                'CivicoResidenza': ['CivicoResidenzaCedente'],
-                'Telefono': ['TelefonoCedente']
-            }
-
-            # Costruisci la query aggiornando solo i campi esistenti
-            query = "UPDATE armi SET "
-            update_fields = []
-            values = []
-
-            for detentore_field, arma_fields in field_mapping.items():
-                for arma_field in arma_fields:
-                    if arma_field in columns and detentore_field in self.current_detentore_data:
-                        update_fields.append(f"{arma_field} = ?")
-                        values.append(self.current_detentore_data.get(detentore_field, ''))
-                        break
-
-            if not update_fields:
+            # Aggiorna solo i campi del cedente esistenti nella tabella armi
+            stmt = statement_trasferimento("trasferimento.cedente")
+            if not stmt.campi:
                 print("Nessun campo da aggiornare")
                 return False
 
-            query += ", ".join(update_fields)
-            query += " WHERE ID_ArmaDetenuta = ?"
+            query = stmt.sql
+            values = [self.current_detentore_data.get(campo, '') for campo in stmt.campi]
             values.append(self.arma_id)
 
-            cursor.execute(query, values)
-            conn.commit()
+            DatabaseManager().esegui_scrittura(lambda conn: conn.execute(query, values))
             return True
 
         except Exception as e:
             print(f"Errore nell'aggiornamento dei dati del cedente: {e}")
             return False
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def get_detentore_esterno_data(self):
         """Restituisce i dati del detentore esterno inseriti manualmente"""
@@ -581,7 +473,8 @@ class TransferimentoDialog(QDialog):
                     QMessageBox.critical(self, "Errore", "ID detentore non valido.")
                     return
 
-                ricevente_data = self.detentori_data.get(nuovo_detentore_id, {})
+                # I dati del ricevente vengono letti dal database durante la registrazione
+                ricevente_data = None
             else:
                 # Detentore esterno
                 if not self.validate_detentore_esterno():
@@ -594,81 +487,21 @@ class TransferimentoDialog(QDialog):
             # Aggiorna i dati del cedente prima di trasferire l'arma
             self.update_cedente_data(nuovo_detentore_id)
 
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-
-            # Impostiamo esplicitamente il tipo di cedente a PERSONA FISICA quando trasferiamo armi tra detentori
-            if using_db_detentore:
-                try:
-                    # Imposta sempre il tipo cedente a PERSONA FISICA per i trasferimenti tra detentori del database
-                    cursor.execute("""
-                        UPDATE armi 
-                        SET TipoCedente = 'PERSONA FISICA'
-                        WHERE ID_ArmaDetenuta = ?
-                    """, (self.arma_id,))
-                    print("Tipo cedente aggiornato a PERSONA FISICA durante il trasferimento")
-                except Exception as e:
-                    print(f"Errore nell'aggiornamento del tipo cedente: {e}")
-
-            # Se stiamo trasferendo a un detentore interno, aggiorna il proprietario dell'arma
-            if using_db_detentore:
-                cursor.execute("""
-                    UPDATE armi
-                    SET ID_Detentore = ?
-                    WHERE ID_ArmaDetenuta = ?
-                """, (nuovo_detentore_id, self.arma_id))
-
             # Ottieni il timestamp corrente per la registrazione
             timestamp_registrazione = QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
 
-            # Verifica la struttura della tabella trasferimenti
-            cursor.execute("PRAGMA table_info(trasferimenti)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Costruisci la query di inserimento dinamicamente
-            query = "INSERT INTO trasferimenti ("
-            values_placeholder = ""
-            fields = []
-            values = []
-
-            # Mappa tra nomi alternativi di colonne e valori da inserire
-            fields_to_insert = {
-                'ID_Arma': self.arma_id,
-                'ID_Detentore_Cedente': self.current_detentore,
-                'ID_Detentore_Ricevente': nuovo_detentore_id if using_db_detentore else None,
-                'Data_Trasferimento': data_trasferimento,
-                'Motivo_Trasferimento': motivo,
-                'Note': note,
-                'Timestamp_Registrazione': timestamp_registrazione,
-                'MarcaArma': self.arma_data.get('MarcaArma', ''),
-                'ModelloArma': self.arma_data.get('ModelloArma', ''),
-                'Matricola': self.arma_data.get('Matricola', ''),
-                'CalibroArma': self.arma_data.get('CalibroArma', ''),
-                'TipoArma': self.arma_data.get('TipoArma', ''),
-                'Cedente_Cognome': self.current_detentore_data.get('Cognome', ''),
-                'Cedente_Nome': self.current_detentore_data.get('Nome', ''),
-                'Cedente_CodiceFiscale': self.current_detentore_data.get('CodiceFiscale', ''),
-                'Ricevente_Cognome': ricevente_data.get('Cognome', ''),
-                'Ricevente_Nome': ricevente_data.get('Nome', ''),
-                'Ricevente_CodiceFiscale': ricevente_data.get('CodiceFiscale', ''),
-                'ID_DetentorePrecedente': self.current_detentore,
-                'ID_NuovoDetentore': nuovo_detentore_id if using_db_detentore else None
-            }
-
-            # Aggiungi solo i campi che esistono nella tabella
-            for column_name in columns:
-                if column_name in fields_to_insert:
-                    fields.append(column_name)
-                    values.append(fields_to_insert[column_name])
-
-            if not fields:
-                raise Exception("Nessun campo valido trovato nella tabella trasferimenti")
-
-            query += ", ".join(fields)
-            query += ") VALUES (" + ", ".join(["?" for _ in fields]) + ")"
-
-            cursor.execute(query, values)
-            conn.commit()
+            # Snapshot di arma, cedente e ricevente, storico e cambio di detentore
+            # in un'unica transazione; il ricevente esterno resta con i dati inseriti
+            TrasferimentiRepository().registra_trasferimento(
+                self.arma_id,
+                self.current_detentore,
+                nuovo_detentore_id if using_db_detentore else None,
+                data_trasferimento,
+                motivo,
+                note,
+                timestamp_registrazione,
+                ricevente_esterno=ricevente_data
+            )
 
             # Messaggio di successo diverso in base al tipo di destinatario
             if using_db_detentore:
@@ -684,9 +517,6 @@ class TransferimentoDialog(QDialog):
         except Exception as e:
             print(f"Errore durante il trasferimento: {e}")
             QMessageBox.critical(self, "Errore", f"Errore durante il trasferimento: {e}")
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 
 if __name__ == "__main__":
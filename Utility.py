@@ -1,5 +1,43 @@
-from PyQt5.QtWidgets import QLineEdit, QCalendarWidget, QToolButton, QHBoxLayout, QWidget
-from PyQt5.QtCore import QDate, Qt, pyqtSignal, QRegExp
+from PyQt5.QtWidgets import QLineEdit, QCalendarWidget, QToolButton, QHBoxLayout, QWidget, QProgressDialog
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QDate, Qt, pyqtSignal, QRegExp, QEventLoop, QTimer, QStringListModel
+
+from Database import data_iso
+from ElencoComuni import ElencoComuni
+from IndiceTesto import IndiceTesto
+from CodiceFiscale import calcola_codice_fiscale, carattere_controllo
+
+
+def qdate_da_db(valore):
+    """QDate da una data salvata nel database (yyyy-MM-dd, accetta anche il vecchio dd/MM/yyyy)"""
+    return QDate.fromString(data_iso(valore), "yyyy-MM-dd")
+
+
+def qdate_per_db(data):
+    """Testo da salvare nel database per una QDate: yyyy-MM-dd, stringa vuota se non valida"""
+    return data.toString("yyyy-MM-dd") if data is not None and data.isValid() else ""
+
+
+def attendi_futuro(futuro, parent=None, messaggio="Caricamento in corso..."):
+    """
+    Restituisce il risultato di un Future (vedi Avvio.py). Se non è ancora pronto
+    mostra un indicatore di attesa e continua a gestire gli eventi dell'interfaccia.
+    """
+    if not futuro.done():
+        attesa = QProgressDialog(messaggio, None, 0, 0, parent)
+        attesa.setWindowModality(Qt.WindowModal)
+        attesa.setMinimumDuration(0)
+        ciclo = QEventLoop()
+        # Il Future si completa in un altro thread: lo si controlla dal thread dell'interfaccia
+        timer = QTimer()
+        timer.timeout.connect(lambda: futuro.done() and ciclo.quit())
+        timer.start(20)
+        attesa.show()
+        if not futuro.done():
+            ciclo.exec_()
+        timer.stop()
+        attesa.close()
+    return futuro.result()
 
 
 def convert_all_lineedits_to_uppercase(widget):
@@ -30,86 +68,30 @@ class UpperCaseLineEdit(QLineEdit):
             self.setText(upper_text)
             self.blockSignals(False)
 
-def get_sigla_provincia(comune, db_path="gestione_armi.db"):
-    import sqlite3
+def get_sigla_provincia(comune):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        comune = comune.upper()  # Assicurati che il comune sia in maiuscolo
-        cursor.execute("SELECT UPPER([Sigla automobilistica]) FROM comuni WHERE UPPER([Denominazione in italiano]) = ?", (comune,))
-        row = cursor.fetchone()
-        if row and row[0]:
-            return row[0]
-        else:
-            return ""
+        return ElencoComuni.condiviso().sigla_provincia(comune)
     except Exception as e:
         print("Errore in get_sigla_provincia:", e)
         return ""
-    finally:
-        conn.close()
 
-def compute_codice_fiscale(nome, cognome, data_nascita, sesso, comune_nascita, db_path="gestione_armi.db"):
+def compute_codice_fiscale(nome, cognome, data_nascita, sesso, comune_nascita):
     """
-    Calcola il codice fiscale completo (16 caratteri) in modo semplificato.
+    Calcola il codice fiscale completo (16 caratteri).
 
     - Per il cognome: estrae le prime tre consonanti (aggiungendo vocali e "X" se necessario).
     - Per il nome: se ha almeno 4 consonanti, usa la prima, la terza e la quarta; altrimenti come per il cognome.
-    - Per la data di nascita (formato DD/MM/YYYY):
+    - Per la data di nascita (formato DD/MM/YYYY o YYYY-MM-DD):
       * Prende gli ultimi due numeri dell'anno.
       * Per il mese usa il corrispondente codice lettera (A, B, C, ...).
       * Per il giorno, se il sesso è femminile, somma 40 al giorno.
-    - Recupera il codice catastale del comune dal database (dal campo [Codice Catastale del comune]).
+    - Recupera il codice catastale del comune dall'elenco dei comuni in memoria.
     - Calcola il carattere di controllo (check char) basandosi su tabelle di conversione per posizioni dispari e pari.
 
+    Il calcolo è in CodiceFiscale.calcola_codice_fiscale, che lavora anche su molti record alla volta.
     Restituisce il codice fiscale completo (senza eventuali spazi) in maiuscolo.
     """
-
-    def extract_letters(s, consonants=True):
-        s = s.upper()
-        if consonants:
-            return "".join([c for c in s if c.isalpha() and c not in "AEIOU"])
-        else:
-            return "".join([c for c in s if c in "AEIOU"])
-
-    # Calcola la parte del cognome
-    cons = extract_letters(cognome, consonants=True)
-    vowels = extract_letters(cognome, consonants=False)
-    cognome_code = (cons + vowels + "XXX")[:3]
-
-    # Calcola la parte del nome
-    cons = extract_letters(nome, consonants=True)
-    vowels = extract_letters(nome, consonants=False)
-    if len(cons) >= 4:
-        # Se il nome ha almeno 4 consonanti, usa la prima, la terza e la quarta
-        nome_code = cons[0] + cons[2] + cons[3]
-    else:
-        nome_code = (cons + vowels + "XXX")[:3]
-
-    # Estrai giorno, mese, anno dalla data (formato DD/MM/YYYY)
-    try:
-        day, month, year = data_nascita.split("/")
-        year_code = year[-2:]
-        day = int(day)
-        month = int(month)
-    except Exception as e:
-        raise ValueError("Formato data_nascita non valido. Usa DD/MM/YYYY.") from e
-
-    month_codes = {1: "A", 2: "B", 3: "C", 4: "D", 5: "E", 6: "H",
-                   7: "L", 8: "M", 9: "P", 10: "R", 11: "S", 12: "T"}
-    month_code = month_codes.get(month, "X")
-
-    # Se il sesso è femminile, aggiunge 40 al giorno
-    if sesso.upper() == "F":
-        day += 40
-    day_code = f"{day:02d}"
-
-    # Recupera il codice catastale del comune di nascita
-    codice_catastale = get_codice_catastale(comune_nascita, db_path=db_path)
-
-    # Codice fiscale parziale (15 caratteri)
-    cf_partial = (cognome_code + nome_code + year_code + month_code + day_code + codice_catastale).upper()
-    check_char = compute_check_char(cf_partial)
-    return cf_partial + check_char
+    return calcola_codice_fiscale(nome, cognome, data_nascita, sesso, comune_nascita)
 
 def compute_check_char(cf_partial):
     """
@@ -117,99 +99,92 @@ def compute_check_char(cf_partial):
     Utilizza due tabelle di conversione: una per i caratteri in posizione dispari e
     una per quelli in posizione pari.
     """
-    odd_table = {
-        '0': 1, '1': 0, '2': 5, '3': 7, '4': 9, '5': 13, '6': 15, '7': 17, '8': 19, '9': 21,
-        'A': 1, 'B': 0, 'C': 5, 'D': 7, 'E': 9, 'F': 13, 'G': 15, 'H': 17, 'I': 19, 'J': 21,
-        'K': 2, 'L': 4, 'M': 18, 'N': 20, 'O': 11, 'P': 3, 'Q': 6, 'R': 8, 'S': 12, 'T': 14,
-        'U': 16, 'V': 10, 'W': 22, 'X': 25, 'Y': 24, 'Z': 23
-    }
-    even_table = {
-        '0': 0, '1': 1, '2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9,
-        'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4, 'F': 5, 'G': 6, 'H': 7, 'I': 8, 'J': 9,
-        'K': 10, 'L': 11, 'M': 12, 'N': 13, 'O': 14, 'P': 15, 'Q': 16, 'R': 17, 'S': 18, 'T': 19,
-        'U': 20, 'V': 21, 'W': 22, 'X': 23, 'Y': 24, 'Z': 25
-    }
-    total = 0
-    for i, ch in enumerate(cf_partial):
-        # Le posizioni si contano a partire da 1
-        if (i + 1) % 2 == 1:  # posizione dispari
-            total += odd_table.get(ch, 0)
-        else:
-            total += even_table.get(ch, 0)
-    remainder = total % 26
-    # Il carattere di controllo: 0 -> A, 1 -> B, ..., 25 -> Z
-    return chr(remainder + ord('A'))
+    return carattere_controllo(cf_partial.upper())
 
-def get_codice_catastale(comune, db_path="gestione_armi.db"):
+def get_codice_catastale(comune):
     """
-    Recupera il "Codice Catastale del comune" dalla tabella comuni.
-    Si assume che il campo si chiami [Codice Catastale del comune].
+    Recupera il "Codice Catastale del comune" dall'elenco dei comuni in memoria.
     """
-    import sqlite3
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        comune = comune.upper()  # Assicurati che il comune sia in maiuscolo
-        cursor.execute(
-            "SELECT UPPER([Codice Catastale del comune]) FROM comuni WHERE UPPER([Denominazione in italiano]) = ?",
-            (comune,))
-        row = cursor.fetchone()
-        if row and row[0]:
-            return row[0]
-        else:
-            return ""
+        return ElencoComuni.condiviso().codice_catastale(comune)
     except Exception as e:
         print("Errore in get_codice_catastale:", e)
         return ""
-    finally:
-        conn.close()
-
-import sqlite3
-
-# Variabili globali per memorizzare i dati in cache
-_comuni_cache = None
-_province_cache = None
 
 def get_comuni():
-    """Restituisce la lista dei comuni usando una cache per evitare query ripetute"""
-    global _comuni_cache
-    if _comuni_cache is None:
-        try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute('SELECT [Denominazione in italiano] FROM comuni')
-            rows = cursor.fetchall()
-            # Supponiamo di non voler usare il primo record
-            _comuni_cache = [row[0].upper() for row in rows[1:] if row[0]]
-        except Exception as e:
-            print("Errore nel caricamento dei comuni:", e)
-            _comuni_cache = []
-        finally:
-            conn.close()
-    return _comuni_cache
+    """Restituisce la lista dei comuni dall'elenco in memoria (caricato una sola volta)"""
+    try:
+        return ElencoComuni.condiviso().comuni
+    except Exception as e:
+        print("Errore nel caricamento dei comuni:", e)
+        return []
 
 def get_province():
-    """Restituisce la lista delle province usando una cache per evitare query ripetute"""
-    global _province_cache
-    if _province_cache is None:
-        try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute('SELECT C15 FROM province')
-            rows = cursor.fetchall()
-            _province_cache = [row[0].upper() for row in rows if row[0]]
-        except Exception as e:
-            print("Errore nel caricamento delle province:", e)
-            _province_cache = []
-        finally:
-            conn.close()
-    return _province_cache
+    """Restituisce la lista delle province dall'elenco in memoria (caricato una sola volta)"""
+    try:
+        return ElencoComuni.condiviso().province
+    except Exception as e:
+        print("Errore nel caricamento delle province:", e)
+        return []
+
+def indice_comuni():
+    """Indice di ricerca dei comuni per le combo filtrabili (vedi IndiceTesto)"""
+    try:
+        return ElencoComuni.condiviso().indice_comuni
+    except Exception as e:
+        print("Errore nella costruzione dell'indice dei comuni:", e)
+        return IndiceTesto([])
+
+def indice_province():
+    """Indice di ricerca delle province per le combo filtrabili (vedi IndiceTesto)"""
+    try:
+        return ElencoComuni.condiviso().indice_province
+    except Exception as e:
+        print("Errore nella costruzione dell'indice delle province:", e)
+        return IndiceTesto([])
 
 def invalidate_cache():
-    """Invalida le cache, utile se i dati cambiano durante l'esecuzione"""
-    global _comuni_cache, _province_cache
-    _comuni_cache = None
-    _province_cache = None
+    """
+    Invalida l'elenco dei comuni se le tabelle comuni o province sono cambiate
+    durante l'esecuzione (la versione è mantenuta dai trigger del database)
+    e aggiorna i modelli condivisi, quindi tutte le combo che li usano
+    (le FilterableComboBox riprendono anche il nuovo indice di ricerca)
+    """
+    if ElencoComuni.invalida():
+        if "comuni" in _modelli_condivisi:
+            _modelli_condivisi["comuni"].setStringList(get_comuni())
+        if "province" in _modelli_condivisi:
+            _modelli_condivisi["province"].setStringList(get_province())
+
+
+class ModelloSolaLettura(QStringListModel):
+    """Modello di stringhe non modificabile dalle viste (può essere condiviso tra più widget)"""
+
+    def flags(self, index):
+        return super().flags(index) & ~Qt.ItemIsEditable
+
+
+# Modelli creati una sola volta per processo e condivisi da tutte le combo e i completer
+_modelli_condivisi = {}
+
+def _modello_condiviso(nome, elementi):
+    modello = _modelli_condivisi.get(nome)
+    if modello is None:
+        # Figlio dell'applicazione: vive nel thread dell'interfaccia fino all'uscita
+        modello = ModelloSolaLettura(elementi(), QApplication.instance())
+        _modelli_condivisi[nome] = modello
+    return modello
+
+def modello_comuni(comuni=None):
+    """
+    Modello condiviso con tutti i comuni. comuni (la lista già caricata, se c'è)
+    serve solo alla prima creazione, per non rileggere l'elenco.
+    """
+    return _modello_condiviso("comuni", lambda: comuni if comuni is not None else get_comuni())
+
+def modello_province(province=None):
+    """Modello condiviso con tutte le province (vedi modello_comuni)."""
+    return _modello_condiviso("province", lambda: province if province is not None else get_province())
 
 
 class DateInputWidget(QWidget):
@@ -0,0 +1,224 @@
+# benchmark_trasferimenti.py
+# Throughput della registrazione dei trasferimenti: trigger di snapshot
+# popolamento_dati_trasferimento (prima) contro lettura congiunta e singolo
+# inserimento di TrasferimentiRepository.scrivi_trasferimento (dopo).
+#
+# Lavora su copie temporanee del database, l'archivio originale non viene toccato.
+# Uso: python benchmark_trasferimenti.py [--db gestione_armi.db] [--trasferimenti 2000]
+#                                        [--armi 20000] [--storico 50000] > bench_output.txt
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+from Migrazioni import applica_migrazioni
+from Database import TrasferimentiRepository
+
+# Trigger ritirato dalla migrazione 6, ricreato sulla copia "prima"
+TRIGGER_SNAPSHOT = """
+CREATE TRIGGER popolamento_dati_trasferimento
+AFTER INSERT ON trasferimenti
+FOR EACH ROW
+BEGIN
+    UPDATE trasferimenti
+    SET
+        MarcaArma = (SELECT MarcaArma FROM armi WHERE ID_ArmaDetenuta = NEW.ID_Arma),
+        ModelloArma = (SELECT ModelloArma FROM armi WHERE ID_ArmaDetenuta = NEW.ID_Arma),
+        Matricola = (SELECT Matricola FROM armi WHERE ID_ArmaDetenuta = NEW.ID_Arma),
+        CalibroArma = (SELECT CalibroArma FROM armi WHERE ID_ArmaDetenuta = NEW.ID_Arma),
+        TipoArma = (SELECT TipoArma FROM armi WHERE ID_ArmaDetenuta = NEW.ID_Arma),
+        Cedente_Cognome = (SELECT Cognome FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Cedente),
+        Cedente_Nome = (SELECT Nome FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Cedente),
+        Cedente_CodiceFiscale = (SELECT CodiceFiscale FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Cedente),
+        Ricevente_Cognome = (SELECT Cognome FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Ricevente),
+        Ricevente_Nome = (SELECT Nome FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Ricevente),
+        Ricevente_CodiceFiscale = (SELECT CodiceFiscale FROM detentori WHERE ID_Detentore = NEW.ID_Detentore_Ricevente)
+    WHERE ID_Trasferimento = NEW.ID_Trasferimento;
+END
+"""
+
+# Scrittura del trasferimento com'era in TransferimentoDialog.save_transfer,
+# con lo snapshot letto all'apertura della finestra e poi riscritto dal trigger
+SQL_INSERISCI_PRIMA = TrasferimentiRepository.SQL_INSERISCI_TRASFERIMENTO
+SQL_CAMBIA_DETENTORE = TrasferimentiRepository.SQL_CAMBIA_DETENTORE
+
+QUOTA_RICEVENTI_ESTERNI = 0.1
+
+
+def popola(conn, num_detentori, num_armi, num_storico):
+    """Aggiunge detentori, armi e uno storico di trasferimenti sintetici."""
+    conn.execute("BEGIN")
+    primo_detentore = conn.execute("SELECT COALESCE(MAX(ID_Detentore), 0) FROM detentori").fetchone()[0] + 1
+    conn.executemany(
+        "INSERT INTO detentori (ID_Detentore, Cognome, Nome, CodiceFiscale) VALUES (?, ?, ?, ?)",
+        [(primo_detentore + i, f"COGNOME{i}", f"NOME{i}", f"CF{i:014d}") for i in range(num_detentori)])
+    detentori = list(range(primo_detentore, primo_detentore + num_detentori))
+
+    primo_arma = conn.execute("SELECT COALESCE(MAX(ID_ArmaDetenuta), 0) FROM armi").fetchone()[0] + 1
+    conn.executemany(
+        "INSERT INTO armi (ID_ArmaDetenuta, ID_Detentore, MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(primo_arma + i, random.choice(detentori), "BERETTA", f"MOD{i % 50}", f"BM{i:08d}", "9X21", "PISTOLA")
+         for i in range(num_armi)])
+    armi = list(range(primo_arma, primo_arma + num_armi))
+
+    conn.executemany("""
+        INSERT INTO trasferimenti
+        (ID_Arma, ID_Detentore_Cedente, ID_Detentore_Ricevente, Data_Trasferimento,
+         Motivo_Trasferimento, Note, Timestamp_Registrazione, Matricola)
+        VALUES (?, ?, ?, '2020-01-01', 'VENDITA', '', '2020-01-01 00:00:00', ?)
+    """, [(a, random.choice(detentori), random.choice(detentori), f"BM{a - primo_arma:08d}")
+          for a in random.choices(armi, k=num_storico)])
+    conn.execute("COMMIT")
+    return detentori, armi
+
+
+def sequenza(detentori, armi, num_trasferimenti):
+    """Trasferimenti da eseguire: (arma, ricevente o None se esterno)."""
+    casuale = random.Random(42)
+    return [(casuale.choice(armi),
+             None if casuale.random() < QUOTA_RICEVENTI_ESTERNI else casuale.choice(detentori))
+            for _ in range(num_trasferimenti)]
+
+
+RICEVENTE_ESTERNO = {'Cognome': 'ESTERNO', 'Nome': 'SOGGETTO', 'CodiceFiscale': 'XXXXXX00X00X000X'}
+
+
+def prepara_prima(conn, trasferimenti):
+    """
+    Dati che la finestra caricava all'apertura, prima della scrittura: restano
+    fuori dalla misura, che confronta solo le transazioni di registrazione.
+    """
+    detentore_di = dict(conn.execute("SELECT ID_ArmaDetenuta, ID_Detentore FROM armi"))
+    preparati = []
+    for arma_id, ricevente_id in trasferimenti:
+        cedente_id = detentore_di[arma_id]
+        arma = conn.execute("SELECT MarcaArma, ModelloArma, Matricola, CalibroArma, TipoArma "
+                            "FROM armi WHERE ID_ArmaDetenuta = ?", (arma_id,)).fetchone()
+        cedente = conn.execute("SELECT Cognome, Nome, CodiceFiscale FROM detentori WHERE ID_Detentore = ?",
+                               (cedente_id,)).fetchone()
+        if ricevente_id is None:
+            ricevente = tuple(RICEVENTE_ESTERNO.values())
+        else:
+            ricevente = conn.execute("SELECT Cognome, Nome, CodiceFiscale FROM detentori WHERE ID_Detentore = ?",
+                                     (ricevente_id,)).fetchone()
+            detentore_di[arma_id] = ricevente_id
+        preparati.append((arma_id, cedente_id, ricevente_id, arma, cedente, ricevente))
+    return preparati
+
+
+def esegui_prima(conn, preparati, unica):
+    for arma_id, cedente_id, ricevente_id, arma, cedente, ricevente in preparati:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        if ricevente_id is not None:
+            conn.execute(SQL_CAMBIA_DETENTORE, (ricevente_id, arma_id))
+        conn.execute(SQL_INSERISCI_PRIMA, (
+            arma_id, cedente_id, ricevente_id if ricevente_id is not None else -1,
+            '2025-01-01', 'VENDITA', '', '2025-01-01 12:00:00',
+            *arma, *cedente, *ricevente, cedente_id, ricevente_id))
+        if not unica:
+            conn.execute("COMMIT")
+
+
+def prepara_dopo(conn, trasferimenti):
+    """Solo il cedente di ogni trasferimento: arma e detentori li legge la registrazione."""
+    detentore_di = dict(conn.execute("SELECT ID_ArmaDetenuta, ID_Detentore FROM armi"))
+    preparati = []
+    for arma_id, ricevente_id in trasferimenti:
+        preparati.append((arma_id, detentore_di[arma_id], ricevente_id))
+        if ricevente_id is not None:
+            detentore_di[arma_id] = ricevente_id
+    return preparati
+
+
+def esegui_dopo(conn, preparati, unica):
+    for arma_id, cedente_id, ricevente_id in preparati:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        TrasferimentiRepository.scrivi_trasferimento(
+            conn, arma_id, cedente_id, ricevente_id, '2025-01-01', 'VENDITA', '', '2025-01-01 12:00:00',
+            ricevente_esterno=RICEVENTE_ESTERNO)
+        if not unica:
+            conn.execute("COMMIT")
+
+
+def misura(percorso, prepara, esegui, trasferimenti, unica):
+    """
+    Registra i trasferimenti e restituisce la durata e i riceventi esterni rimasti senza nome.
+    Con unica=True tutto avviene in una sola transazione, per escludere il costo dei commit.
+    """
+    conn = sqlite3.connect(percorso, isolation_level=None)
+    try:
+        preparati = prepara(conn, trasferimenti)
+        inizio = time.perf_counter()
+        esegui(conn, preparati, unica)
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+        durata = time.perf_counter() - inizio
+        esterni_senza_nome = conn.execute("""
+            SELECT COUNT(*) FROM trasferimenti
+            WHERE Timestamp_Registrazione = '2025-01-01 12:00:00'
+              AND ID_Detentore_Ricevente = -1 AND Ricevente_Cognome IS NULL
+        """).fetchone()[0]
+    finally:
+        conn.close()
+    return durata, esterni_senza_nome
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della registrazione dei trasferimenti")
+    parser.add_argument("--db", default="gestione_armi.db", help="Database di partenza (viene copiato)")
+    parser.add_argument("--trasferimenti", type=int, default=2000, help="Trasferimenti da registrare")
+    parser.add_argument("--detentori", type=int, default=2000, help="Detentori sintetici da aggiungere")
+    parser.add_argument("--armi", type=int, default=20000, help="Armi sintetiche da aggiungere")
+    parser.add_argument("--storico", type=int, default=50000, help="Trasferimenti pregressi da aggiungere")
+    args = parser.parse_args()
+
+    random.seed(1)
+    cartella = tempfile.mkdtemp(prefix="bench_trasferimenti_")
+    try:
+        base = os.path.join(cartella, "base.db")
+        shutil.copyfile(args.db, base)
+        conn = sqlite3.connect(base, isolation_level=None)
+        applica_migrazioni(conn)
+        detentori, armi = popola(conn, args.detentori, args.armi, args.storico)
+        conn.execute("ANALYZE")
+        conn.close()
+
+        trasferimenti = sequenza(detentori, armi, args.trasferimenti)
+        print(f"SQLite {sqlite3.sqlite_version}, {len(trasferimenti)} trasferimenti "
+              f"({sum(1 for _, r in trasferimenti if r is None)} a riceventi esterni), "
+              f"{args.armi} armi, {args.storico} trasferimenti pregressi")
+
+        for unica, titolo in ((False, "Un commit per trasferimento (come l'applicazione)"),
+                              (True, "Transazione unica (solo il costo delle istruzioni)")):
+            print(f"\n{titolo}")
+            durate = []
+            for nome, prepara, esegui, trigger in (
+                    ("prima (trigger)", prepara_prima, esegui_prima, True),
+                    ("dopo (lettura congiunta)", prepara_dopo, esegui_dopo, False)):
+                # Ogni misura parte da una copia nuova dello stesso database
+                percorso = os.path.join(cartella, "misura.db")
+                shutil.copyfile(base, percorso)
+                if trigger:
+                    with sqlite3.connect(percorso) as conn:
+                        conn.execute(TRIGGER_SNAPSHOT)
+                    conn.close()
+                durata, esterni_senza_nome = misura(percorso, prepara, esegui, trasferimenti, unica)
+                durate.append(durata)
+                print(f"  {nome:26s} {len(trasferimenti) / durata:9.0f} trasferimenti/s  "
+                      f"{durata / len(trasferimenti) * 1000:7.3f} ms/trasferimento  "
+                      f"riceventi esterni senza nome: {esterni_senza_nome}")
+            print(f"  Accelerazione: {durate[0] / durate[1]:.2f}x")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
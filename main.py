@@ -1,12 +1,17 @@
+import time
+# Riferimento per il tempo alla prima visualizzazione (import compresi)
+INIZIO_PROCESSO = time.perf_counter()
+
 import sys
+import logging
 import traceback
-import sqlite3
+from bisect import bisect_left, bisect_right
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QDialog, QListWidget,
     QHBoxLayout, QMessageBox, QLineEdit, QTableWidget, QTableWidgetItem, QComboBox,
     QCompleter, QLabel, QStyleFactory
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont, QIcon
 
 try:
@@ -15,7 +20,16 @@ except Exception as e:
     print(f"Errore nell'importare InserisciDetentoreDialog: {e}")
 
 # Importa le funzioni per la cache
-from Utility import get_comuni, get_province
+from Utility import get_comuni, get_province, attendi_futuro
+from Database import DatabaseManager, DetentoriRepository, CAMPI_LISTA_DETENTORE
+from Avvio import avvia_caricamenti
+from NotificheModifiche import bus_modifiche
+
+
+def chiave_nome(detentore):
+    """Chiave dell'ordine della lista (cognome, nome) per una tupla (id, nome, cognome)"""
+    _, nome, cognome = detentore
+    return (cognome or "", nome or "")
 
 
 # Dialog per visualizzare la lista dei Detentori
@@ -25,6 +39,10 @@ class DetentoriListDialog(QDialog):
         self.setWindowTitle("Lista Detentori")
         self.setMinimumWidth(400)
         self.detentori = []
+        # chiave_nome di ogni detentore, parallela a self.detentori, e per ID:
+        # le righe da aggiornare si trovano con bisect
+        self.chiavi = []
+        self.chiavi_per_id = {}
 
         # --- MODIFICA: Memorizza le liste ---
         self.comuni_list = comuni_list
@@ -32,6 +50,8 @@ class DetentoriListDialog(QDialog):
         # ------------------------------------
 
         self.initUI()
+        # Le modifiche ai detentori (anche di altre postazioni) aggiornano solo le loro righe
+        bus_modifiche().modifiche.connect(self.applica_modifiche)
         self.load_detentori_from_db()
         self.refreshList()
 
@@ -58,33 +78,86 @@ class DetentoriListDialog(QDialog):
 
     def load_detentori_from_db(self):
         try:
-            conn = sqlite3.connect("gestione_armi.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM detentori")
-            rows = cursor.fetchall()
-            conn.close()
-            # Ordine dei campi deve corrispondere al database
-            columns = ["id", "nome", "cognome", "fascicoloPersonale", "dataNascita", "luogoNascita",
-                       "siglaProvinciaNascita", "sesso", "codiceFiscale", "comuneResidenza", "siglaProvinciaResidenza",
-                       "tipoVia", "via", "civico", "telefono", "tipologiaTitolo", "enteRilascio",
-                       "provinciaEnteRilascio", "dataRilascio", "numeroPortoArmi", "tipoLuogoDetenzione",
-                       "comuneDetenzione", "siglaProvinciaDetenzione", "tipoViaDetenzione", "viaDetenzione",
-                       "civicoDetenzione", "tipoDocumento", "numeroDocumento", "dataRilascioDocumento",
-                       "enteRilascioDocumento", "comuneEnteRilascioDocumento"]
-            self.detentori = [dict(zip(columns, row)) for row in rows]
+            # Solo (ID, nome, cognome): il record completo si legge quando si apre la modifica
+            colonne = dict(zip((chiave for _, chiave in CAMPI_LISTA_DETENTORE),
+                               DetentoriRepository().lista_colonne()))
+            self.detentori = list(zip(colonne['id'], colonne['nome'], colonne['cognome']))
+            self.chiavi = [chiave_nome(d) for d in self.detentori]
+            self.chiavi_per_id = {d[0]: chiave for d, chiave in zip(self.detentori, self.chiavi)}
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nel caricamento dei detentori:\n{e}")
 
+    def applica_modifiche(self, modifiche):
+        """Inserisce, aggiorna o toglie le sole righe dei detentori modificati"""
+        if modifiche.ricarica:
+            self.load_detentori_from_db()
+            self.refreshList()
+            return
+        # La lista mostra solo nome e cognome: le modifiche alle armi non la cambiano
+        ids = modifiche.ids("detentori")
+        if not ids:
+            return
+        try:
+            colonne = dict(zip((chiave for _, chiave in CAMPI_LISTA_DETENTORE),
+                               DetentoriRepository().lista_colonne(ids=ids)))
+        except Exception as e:
+            print(f"Errore nell'aggiornamento dei detentori modificati: {e}")
+            return
+        letti = {d[0]: d for d in zip(colonne['id'], colonne['nome'], colonne['cognome'])}
+        for id_detentore in ids:
+            riga = self.findRow(id_detentore)
+            nuovo = letti.get(id_detentore)
+            if riga is not None and nuovo is not None and chiave_nome(nuovo) == self.chiavi[riga]:
+                self.detentori[riga] = nuovo
+                self.listWidget.item(riga).setText(f"{nuovo[1]} {nuovo[2]}")
+                continue
+            if riga is not None:
+                del self.detentori[riga]
+                del self.chiavi[riga]
+                del self.chiavi_per_id[id_detentore]
+                self.listWidget.takeItem(riga)
+            if nuovo is not None:
+                chiave = chiave_nome(nuovo)
+                riga = bisect_right(self.chiavi, chiave)
+                self.detentori.insert(riga, nuovo)
+                self.chiavi.insert(riga, chiave)
+                self.chiavi_per_id[id_detentore] = chiave
+                self.listWidget.insertItem(riga, f"{nuovo[1]} {nuovo[2]}")
+
+    def findRow(self, id_detentore):
+        """Riga del detentore nella lista (None se non c'è), cercata tra quelli con lo stesso nome"""
+        chiave = self.chiavi_per_id.get(id_detentore)
+        if chiave is None:
+            return None
+        for riga in range(bisect_left(self.chiavi, chiave), bisect_right(self.chiavi, chiave)):
+            if self.detentori[riga][0] == id_detentore:
+                return riga
+        return None
+
+    def done(self, result):
+        # La finestra chiusa non segue più le modifiche
+        try:
+            bus_modifiche().modifiche.disconnect(self.applica_modifiche)
+        except TypeError:
+            pass
+        super().done(result)
+
     def refreshList(self):
         self.listWidget.clear()
-        for det in self.detentori:
-            self.listWidget.addItem(f"{det['nome']} {det['cognome']}")
+        self.listWidget.addItems([f"{nome} {cognome}" for _, nome, cognome in self.detentori])
+
+    def loadDetentore(self, index):
+        """Record completo del detentore alla riga indicata della lista"""
+        try:
+            return DetentoriRepository().get(self.detentori[index][0])
+        except Exception as e:
+            QMessageBox.critical(self, "Errore", f"Errore nel caricamento del detentore:\n{e}")
+            return None
 
     def getSelectedDetentore(self):
         selected_items = self.listWidget.selectedItems()
         if selected_items:
-            index = self.listWidget.row(selected_items[0])
-            return self.detentori[index]
+            return self.loadDetentore(self.listWidget.row(selected_items[0]))
         return None
 
     def newDetentore(self):
@@ -95,9 +168,7 @@ class DetentoriListDialog(QDialog):
                 province=self.province_list
             )
             # --------------------------------
-            if dialog.exec_() == QDialog.Accepted:
-                self.load_detentori_from_db()
-                self.refreshList()
+            dialog.exec_()
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nell'aprire il form di inserimento:\n{e}")
 
@@ -112,9 +183,7 @@ class DetentoriListDialog(QDialog):
                     province=self.province_list
                 )
                 # --------------------------------
-                if dialog.exec_() == QDialog.Accepted:
-                    self.load_detentori_from_db()
-                    self.refreshList()
+                dialog.exec_()
             except Exception as e:
                 QMessageBox.critical(self, "Errore", f"Errore nell'aprire il form di modifica:\n{e}")
 
@@ -130,19 +199,14 @@ class DetentoriListDialog(QDialog):
             )
             if reply == QMessageBox.Yes:
                 try:
-                    conn = sqlite3.connect("gestione_armi.db")
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM detentori WHERE ID_Detentore = ?", (selected['id'],))
-                    conn.commit()
-                    conn.close()
-                    self.load_detentori_from_db()
-                    self.refreshList()
+                    DetentoriRepository().elimina(selected['id'])
                 except Exception as e:
                     QMessageBox.critical(self, "Errore", f"Impossibile eliminare il detentore:\n{e}")
 
     def editDetentore(self, item):
-        index = self.listWidget.row(item)
-        det = self.detentori[index]
+        det = self.loadDetentore(self.listWidget.row(item))
+        if det is None:
+            return
         try:
             # --- MODIFICA: Passa le liste ---
             dialog = InserisciDetentoreDialog(
@@ -151,21 +215,20 @@ class DetentoriListDialog(QDialog):
                 province=self.province_list
             )
             # --------------------------------
-            if dialog.exec_() == QDialog.Accepted:
-                self.load_detentori_from_db()
-                self.refreshList()
+            dialog.exec_()
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore nell'aprire il form di modifica:\n{e}")
 
 
 # Finestra principale
 class MainWindow(QMainWindow):
-    def __init__(self, comuni_list, province_list): # <-- Aggiungi argomenti
+    def __init__(self, comuni_list=None, province_list=None, avvio=None):
         super().__init__()
-        # --- MODIFICA: Memorizza le liste ---
+        # Liste dei comuni e delle province: se non fornite arrivano dal caricamento di avvio
         self.comuni_list = comuni_list
         self.province_list = province_list
-        # ------------------------------------
+        self.avvio = avvio
+        self.primo_disegno = False
         self.setWindowTitle("Gestione Armi - Programma Principale")
         self.resize(600, 400)
         self.setup_ui()
@@ -206,12 +269,49 @@ class MainWindow(QMainWindow):
         self.btn_detentori.clicked.connect(self.open_detentori)
         self.btn_storico.clicked.connect(self.open_ricerca_storico)
 
+        # Barra di stato con i tempi di attesa delle scritture (utile in modalità multi-postazione)
+        self.db_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.db_status_label)
+        self.metriche_timer = QTimer(self)
+        self.metriche_timer.timeout.connect(self.update_db_status)
+        self.metriche_timer.start(5000)
+        self.update_db_status()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.primo_disegno:
+            self.primo_disegno = True
+            print(f"Finestra principale visualizzata dopo {(time.perf_counter() - INIZIO_PROCESSO) * 1000:.0f} ms")
+
+    def dati_riferimento(self):
+        """Comuni e province, attendendo il caricamento di avvio se non è ancora concluso"""
+        if self.comuni_list is None:
+            futuro = self.avvio.futuro("riferimenti") if self.avvio else None
+            try:
+                if futuro is None:
+                    raise RuntimeError("caricamento di avvio non disponibile")
+                elenco = attendi_futuro(futuro, self, "Caricamento di comuni e province...")
+                self.comuni_list, self.province_list = elenco.comuni, elenco.province
+            except Exception as e:
+                print(f"Dati di riferimento non disponibili dal caricamento di avvio ({e}), lettura diretta")
+                self.comuni_list, self.province_list = get_comuni(), get_province()
+        return self.comuni_list, self.province_list
+
+    def update_db_status(self):
+        # Il database si apre (e si aggiorna con le migrazioni) nel caricamento "catalogo":
+        # fino ad allora la finestra non lo tocca
+        futuro = self.avvio.futuro("catalogo") if self.avvio else None
+        if futuro is not None and not futuro.done():
+            self.db_status_label.setText("Apertura del database in corso...")
+            return
+        db = DatabaseManager()
+        modalita = "Multi-postazione (WAL)" if db.concorrente else "Postazione singola"
+        self.db_status_label.setText(f"{modalita} | {db.metriche_scritture.testo_stato()}")
+
     def open_detentori(self):
         try:
-            # --- MODIFICA: Passa le liste ---
-            # Se DetentoriListDialog è qui, altrimenti devi trovarlo
-            dialog = DetentoriListDialog(self.comuni_list, self.province_list)
-            # --------------------------------
+            comuni, province = self.dati_riferimento()
+            dialog = DetentoriListDialog(comuni, province)
             dialog.exec_()
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Errore durante l'apertura della gestione detentori:\n{e}")
@@ -229,21 +329,24 @@ class MainWindow(QMainWindow):
 
 if __name__ == "__main__":
     try:
+        # Una sola configurazione per tutta l'applicazione: i tempi di caricamento
+        # e gli avvisi dei moduli (livello INFO) finiscono sulla console
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         print("Avvio dell'applicazione...")
         app = QApplication(sys.argv)
         app.setStyle(QStyleFactory.create("Fusion"))
+        # Chiude le connessioni condivise all'uscita
+        app.aboutToQuit.connect(DatabaseManager().close_all)
 
-        # --- MODIFICA: Carica i dati QUI ---
-        print("Caricamento dati statici...")
-        comuni = get_comuni()
-        province = get_province()
-        print("Caricati", len(comuni), "comuni e", len(province), "province.")
-        # -----------------------------------
+        # Dati di riferimento, marche e catalogo dello schema vengono caricati
+        # in background: la finestra si mostra subito
+        print("Avvio del caricamento dei dati statici in background...")
+        avvio = avvia_caricamenti()
+        app.aboutToQuit.connect(avvio.chiudi)
 
         print("Creazione della finestra principale...")
-        # --- MODIFICA: Passa le liste a MainWindow ---
-        window = MainWindow(comuni, province)
-        # -------------------------------------------
+        window = MainWindow(avvio=avvio)
         print("Visualizzazione della finestra principale...")
         window.show()
 
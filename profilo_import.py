@@ -0,0 +1,83 @@
+# profilo_import.py
+# Tempo di import dell'avvio modulo per modulo (python -X importtime) e controllo
+# che i sottosistemi pesanti (documenti Word, stampa) non vengano caricati all'avvio.
+#
+# Uso: python profilo_import.py [--modulo main] [--primi 25] [--budget-ms 1500] > import_output.txt
+# Esce con codice 1 se il budget è superato o un modulo differito viene importato all'avvio.
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Moduli che devono essere importati solo al primo utilizzo
+MODULI_DIFFERITI = ("GeneraDenuncia", "docxtpl", "jinja2", "docx", "PyQt5.QtPrintSupport")
+
+_RIGA = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+def misura(modulo):
+    """
+    Importa il modulo in un interprete nuovo con -X importtime.
+
+    Returns:
+        (lista di (nome, profondità, self ms, cumulativo ms), stderr se l'import è fallito o None)
+    """
+    cartella = os.path.dirname(os.path.abspath(__file__))
+    processo = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                              cwd=cartella, capture_output=True, text=True)
+    voci = []
+    for riga in processo.stderr.splitlines():
+        trovata = _RIGA.match(riga)
+        if trovata:
+            proprio, cumulativo, rientro, nome = trovata.groups()
+            voci.append((nome, (len(rientro) - 1) // 2, int(proprio) / 1000, int(cumulativo) / 1000))
+    return voci, (processo.stderr if processo.returncode != 0 else None)
+
+
+def moduli_progetto():
+    cartella = os.path.dirname(os.path.abspath(__file__))
+    return {nome[:-3] for nome in os.listdir(cartella) if nome.endswith(".py")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profilo dei tempi di import all'avvio")
+    parser.add_argument("--modulo", default="main", help="Modulo da importare (predefinito: main)")
+    parser.add_argument("--primi", type=int, default=25, help="Numero di moduli più lenti da elencare")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Tempo massimo di import consentito")
+    args = parser.parse_args()
+
+    voci, errore = misura(args.modulo)
+    if errore:
+        print(f"Import di {args.modulo} fallito:\n{errore.strip().splitlines()[-1]}")
+        return 2
+
+    totale = next((cumulativo for nome, profondita, _, cumulativo in reversed(voci)
+                   if nome == args.modulo and profondita == 0), 0.0)
+    print(f"Import di {args.modulo}: {totale:.1f} ms cumulativi, {len(voci)} moduli")
+
+    print(f"\nModuli più lenti (cumulativo, figli compresi)")
+    for nome, _, proprio, cumulativo in sorted(voci, key=lambda v: v[3], reverse=True)[:args.primi]:
+        print(f"  {cumulativo:9.1f} ms  {proprio:8.1f} ms propri  {nome}")
+
+    progetto = moduli_progetto()
+    print(f"\nModuli del progetto")
+    for nome, _, proprio, cumulativo in sorted((v for v in voci if v[0] in progetto),
+                                               key=lambda v: v[3], reverse=True):
+        print(f"  {cumulativo:9.1f} ms  {proprio:8.1f} ms propri  {nome}")
+
+    esito = 0
+    caricati = sorted({nome for nome, _, _, _ in voci
+                       if any(nome == m or nome.startswith(m + ".") for m in MODULI_DIFFERITI)})
+    if caricati:
+        print(f"\nERRORE: moduli da caricare al primo utilizzo importati all'avvio: {', '.join(caricati)}")
+        esito = 1
+    if args.budget_ms is not None and totale > args.budget_ms:
+        print(f"\nERRORE: import di {totale:.1f} ms oltre il budget di {args.budget_ms:.0f} ms")
+        esito = 1
+    return esito
+
+
+if __name__ == "__main__":
+    sys.exit(main())